@@ -1,29 +1,80 @@
 import datetime
+import hashlib
+import hmac
 import json
-from dataclasses import asdict
-from functools import cache
-from typing import Annotated, Literal, Optional, Union
-
-from fastapi import Depends, FastAPI, Header, Path, Request, status
+import math
+import os
+from contextlib import asynccontextmanager
+from dataclasses import asdict, replace
+from functools import cache, partial
+from typing import Annotated, Literal, Optional, Tuple, Union
+
+from fastapi import (
+    BackgroundTasks,
+    Depends,
+    FastAPI,
+    Header,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    status,
+)
 from fastapi.responses import PlainTextResponse
 from jinja2 import FileSystemLoader
 from pydantic_settings import BaseSettings
+from starlette.concurrency import run_in_threadpool
 from tinydb import TinyDB
 
 from doveseed import __version__
-from doveseed.config import Config, SmtpConfig, TemplateVarsConfig
+from doveseed.config import (
+    BatchDeliveryConfig,
+    BouncesConfig,
+    Config,
+    DaemonConfig,
+    DigestConfig,
+    FeedConfig,
+    LookupFilterConfig,
+    RateLimitConfig,
+    RetryConfig,
+    SeenItemsConfig,
+    SmtpConfig,
+    TemplateVarsConfig,
+    ThrottleConfig,
+    WebhookConfig,
+)
 
+from .cli import process_feed, run_exclusively
+from .client_address import TrustedProxies
 from .confirmation import EmailConfirmationRequester
-from .domain_types import Email, Token
+from .daemon import CoalescingRunner
+from .deadline import Deadline, DeadlineExceeded
+from .domain_types import Action, Email, Token
+from .email_notification import EmailNotifier
 from .email_templating import EmailFromTemplateProvider, FileSystemBinaryLoader
+from .locking import FileLock
+from .lookup_filter import FilteredStorage
+from .rate_limit import (
+    BucketStore,
+    MemoryBucketStore,
+    RateLimiter,
+    RateLimitExceeded,
+    SqliteBucketStore,
+)
 from .registration import (
     ConfirmationRequester,
     RegistrationService,
     UnauthorizedException,
 )
-from .smtp import ConnectionManager, noop_connection, smtp_connection
+from .smtp import (
+    ConnectionManager,
+    DeadlineConnectionManager,
+    noop_connection,
+    smtp_connection,
+)
 from .storage import TinyDbStorage
-from .token_gen import gen_secure_token
+from .throttle import DomainScheduler
+from .token_gen import TokenSigner, UnsubscribeTokenSigner, gen_secure_token
 
 
 class Settings(BaseSettings):
@@ -38,16 +89,83 @@ def get_config() -> Config:
         config = json.load(f)
         if config.get("smtp", None):
             config["smtp"] = SmtpConfig(**config["smtp"])
+        if "retry" in config:
+            config["retry"] = RetryConfig(**config["retry"])
+        if config.get("digest", None):
+            config["digest"] = DigestConfig(**config["digest"])
+        if config.get("batch_delivery", None) is not None:
+            config["batch_delivery"] = BatchDeliveryConfig(**config["batch_delivery"])
+        if config.get("throttle", None) is not None:
+            config["throttle"] = ThrottleConfig(**config["throttle"])
+        if "seen_items" in config:
+            config["seen_items"] = SeenItemsConfig(**config["seen_items"])
+        if "daemon" in config:
+            config["daemon"] = DaemonConfig(**config["daemon"])
+        if config.get("webhook", None):
+            config["webhook"] = WebhookConfig(**config["webhook"])
+        if config.get("lookup_filter", None) is not None:
+            config["lookup_filter"] = LookupFilterConfig(**config["lookup_filter"])
+        if config.get("rate_limit", None) is not None:
+            rate_limit = config["rate_limit"]
+            rate_limit["trusted_proxies"] = tuple(rate_limit.get("trusted_proxies", ()))
+            config["rate_limit"] = RateLimitConfig(**rate_limit)
+        if "bounces" in config:
+            config["bounces"] = BouncesConfig(**config["bounces"])
+        if "feeds" in config:
+            config["feeds"] = {
+                name: _parse_feed_config(feed_config)
+                for name, feed_config in config["feeds"].items()
+            }
         return Config(
             template_vars=TemplateVarsConfig(**config.pop("template_vars")), **config
         )
 
 
+def _parse_feed_config(feed_config: dict) -> FeedConfig:
+    if feed_config.get("template_vars", None):
+        feed_config["template_vars"] = TemplateVarsConfig(
+            **feed_config["template_vars"]
+        )
+    return FeedConfig(**feed_config)
+
+
 ConfigDependency = Annotated[Config, Depends(get_config)]
 
 
+class UnknownFeedException(LookupError):
+    pass
+
+
+def get_feed_config(
+    config: ConfigDependency,
+    feed: Annotated[
+        Optional[str],
+        Query(
+            description="Name of the feed to operate on (default: the primary feed).",
+            examples=["blog"],
+        ),
+    ] = None,
+) -> Config:
+    if feed is None:
+        return config
+    if feed not in config.feeds:
+        raise UnknownFeedException(f"Unknown feed '{feed}'.")
+    feed_config = config.feeds[feed]
+    return replace(
+        config,
+        db=feed_config.db,
+        rss=feed_config.rss,
+        template_vars=feed_config.template_vars or config.template_vars,
+        email_templates=feed_config.email_templates or config.email_templates,
+        feeds={},
+    )
+
+
+FeedConfigDependency = Annotated[Config, Depends(get_feed_config)]
+
+
 @cache
-def get_db(config: ConfigDependency):
+def get_db(config: FeedConfigDependency):
     return TinyDB(config.db)
 
 
@@ -60,41 +178,214 @@ def get_connection(config: ConfigDependency):
     )
 
 
+def _get_unsubscribe_signer(config: Config) -> Optional[UnsubscribeTokenSigner]:
+    if config.unsubscribe_token_secret is None:
+        return None
+    return UnsubscribeTokenSigner(config.unsubscribe_token_secret.encode("utf-8"))
+
+
+@cache
+def get_message_provider(config: FeedConfigDependency):
+    return EmailFromTemplateProvider(
+        settings=EmailFromTemplateProvider.Settings(**asdict(config.template_vars)),
+        template_loader=FileSystemLoader(config.email_templates),
+        binary_loader=FileSystemBinaryLoader(config.email_templates),
+        unsubscribe_signer=_get_unsubscribe_signer(config),
+        personalized=(
+            config.batch_delivery.personalized
+            if config.batch_delivery is not None
+            else None
+        ),
+    )
+
+
 @cache
 def get_confirmation_requester(
-    config: ConfigDependency,
-    connection: Annotated[ConnectionManager, Depends(get_connection)],
+    connection: Annotated[DeadlineConnectionManager, Depends(get_connection)],
+    message_provider: Annotated[
+        EmailFromTemplateProvider, Depends(get_message_provider)
+    ],
 ):
     return EmailConfirmationRequester(
-        connection=connection,
-        message_provider=EmailFromTemplateProvider(
-            settings=EmailFromTemplateProvider.Settings(**asdict(config.template_vars)),
-            template_loader=FileSystemLoader(config.email_templates),
-            binary_loader=FileSystemBinaryLoader(config.email_templates),
+        connection=connection, message_provider=message_provider
+    )
+
+
+@cache
+def get_db_lock(config: FeedConfigDependency):
+    return FileLock(f"{config.db}.lock")
+
+
+@cache
+def get_storage(
+    db: Annotated[TinyDB, Depends(get_db)],
+    lock: Annotated[FileLock, Depends(get_db_lock)],
+):
+    return TinyDbStorage(db, lock=lock)
+
+
+@cache
+def get_rate_limiter(config: ConfigDependency) -> Optional[RateLimiter]:
+    rate_limit = config.rate_limit
+    if rate_limit is None:
+        return None
+    store: BucketStore = (
+        SqliteBucketStore(rate_limit.db, max_entries=rate_limit.max_entries)
+        if rate_limit.db is not None
+        else MemoryBucketStore(max_entries=rate_limit.max_entries)
+    )
+    return RateLimiter(
+        store,
+        per_ip=RateLimiter.Rate(
+            capacity=rate_limit.ip_capacity,
+            refill_per_hour=rate_limit.ip_refill_per_hour,
+        ),
+        per_email=RateLimiter.Rate(
+            capacity=rate_limit.email_capacity,
+            refill_per_hour=rate_limit.email_refill_per_hour,
         ),
     )
 
 
 @cache
-def get_storage(db: Annotated[TinyDB, Depends(get_db)]):
-    return TinyDbStorage(db)
+def get_trusted_proxies(config: ConfigDependency) -> TrustedProxies:
+    if config.rate_limit is None:
+        return TrustedProxies()
+    return TrustedProxies(config.rate_limit.trusted_proxies)
+
+
+def enforce_rate_limit(
+    request: Request,
+    email: Annotated[str, Path()],
+    rate_limiter: Annotated[Optional[RateLimiter], Depends(get_rate_limiter)],
+    trusted_proxies: Annotated[TrustedProxies, Depends(get_trusted_proxies)],
+) -> None:
+    if rate_limiter is None:
+        return
+    rate_limiter.acquire(ip=trusted_proxies.get_client_host(request.scope), email=email)
+
+
+def get_request_deadline(config: ConfigDependency) -> Optional[Deadline]:
+    if config.request_deadline_seconds is None:
+        return None
+    return Deadline(config.request_deadline_seconds)
+
+
+RequestDeadlineDependency = Annotated[Optional[Deadline], Depends(get_request_deadline)]
+
+
+def _file_version(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
 
 @cache
 def get_registration_service(
+    config: FeedConfigDependency,
     confirmation_requester: Annotated[
         ConfirmationRequester, Depends(get_confirmation_requester)
     ],
     storage: Annotated[TinyDbStorage, Depends(get_storage)],
+    lock: Annotated[FileLock, Depends(get_db_lock)],
 ):
     return RegistrationService(
-        storage=storage,
+        storage=(
+            FilteredStorage(
+                storage,
+                capacity=config.lookup_filter.capacity,
+                false_positive_rate=config.lookup_filter.false_positive_rate,
+                version=partial(_file_version, config.db),
+                lock=lock,
+            )
+            if config.lookup_filter is not None
+            else storage
+        ),
         confirmation_requester=confirmation_requester,
         token_generator=gen_secure_token(),
         utcnow=datetime.datetime.utcnow,
+        resend_window=datetime.timedelta(minutes=config.confirm_resend_window_minutes),
+        token_signer=(
+            TokenSigner(
+                config.confirm_token_secret.encode("utf-8"),
+                max_age=datetime.timedelta(minutes=config.confirm_timeout_minutes),
+            )
+            if config.confirm_token_secret is not None
+            else None
+        ),
+        unsubscribe_signer=_get_unsubscribe_signer(config),
     )
 
 
+@cache
+def get_notification_runner(
+    config: FeedConfigDependency,
+    storage: Annotated[TinyDbStorage, Depends(get_storage)],
+    connection: Annotated[ConnectionManager, Depends(get_connection)],
+    message_provider: Annotated[
+        EmailFromTemplateProvider, Depends(get_message_provider)
+    ],
+):
+    def notify():
+        storage.clear_cache()
+        email_notifier = EmailNotifier(
+            storage,
+            connection,
+            message_provider,
+            retry_policy=EmailNotifier.RetryPolicy(**asdict(config.retry)),
+            batch_policy=(
+                EmailNotifier.BatchPolicy(
+                    max_recipients=config.batch_delivery.max_recipients
+                )
+                if config.batch_delivery is not None
+                else None
+            ),
+            throttle_policy=(
+                DomainScheduler.Policy(**asdict(config.throttle))
+                if config.throttle is not None
+                else None
+            ),
+        )
+        process_feed(asdict(config), email_notifier, storage)
+
+    return CoalescingRunner(partial(run_exclusively, asdict(config), notify))
+
+
+class InvalidSignatureException(Exception):
+    pass
+
+
+def require_webhook_config(config: FeedConfigDependency) -> WebhookConfig:
+    if config.webhook is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return config.webhook
+
+
+async def require_webhook_signature(
+    request: Request,
+    webhook_config: Annotated[WebhookConfig, Depends(require_webhook_config)],
+    x_hub_signature_256: Annotated[
+        Optional[str],
+        Header(
+            description="HMAC-SHA256 signature of the request body created with "
+            "the shared webhook secret.",
+            examples=[
+                "sha256=9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+            ],
+        ),
+    ] = None,
+) -> None:
+    expected = hmac.new(
+        webhook_config.secret.encode("utf-8"), await request.body(), hashlib.sha256
+    ).hexdigest()
+    if x_hub_signature_256 is None or not hmac.compare_digest(
+        x_hub_signature_256, f"sha256={expected}"
+    ):
+        raise InvalidSignatureException("Invalid signature.")
+
+
 def require_bearer_token(
     authorization: Annotated[
         Optional[str],
@@ -112,26 +403,83 @@ def require_bearer_token(
     return Token.from_string(token)
 
 
+def warm_up() -> None:
+    config = get_config()
+    connection = get_connection(config=config)
+    get_rate_limiter(config=config)
+    get_trusted_proxies(config=config)
+    feed_configs = [config] + [
+        get_feed_config(config=config, feed=feed) for feed in config.feeds
+    ]
+    for feed_config in feed_configs:
+        db = get_db(config=feed_config)
+        db.tables()
+        message_provider = get_message_provider(config=feed_config)
+        for action in Action:
+            message_provider.get_confirmation_request_msg(
+                Email("warm-up@localhost"),
+                action=action,
+                confirm_token=Token(b"warm-up"),
+            )
+        lock = get_db_lock(config=feed_config)
+        get_registration_service(
+            config=feed_config,
+            confirmation_requester=get_confirmation_requester(
+                connection=connection, message_provider=message_provider
+            ),
+            storage=get_storage(db=db, lock=lock),
+            lock=lock,
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await run_in_threadpool(warm_up)
+    app.state.ready = True
+    yield
+    app.state.ready = False
+
+
 app = FastAPI(
     title="Doveseed",
     version=__version__,
     description="Doveseed is a backend service for email subscriptions to RSS feeds.",
     openapi_url="/openapi.json" if Settings().doveseed_env == "development" else None,
+    lifespan=lifespan,
 )
+app.state.ready = False
 
 
 @app.get(
     "/health",
     status_code=status.HTTP_204_NO_CONTENT,
-    description="Returns a success status if the service is up and running.",
+    responses={
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "The service is still warming up."
+        }
+    },
+    description="Returns a success status if the service is up and running and "
+    "ready to handle requests.",
 )
-async def health():
-    pass
+async def health(request: Request):
+    if not request.app.state.ready:
+        return PlainTextResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content="Warming up."
+        )
 
 
 @app.post(
     "/subscribe/{email}",
     status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(enforce_rate_limit)],
+    responses={
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many requests for the client or email address."
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "The confirmation email could not be sent in time."
+        },
+    },
     description="Request to subscribe an email address and send out an email asking "
     "for confirmation.",
 )
@@ -145,13 +493,23 @@ def subscribe(
     registration_service: Annotated[
         RegistrationService, Depends(get_registration_service)
     ],
+    deadline: RequestDeadlineDependency,
 ):
-    registration_service.subscribe(Email(email))
+    registration_service.subscribe(Email(email), deadline=deadline)
 
 
 @app.post(
     "/unsubscribe/{email}",
     status_code=status.HTTP_204_NO_CONTENT,
+    dependencies=[Depends(enforce_rate_limit)],
+    responses={
+        status.HTTP_429_TOO_MANY_REQUESTS: {
+            "description": "Too many requests for the client or email address."
+        },
+        status.HTTP_503_SERVICE_UNAVAILABLE: {
+            "description": "The confirmation email could not be sent in time."
+        },
+    },
     description="Request to unsubscribe an email address and send out an email "
     "asking for confirmation.",
 )
@@ -166,8 +524,9 @@ def unsubscribe(
     registration_service: Annotated[
         RegistrationService, Depends(get_registration_service)
     ],
+    deadline: RequestDeadlineDependency,
 ):
-    registration_service.unsubscribe(Email(email))
+    registration_service.unsubscribe(Email(email), deadline=deadline)
 
 
 @app.post(
@@ -193,6 +552,101 @@ def confirm(
     registration_service.confirm(Email(email), token)
 
 
+@app.post(
+    "/one-click-unsubscribe/{email}",
+    status_code=status.HTTP_204_NO_CONTENT,
+    description="Unsubscribe an email address immediately without confirmation "
+    "(RFC 8058). This needs to be authorized with the token from the "
+    "List-Unsubscribe header of a notification email.",
+)
+def one_click_unsubscribe(
+    email: Annotated[
+        str,
+        Path(
+            description="Email address to unsubscribe.",
+            examples=["john.doe@example.com"],
+        ),
+    ],
+    token: Annotated[
+        str,
+        Query(
+            description="Token from the List-Unsubscribe header.",
+            examples=["6RQkYl6o8aWzPe5IfGuZBA=="],
+        ),
+    ],
+    registration_service: Annotated[
+        RegistrationService, Depends(get_registration_service)
+    ],
+):
+    try:
+        parsed_token = Token.from_string(token)
+    except ValueError:
+        raise UnauthorizedException("Invalid token.")
+    registration_service.unsubscribe_one_click(Email(email), parsed_token)
+
+
+@app.get(
+    "/feed-updated",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(require_webhook_config)],
+    description="WebSub verification of intent for the feed update notifications.",
+)
+def verify_feed_update_subscription(
+    config: FeedConfigDependency,
+    mode: Annotated[
+        Union[Literal["subscribe"], Literal["unsubscribe"]], Query(alias="hub.mode")
+    ],
+    topic: Annotated[str, Query(alias="hub.topic")],
+    challenge: Annotated[str, Query(alias="hub.challenge")],
+):
+    if topic != config.rss:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return challenge
+
+
+@app.post(
+    "/feed-updated",
+    status_code=status.HTTP_202_ACCEPTED,
+    dependencies=[Depends(require_webhook_signature)],
+    description="Notification that the feed has been updated. Triggers the "
+    "notification of subscribers about new posts in the background. This needs to "
+    "be signed with the shared webhook secret.",
+)
+def feed_updated(
+    background_tasks: BackgroundTasks,
+    notification_runner: Annotated[CoalescingRunner, Depends(get_notification_runner)],
+):
+    background_tasks.add_task(notification_runner)
+
+
+@app.exception_handler(InvalidSignatureException)
+def handle_invalid_signature_exception(
+    request: Request, exc: InvalidSignatureException
+):
+    return PlainTextResponse(status_code=status.HTTP_401_UNAUTHORIZED, content=str(exc))
+
+
+@app.exception_handler(RateLimitExceeded)
+def handle_rate_limit_exceeded(request: Request, exc: RateLimitExceeded):
+    return PlainTextResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content=str(exc),
+        headers={"Retry-After": str(math.ceil(exc.retry_after_seconds))},
+    )
+
+
+@app.exception_handler(DeadlineExceeded)
+def handle_deadline_exceeded(request: Request, exc: DeadlineExceeded):
+    return PlainTextResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=str(exc)
+    )
+
+
+@app.exception_handler(UnknownFeedException)
+def handle_unknown_feed_exception(request: Request, exc: UnknownFeedException):
+    return PlainTextResponse(status_code=status.HTTP_404_NOT_FOUND, content=str(exc))
+
+
 @app.exception_handler(UnauthorizedException)
 def handle_unauthorized_exception(request: Request, exc: UnauthorizedException):
     return PlainTextResponse(
@@ -0,0 +1,125 @@
+import mailbox
+import os.path
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime
+from email.message import Message
+from typing import Collection, Iterable, List, Sequence
+
+from typing_extensions import Protocol
+
+from .domain_types import Email
+from .registration import Registration
+
+
+@dataclass(frozen=True)
+class Bounce:
+    email: Email
+    status: str
+
+    @property
+    def is_permanent(self) -> bool:
+        return self.status.startswith("5")
+
+
+@dataclass
+class Suppression:
+    email: Email
+    bounces: int
+    last_bounce: datetime
+
+
+@dataclass
+class BounceResult:
+    hard_bounces: int = 0
+    soft_bounces: int = 0
+    unsubscribed: List[Email] = field(default_factory=list)
+
+
+class Storage(Protocol):
+    def emails(self) -> Iterable[Email]: ...
+
+    def get_suppressions(self) -> Iterable[Suppression]: ...
+
+    def upsert_suppressions(self, suppressions: Sequence[Suppression]) -> None: ...
+
+    def apply_changes(
+        self,
+        *,
+        upserts: Sequence[Registration] = (),
+        deletes: Collection[Email] = (),
+    ) -> None: ...
+
+
+def open_mailbox(path: str) -> mailbox.Mailbox:
+    if os.path.isdir(path):
+        return mailbox.Maildir(path, factory=None, create=False)
+    return mailbox.mbox(path, create=False)
+
+
+def is_delivery_report(message: Message) -> bool:
+    return any(
+        part.get_content_type() == "message/delivery-status" for part in message.walk()
+    )
+
+
+def parse_dsn(message: Message) -> List[Bounce]:
+    bounces = []
+    for part in message.walk():
+        if part.get_content_type() != "message/delivery-status":
+            continue
+        for block in part.get_payload():
+            if not isinstance(block, Message):
+                continue
+            recipient = block.get("Final-Recipient") or block.get("Original-Recipient")
+            action = block.get("Action", "").strip().lower()
+            if recipient is None or action != "failed":
+                continue
+            address = recipient.partition(";")[2].strip().strip("<>")
+            if address:
+                bounces.append(
+                    Bounce(email=Email(address), status=block.get("Status", "").strip())
+                )
+    return bounces
+
+
+def process_bounces(
+    storage: Storage,
+    messages: Iterable[Message],
+    *,
+    now: datetime,
+    threshold: int,
+) -> BounceResult:
+    result = BounceResult()
+    hard_bounces: Counter[Email] = Counter()
+    for message in messages:
+        for bounce in parse_dsn(message):
+            if bounce.is_permanent:
+                hard_bounces[Email(bounce.email.lower())] += 1
+                result.hard_bounces += 1
+            else:
+                result.soft_bounces += 1
+
+    suppressions = {
+        suppression.email: suppression for suppression in storage.get_suppressions()
+    }
+    updated = [
+        Suppression(
+            email=email,
+            bounces=count
+            + (suppressions[email].bounces if email in suppressions else 0),
+            last_bounce=now,
+        )
+        for email, count in hard_bounces.items()
+    ]
+    registered = {email.lower(): email for email in storage.emails()}
+    result.unsubscribed = [
+        registered[suppression.email]
+        for suppression in updated
+        if suppression.bounces >= threshold and suppression.email in registered
+    ]
+    if len(updated) > 0:
+        storage.upsert_suppressions(updated)
+    if len(result.unsubscribed) > 0:
+        storage.apply_changes(deletes=result.unsubscribed)
+    return result
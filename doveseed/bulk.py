@@ -0,0 +1,203 @@
+import csv
+import json
+import logging
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime
+from itertools import islice
+from typing import (
+    IO,
+    Callable,
+    Collection,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
+
+from typing_extensions import Protocol
+
+from .domain_types import Action, Email, State, Token
+from .registration import Registration, is_valid_email
+
+Logger = logging.getLogger(__name__)
+
+Format = Union[Literal["csv"], Literal["jsonl"]]
+
+ConfirmationSender = Callable[[Sequence[Registration]], Sequence[Registration]]
+
+EXPORT_FIELDS = ("email", "state", "last_update")
+
+
+class Storage(Protocol):
+    def all(self) -> Iterable[Registration]: ...
+
+    def emails(self) -> Iterable[Email]: ...
+
+    def insert_multiple(self, registrations: Sequence[Registration]) -> None: ...
+
+    def apply_changes(
+        self,
+        *,
+        upserts: Sequence[Registration] = (),
+        deletes: Collection[Email] = (),
+    ) -> None: ...
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    invalid: int = 0
+    duplicates: int = 0
+    confirmations_requested: int = 0
+    confirmations_failed: int = 0
+
+
+def read_emails(source: IO[str], format: Format) -> Iterator[str]:
+    if format == "csv":
+        reader = csv.DictReader(source)
+        if reader.fieldnames is None or "email" not in reader.fieldnames:
+            raise ValueError("CSV input requires an 'email' column.")
+        for row in reader:
+            yield row["email"] or ""
+    else:
+        for line in source:
+            if line.strip():
+                yield json.loads(line)["email"]
+
+
+def import_registrations(
+    storage: Storage,
+    emails: Iterable[str],
+    *,
+    state: State,
+    now: datetime,
+    batch_size: int = 50000,
+    token_generator: Optional[Iterator[Token]] = None,
+    send_confirmations: Optional[ConfirmationSender] = None,
+) -> ImportResult:
+    result = ImportResult()
+    known: Set[str] = set(storage.emails())
+    started = time.monotonic()
+    rows = iter(emails)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if len(batch) == 0:
+            break
+
+        registrations: List[Registration] = []
+        pending: List[Registration] = []
+        for email in batch:
+            email = email.strip()
+            if not is_valid_email(email):
+                Logger.warning("Skipping invalid email address %r.", email)
+                result.invalid += 1
+            elif email in known:
+                result.duplicates += 1
+            else:
+                known.add(email)
+                registration = Registration(
+                    email=Email(email), last_update=now, state=state
+                )
+                if state == State.pending_subscribe:
+                    registration.confirm_action = Action.subscribe
+                    if token_generator is not None:
+                        registration.confirm_token = next(token_generator)
+                    pending.append(registration)
+                registrations.append(registration)
+        if len(registrations) > 0:
+            storage.insert_multiple(registrations)
+        result.imported += len(registrations)
+        if send_confirmations is not None and len(pending) > 0:
+            failed = [
+                registration.email for registration in send_confirmations(pending)
+            ]
+            if len(failed) > 0:
+                storage.apply_changes(deletes=failed)
+                known.difference_update(failed)
+            result.confirmations_requested += len(pending) - len(failed)
+            result.confirmations_failed += len(failed)
+
+        rows_done = result.imported + result.invalid + result.duplicates
+        Logger.info(
+            "Processed %d rows (%.0f rows/s).",
+            rows_done,
+            rows_done / max(time.monotonic() - started, 1e-9),
+        )
+    return result
+
+
+def export_registrations(storage: Storage, destination: IO[str], format: Format) -> int:
+    count = 0
+    writer = csv.writer(destination) if format == "csv" else None
+    if writer is not None:
+        writer.writerow(EXPORT_FIELDS)
+    for registration in storage.all():
+        row = (
+            registration.email,
+            registration.state.name,
+            registration.last_update.isoformat(),
+        )
+        if writer is not None:
+            writer.writerow(row)
+        else:
+            destination.write(json.dumps(dict(zip(EXPORT_FIELDS, row))) + "\n")
+        count += 1
+    return count
+
+
+def has_domain(email: str, domain: str) -> bool:
+    return email.rpartition("@")[2].lower() == domain.lower()
+
+
+def unsubscribe_domain(storage: Storage, domain: str) -> int:
+    emails = [email for email in storage.emails() if has_domain(email, domain)]
+    storage.apply_changes(deletes=emails)
+    return len(emails)
+
+
+def purge_emails(storage: Storage, emails: Iterable[str]) -> int:
+    suppressed = {email.strip() for email in emails}
+    purged = [email for email in storage.emails() if email in suppressed]
+    storage.apply_changes(deletes=purged)
+    return len(purged)
+
+
+def select_subscribers(
+    storage: Storage,
+    *,
+    domain: Optional[str] = None,
+    updated_before: Optional[datetime] = None,
+) -> List[Registration]:
+    return [
+        registration
+        for registration in storage.all()
+        if registration.state == State.subscribed
+        and (domain is None or has_domain(registration.email, domain))
+        and (updated_before is None or registration.last_update < updated_before)
+    ]
+
+
+def request_reconfirmation(
+    storage: Storage,
+    cohort: Sequence[Registration],
+    *,
+    token_generator: Iterator[Token],
+    now: datetime,
+) -> List[Registration]:
+    pending = [
+        replace(
+            registration,
+            state=State.pending_subscribe,
+            last_update=now,
+            confirm_token=next(token_generator),
+            confirm_action=Action.subscribe,
+        )
+        for registration in cohort
+    ]
+    storage.apply_changes(upserts=pending)
+    return pending
@@ -1,42 +1,539 @@
 import json
+import logging
+import signal
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from smtplib import SMTPException
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional, Sequence, Union
 
 from jinja2 import FileSystemLoader
 from tinydb import TinyDB
 
+from .bounces import BounceResult, is_delivery_report, open_mailbox, process_bounces
+from .bulk import (
+    ConfirmationSender,
+    Format,
+    ImportResult,
+    export_registrations,
+    import_registrations,
+    purge_emails,
+    read_emails,
+    request_reconfirmation,
+    select_subscribers,
+    unsubscribe_domain,
+)
+from .confirmation import EmailConfirmationRequester
+from .daemon import NotifierDaemon
+from .domain_types import Action, State
 from .email_notification import EmailNotifier
 from .email_templating import EmailFromTemplateProvider, FileSystemBinaryLoader
-from .feed import get_feed, parse_rss
+from .feed import DEFAULT_TIMEOUT_SECONDS, FeedNotModified, iter_rss, open_feed
+from .locking import FileLock
 from .notifier import NewPostNotifier
-from .smtp import smtp_connection
+from .registration import Registration
+from .sharding import Shard, ShardedStorage
+from .smtp import (
+    ConnectionManager,
+    PersistentConnectionManager,
+    persistent_smtp_connection,
+)
 from .storage import TinyDbStorage
+from .throttle import DomainScheduler
+from .token_gen import UnsubscribeTokenSigner, gen_secure_token
+
+Logger = logging.getLogger(__name__)
+
+
+def _open_storage(config: Dict[str, Any]) -> TinyDbStorage:
+    return TinyDbStorage(TinyDB(config["db"]), lock=FileLock(f"{config['db']}.lock"))
+
+
+def _scope_storage(
+    storage: TinyDbStorage, shard: Optional[Shard]
+) -> Union[TinyDbStorage, ShardedStorage]:
+    return storage if shard is None else ShardedStorage(storage, shard)
+
+
+def _feed_configs(config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    feed_configs = [config] + [
+        {**config, **feed_config, "feeds": {}}
+        for feed_config in config.get("feeds", {}).values()
+    ]
+    dbs = [feed_config["db"] for feed_config in feed_configs]
+    if len(set(dbs)) < len(dbs):
+        raise ValueError("Each feed requires its own database.")
+    return feed_configs
+
+
+@contextmanager
+def _shared_connection(
+    config: Dict[str, Any],
+) -> Iterator[PersistentConnectionManager]:
+    connection = persistent_smtp_connection(**config["smtp"])
+    try:
+        yield connection
+    finally:
+        connection.close()
+
+
+def run_exclusively(
+    config: Dict[str, Any], task: Callable[[], None], *, shard: Optional[Shard] = None
+) -> None:
+    suffix = f".{shard.index}-of-{shard.count}" if shard is not None else ""
+    lock = FileLock(f"{config['db']}.notify{suffix}.lock")
+    if not lock.acquire(blocking=False):
+        Logger.info(
+            "Skipping notification run for %s, another run is in progress.",
+            config["rss"],
+        )
+        return
+    try:
+        task()
+    finally:
+        lock.release()
+
+
+class _FeedProcessor:
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        connection: ConnectionManager,
+        shard: Optional[Shard] = None,
+    ):
+        self.config = config
+        self.shard = shard
+        self.storage = _open_storage(config)
+        self.scoped_storage = _scope_storage(self.storage, shard)
+        self._connection = connection
+        self._message_provider = _create_message_provider(config)
+
+    def create_email_notifier(self) -> EmailNotifier:
+        return _create_email_notifier(
+            self.config,
+            self.scoped_storage,
+            connection=self._connection,
+            message_provider=self._message_provider,
+        )
+
+    def notify(self) -> None:
+        run_exclusively(self.config, self._notify, shard=self.shard)
+
+    def _notify(self) -> None:
+        self.storage.clear_cache()
+        process_feed(self.config, self.create_email_notifier(), self.scoped_storage)
+
+    def retry(self) -> None:
+        run_exclusively(self.config, self._retry, shard=self.shard)
+
+    def _retry(self) -> None:
+        self.storage.clear_cache()
+        self.create_email_notifier().retry_pending()
+
+    def clean(self) -> None:
+        _drop_old_unconfirmed(self.config, self.storage)
+
+
+def _create_feed_processors(
+    config: Dict[str, Any], connection: ConnectionManager, shard: Optional[Shard]
+) -> List[_FeedProcessor]:
+    return [
+        _FeedProcessor(feed_config, connection, shard)
+        for feed_config in _feed_configs(config)
+    ]
+
+
+def _run_for_feeds(
+    processors: List[_FeedProcessor], action: Callable[[_FeedProcessor], None]
+) -> None:
+    if len(processors) == 1:
+        action(processors[0])
+        return
+
+    with ThreadPoolExecutor(max_workers=len(processors)) as executor:
+        futures = [
+            (processor, executor.submit(action, processor)) for processor in processors
+        ]
+    errors = []
+    for processor, future in futures:
+        error = future.exception()
+        if error is not None:
+            Logger.error(
+                "Processing feed %s failed", processor.config["rss"], exc_info=error
+            )
+            errors.append(error)
+    if len(errors) > 0:
+        raise errors[0]
 
 
 def clean_unconfirmed(config: Dict[str, Any]) -> None:
-    db = TinyDB(config["db"])
-    storage = TinyDbStorage(db)
+    for feed_config in _feed_configs(config):
+        _drop_old_unconfirmed(feed_config, _open_storage(feed_config))
+
+
+def _drop_old_unconfirmed(config: Dict[str, Any], storage: TinyDbStorage) -> None:
     storage.drop_old_unconfirmed(
         drop_before=datetime.utcnow()
         - timedelta(minutes=config["confirm_timeout_minutes"])
     )
 
 
-def notify_subscribers(config: Dict[str, Any]) -> None:
-    db = TinyDB(config["db"])
-    storage = TinyDbStorage(db)
-    connection = smtp_connection(**config["smtp"])
-    message_provider = EmailFromTemplateProvider(
+def _create_message_provider(config: Dict[str, Any]) -> EmailFromTemplateProvider:
+    return EmailFromTemplateProvider(
         settings=EmailFromTemplateProvider.Settings(**config["template_vars"]),
         template_loader=FileSystemLoader(config["email_templates"]),
         binary_loader=FileSystemBinaryLoader(config["email_templates"]),
+        unsubscribe_signer=(
+            UnsubscribeTokenSigner(config["unsubscribe_token_secret"].encode("utf-8"))
+            if config.get("unsubscribe_token_secret", None) is not None
+            else None
+        ),
+        personalized=(config.get("batch_delivery") or {}).get("personalized", None),
+    )
+
+
+def _create_email_notifier(
+    config: Dict[str, Any],
+    storage: Union[TinyDbStorage, ShardedStorage],
+    *,
+    connection: ConnectionManager,
+    message_provider: EmailFromTemplateProvider,
+) -> EmailNotifier:
+    return EmailNotifier(
+        storage,
+        connection,
+        message_provider,
+        retry_policy=EmailNotifier.RetryPolicy(**config.get("retry", {})),
+        batch_policy=(
+            EmailNotifier.BatchPolicy(
+                max_recipients=config["batch_delivery"].get("max_recipients", 100)
+            )
+            if config.get("batch_delivery", None) is not None
+            else None
+        ),
+        throttle_policy=(
+            DomainScheduler.Policy(**config["throttle"])
+            if config.get("throttle", None) is not None
+            else None
+        ),
+    )
+
+
+def notify_subscribers(
+    config: Dict[str, Any], *, shard: Optional[Shard] = None
+) -> None:
+    with _shared_connection(config) as connection:
+        _run_for_feeds(
+            _create_feed_processors(config, connection, shard), _FeedProcessor.notify
+        )
+
+
+def process_feed(
+    config: Dict[str, Any],
+    email_notifier: EmailNotifier,
+    storage: Union[TinyDbStorage, ShardedStorage],
+) -> None:
+    email_notifier.retry_pending()
+    try:
+        with open_feed(
+            config["rss"],
+            validators=storage.get_feed_validators(),
+            timeout=config.get("feed_timeout_seconds", DEFAULT_TIMEOUT_SECONDS),
+        ) as (feed, validators):
+            feed_consumer = NewPostNotifier(
+                storage,
+                email_notifier,
+                seen_items_policy=NewPostNotifier.SeenItemsPolicy(
+                    **config.get("seen_items", {})
+                ),
+                **_digest_options(config, email_notifier),
+            )
+            feed_consumer(
+                iter_rss(
+                    feed,
+                    is_seen=feed_consumer.is_seen,
+                    seen_cutoff=feed_consumer.seen_cutoff,
+                )
+            )
+    except FeedNotModified:
+        return
+    storage.set_feed_validators(validators)
+
+
+def _digest_options(
+    config: Dict[str, Any], email_notifier: EmailNotifier
+) -> Dict[str, Any]:
+    if not config.get("digest", None):
+        return {}
+    return dict(
+        digest_consumer=email_notifier.send_digest,
+        digest_policy=NewPostNotifier.DigestPolicy(**config["digest"]),
+    )
+
+
+def retry_deliveries(config: Dict[str, Any], *, shard: Optional[Shard] = None) -> None:
+    with _shared_connection(config) as connection:
+        _run_for_feeds(
+            _create_feed_processors(config, connection, shard), _FeedProcessor.retry
+        )
+
+
+def _select_feed_config(config: Dict[str, Any], feed: Optional[str]) -> Dict[str, Any]:
+    if feed is None:
+        return config
+    if feed not in config.get("feeds", {}):
+        raise ValueError(f"Unknown feed '{feed}'.")
+    return {**config, **config["feeds"][feed], "feeds": {}}
+
+
+def _guess_format(path: str) -> Format:
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+@contextmanager
+def _open_text(path: str, mode: str) -> Iterator[IO[str]]:
+    if path == "-":
+        yield sys.stdin if mode == "r" else sys.stdout
+    else:
+        with open(path, mode, encoding="utf-8", newline="") as f:
+            yield f
+
+
+def import_subscribers(
+    config: Dict[str, Any],
+    path: str,
+    *,
+    format: Optional[Format] = None,
+    subscribed: bool = False,
+    batch_size: int = 50000,
+    feed: Optional[str] = None,
+) -> ImportResult:
+    feed_config = _select_feed_config(config, feed)
+    storage = _open_storage(feed_config)
+    started = time.monotonic()
+    with ExitStack() as stack:
+        source = stack.enter_context(_open_text(path, "r"))
+        result = import_registrations(
+            storage,
+            read_emails(source, format or _guess_format(path)),
+            state=State.subscribed if subscribed else State.pending_subscribe,
+            now=datetime.utcnow(),
+            batch_size=batch_size,
+            token_generator=gen_secure_token(),
+            send_confirmations=(
+                None
+                if subscribed
+                else stack.enter_context(_confirmation_sender(feed_config))
+            ),
+        )
+    duration = time.monotonic() - started
+    rows = result.imported + result.invalid + result.duplicates
+    Logger.info(
+        "Imported %d of %d rows (%d invalid, %d duplicates) in %.1f s (%.0f rows/s).",
+        result.imported,
+        rows,
+        result.invalid,
+        result.duplicates,
+        duration,
+        rows / max(duration, 1e-9),
+    )
+    if result.confirmations_failed > 0:
+        Logger.warning(
+            "Removed %d imported addresses because their confirmation request "
+            "failed. Import them again to retry.",
+            result.confirmations_failed,
+        )
+    if not subscribed:
+        _log_changes(
+            "Requested confirmation of", result.confirmations_requested, started
+        )
+    return result
+
+
+def export_subscribers(
+    config: Dict[str, Any],
+    path: str,
+    *,
+    format: Optional[Format] = None,
+    feed: Optional[str] = None,
+) -> int:
+    storage = _open_storage(_select_feed_config(config, feed))
+    started = time.monotonic()
+    with _open_text(path, "w") as destination:
+        count = export_registrations(
+            storage, destination, format or _guess_format(path)
+        )
+    duration = time.monotonic() - started
+    Logger.info(
+        "Exported %d rows in %.1f s (%.0f rows/s).",
+        count,
+        duration,
+        count / max(duration, 1e-9),
+    )
+    return count
+
+
+def _log_changes(message: str, count: int, started: float) -> None:
+    duration = time.monotonic() - started
+    Logger.info(
+        "%s %d subscribers in %.1f s (%.0f rows/s).",
+        message,
+        count,
+        duration,
+        count / max(duration, 1e-9),
+    )
+
+
+def unsubscribe_subscribers_of_domain(
+    config: Dict[str, Any], domain: str, *, feed: Optional[str] = None
+) -> int:
+    storage = _open_storage(_select_feed_config(config, feed))
+    started = time.monotonic()
+    count = unsubscribe_domain(storage, domain)
+    _log_changes("Unsubscribed", count, started)
+    return count
+
+
+def purge_subscribers(
+    config: Dict[str, Any],
+    path: str,
+    *,
+    format: Optional[Format] = None,
+    feed: Optional[str] = None,
+) -> int:
+    storage = _open_storage(_select_feed_config(config, feed))
+    started = time.monotonic()
+    with _open_text(path, "r") as source:
+        count = purge_emails(
+            storage, read_emails(source, format or _guess_format(path))
+        )
+    _log_changes("Purged", count, started)
+    return count
+
+
+def reconfirm_subscribers(
+    config: Dict[str, Any],
+    *,
+    domain: Optional[str] = None,
+    subscribed_before: Optional[datetime] = None,
+    feed: Optional[str] = None,
+) -> int:
+    feed_config = _select_feed_config(config, feed)
+    storage = _open_storage(feed_config)
+    started = time.monotonic()
+    cohort = select_subscribers(
+        storage, domain=domain, updated_before=subscribed_before
+    )
+    pending = request_reconfirmation(
+        storage, cohort, token_generator=gen_secure_token(), now=datetime.utcnow()
+    )
+    with _confirmation_sender(feed_config) as send_confirmations:
+        failed = {registration.email for registration in send_confirmations(pending)}
+    if len(failed) > 0:
+        storage.apply_changes(
+            upserts=[
+                registration for registration in cohort if registration.email in failed
+            ]
+        )
+        Logger.warning(
+            "Restored %d subscriptions because their reconfirmation request failed. "
+            "Run the action again to retry.",
+            len(failed),
+        )
+    _log_changes("Requested reconfirmation of", len(cohort) - len(failed), started)
+    return len(cohort) - len(failed)
+
+
+@contextmanager
+def _confirmation_sender(config: Dict[str, Any]) -> Iterator[ConfirmationSender]:
+    with _shared_connection(config) as connection:
+        confirmation_requester = EmailConfirmationRequester(
+            connection=connection,
+            message_provider=_create_message_provider(config),
+        )
+
+        def send_confirmations(
+            registrations: Sequence[Registration],
+        ) -> List[Registration]:
+            failed = []
+            for registration in registrations:
+                assert registration.confirm_token is not None
+                try:
+                    confirmation_requester.request_confirmation(
+                        registration.email,
+                        action=Action.subscribe,
+                        confirm_token=registration.confirm_token,
+                    )
+                except (SMTPException, OSError):
+                    Logger.exception(
+                        "Failed to request confirmation from %s.", registration.email
+                    )
+                    failed.append(registration)
+            return failed
+
+        yield send_confirmations
+
+
+def process_bounce_mailbox(
+    config: Dict[str, Any],
+    path: str,
+    *,
+    remove_processed: bool = False,
+    feed: Optional[str] = None,
+) -> BounceResult:
+    feed_config = _select_feed_config(config, feed)
+    storage = _open_storage(feed_config)
+    started = time.monotonic()
+    mailbox = open_mailbox(path)
+    mailbox.lock()
+    try:
+        reports = {
+            key: message
+            for key, message in mailbox.iteritems()
+            if is_delivery_report(message)
+        }
+        result = process_bounces(
+            storage,
+            reports.values(),
+            now=datetime.utcnow(),
+            threshold=feed_config.get("bounces", {}).get("threshold", 3),
+        )
+        if remove_processed:
+            for key in reports:
+                mailbox.discard(key)
+            mailbox.flush()
+    finally:
+        mailbox.unlock()
+        mailbox.close()
+
+    duration = time.monotonic() - started
+    Logger.info(
+        "Processed %d delivery reports (%d hard bounces, %d soft bounces) "
+        "in %.1f s, %d addresses reached the bounce threshold.",
+        len(reports),
+        result.hard_bounces,
+        result.soft_bounces,
+        duration,
+        len(result.unsubscribed),
     )
-    email_notifier = EmailNotifier(storage, connection, message_provider)
-    feed_consumer = NewPostNotifier(storage, email_notifier)
-    feed_consumer(parse_rss(get_feed(config["rss"])))
+    return result
 
 
-Actions = {"clean": clean_unconfirmed, "notify": notify_subscribers}
+def serve_notifier(config: Dict[str, Any], *, shard: Optional[Shard] = None) -> None:
+    with _shared_connection(config) as connection:
+        processors = _create_feed_processors(config, connection, shard)
+        daemon_config = config.get("daemon", {})
+        daemon = NotifierDaemon(
+            poll=lambda: _run_for_feeds(processors, _FeedProcessor.notify),
+            clean=lambda: _run_for_feeds(processors, _FeedProcessor.clean),
+            poll_interval_seconds=daemon_config.get("poll_interval_seconds", 300),
+            clean_interval_seconds=daemon_config.get("clean_interval_seconds", 86400),
+        )
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda signum, frame: daemon.stop())
+        daemon.run()
 
 
 if __name__ == "__main__":
@@ -45,23 +542,182 @@ if __name__ == "__main__":
     import os.path
 
     parser = argparse.ArgumentParser(description="Triggers a doveseed action")
-    parser.add_argument(
-        "action",
-        type=str,
-        nargs=1,
-        choices=("clean", "notify"),
-        help="Action to perform: 'clean' to clean expired pending "
-        "subscriptions; 'notify' to notify active subscribers about "
-        "new posts.",
+    actions = parser.add_subparsers(dest="action", metavar="action", required=True)
+
+    clean_parser = actions.add_parser(
+        "clean", help="clean expired pending subscriptions"
+    )
+    clean_parser.set_defaults(func=lambda config, args: clean_unconfirmed(config))
+
+    shard_kwargs: Dict[str, Any] = dict(
+        type=Shard.from_string,
+        default=None,
+        metavar="i/n",
+        help="only process subscribers in shard i of n (0-based)",
+    )
+    notify_parser = actions.add_parser(
+        "notify", help="notify active subscribers about new posts"
+    )
+    notify_parser.add_argument("--shard", **shard_kwargs)
+    notify_parser.set_defaults(
+        func=lambda config, args: notify_subscribers(config, shard=args.shard)
+    )
+
+    retry_parser = actions.add_parser(
+        "retry", help="retry deferred notification deliveries"
+    )
+    retry_parser.add_argument("--shard", **shard_kwargs)
+    retry_parser.set_defaults(
+        func=lambda config, args: retry_deliveries(config, shard=args.shard)
+    )
+
+    serve_notifier_parser = actions.add_parser(
+        "serve-notifier",
+        help="continuously poll for new posts and notify active subscribers",
+    )
+    serve_notifier_parser.add_argument("--shard", **shard_kwargs)
+    serve_notifier_parser.set_defaults(
+        func=lambda config, args: serve_notifier(config, shard=args.shard)
+    )
+
+    def input_path(path: str) -> str:
+        return path if path == "-" else os.path.abspath(path)
+
+    feed_kwargs: Dict[str, Any] = dict(
+        default=None, help="name of the feed to operate on (default: primary feed)"
+    )
+    format_kwargs: Dict[str, Any] = dict(
+        choices=("csv", "jsonl"),
+        default=None,
+        help="file format (default: derived from the file extension)",
     )
-    parser.add_argument(
-        "config", type=str, nargs=1, help="configuration file", metavar="config"
+
+    import_parser = actions.add_parser(
+        "import", help="import subscribers from a CSV or JSONL file"
+    )
+    import_parser.add_argument(
+        "file", type=input_path, help="file to read, '-' for stdin"
+    )
+    import_parser.add_argument("--format", **format_kwargs)
+    import_parser.add_argument(
+        "--subscribed",
+        action="store_true",
+        help="mark imported addresses as subscribed instead of pending",
+    )
+    import_parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=50000,
+        help="number of rows written to the database at once",
+    )
+    import_parser.add_argument("--feed", **feed_kwargs)
+    import_parser.set_defaults(
+        func=lambda config, args: import_subscribers(
+            config,
+            args.file,
+            format=args.format,
+            subscribed=args.subscribed,
+            batch_size=args.batch_size,
+            feed=args.feed,
+        )
+    )
+
+    export_parser = actions.add_parser(
+        "export", help="export subscribers to a CSV or JSONL file"
+    )
+    export_parser.add_argument(
+        "file", type=input_path, help="file to write, '-' for stdout"
+    )
+    export_parser.add_argument("--format", **format_kwargs)
+    export_parser.add_argument("--feed", **feed_kwargs)
+    export_parser.set_defaults(
+        func=lambda config, args: export_subscribers(
+            config, args.file, format=args.format, feed=args.feed
+        )
+    )
+
+    unsubscribe_domain_parser = actions.add_parser(
+        "unsubscribe-domain", help="remove all subscribers of an email domain"
+    )
+    unsubscribe_domain_parser.add_argument(
+        "domain", type=str, help="domain part of the email addresses"
+    )
+    unsubscribe_domain_parser.add_argument("--feed", **feed_kwargs)
+    unsubscribe_domain_parser.set_defaults(
+        func=lambda config, args: unsubscribe_subscribers_of_domain(
+            config, args.domain, feed=args.feed
+        )
+    )
+
+    purge_parser = actions.add_parser(
+        "purge", help="remove the subscribers listed in a CSV or JSONL file"
+    )
+    purge_parser.add_argument(
+        "file", type=input_path, help="file to read, '-' for stdin"
+    )
+    purge_parser.add_argument("--format", **format_kwargs)
+    purge_parser.add_argument("--feed", **feed_kwargs)
+    purge_parser.set_defaults(
+        func=lambda config, args: purge_subscribers(
+            config, args.file, format=args.format, feed=args.feed
+        )
+    )
+
+    reconfirm_parser = actions.add_parser(
+        "reconfirm", help="ask active subscribers to confirm their subscription again"
+    )
+    reconfirm_parser.add_argument(
+        "--domain", default=None, help="only subscribers of this email domain"
+    )
+    reconfirm_parser.add_argument(
+        "--subscribed-before",
+        type=datetime.fromisoformat,
+        default=None,
+        metavar="YYYY-MM-DD",
+        help="only subscribers that last changed their subscription before (UTC)",
     )
+    reconfirm_parser.add_argument("--feed", **feed_kwargs)
+    reconfirm_parser.set_defaults(
+        func=lambda config, args: reconfirm_subscribers(
+            config,
+            domain=args.domain,
+            subscribed_before=args.subscribed_before,
+            feed=args.feed,
+        )
+    )
+
+    bounces_parser = actions.add_parser(
+        "bounces", help="record hard bounces from delivery status notifications"
+    )
+    bounces_parser.add_argument(
+        "mailbox", type=os.path.abspath, help="maildir directory or mbox file"
+    )
+    bounces_parser.add_argument(
+        "--remove-processed",
+        action="store_true",
+        help="delete processed delivery status notifications from the mailbox",
+    )
+    bounces_parser.add_argument("--feed", **feed_kwargs)
+    bounces_parser.set_defaults(
+        func=lambda config, args: process_bounce_mailbox(
+            config,
+            args.mailbox,
+            remove_processed=args.remove_processed,
+            feed=args.feed,
+        )
+    )
+
+    for action_parser in actions.choices.values():
+        action_parser.add_argument(
+            "config", type=str, nargs=1, help="configuration file", metavar="config"
+        )
 
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
-    os.chdir(os.path.dirname(os.path.abspath(args.config[0])))
-    with open(args.config[0], "r", encoding="utf-8") as f:
+    config_path = os.path.abspath(args.config[0])
+    os.chdir(os.path.dirname(config_path))
+    with open(config_path, "r", encoding="utf-8") as f:
         config = json.load(f)
 
-    Actions[args.action[0]](config)
+    args.func(config, args)
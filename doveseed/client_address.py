@@ -0,0 +1,48 @@
+import ipaddress
+from typing import Iterable, List, Optional, Union
+
+from starlette.types import Scope
+
+
+class TrustedProxies:
+    def __init__(self, networks: Iterable[str] = ()):
+        self._networks = [
+            ipaddress.ip_network(network, strict=False) for network in networks
+        ]
+
+    def __contains__(self, host: str) -> bool:
+        address = parse_ip_address(host)
+        return address is not None and any(
+            address in network for network in self._networks
+        )
+
+    def get_client_host(self, scope: Scope) -> Optional[str]:
+        client = scope.get("client")
+        if client is None:
+            return None
+        host = client[0]
+        if host in self:
+            host = self._get_forwarded_for(scope) or host
+        return host
+
+    def _get_forwarded_for(self, scope: Scope) -> Optional[str]:
+        forwarded_for: List[str] = [
+            address.strip()
+            for name, value in scope["headers"]
+            if name == b"x-forwarded-for"
+            for address in value.decode("latin-1").split(",")
+            if address.strip()
+        ]
+        for address in reversed(forwarded_for):
+            if address not in self:
+                return address
+        return forwarded_for[0] if forwarded_for else None
+
+
+def parse_ip_address(
+    value: str,
+) -> Optional[Union[ipaddress.IPv4Address, ipaddress.IPv6Address]]:
+    try:
+        return ipaddress.ip_address(value)
+    except ValueError:
+        return None
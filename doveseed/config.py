@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Literal, Optional, Union
+from dataclasses import dataclass, field
+from typing import Dict, Literal, Optional, Tuple, Union
 
 
 @dataclass(frozen=True)
@@ -12,6 +12,8 @@ class SmtpConfig:
         "start-tls"
     )
     check_hostname: bool = True
+    connect_timeout_seconds: float = 10
+    command_timeout_seconds: float = 30
 
 
 @dataclass(frozen=True)
@@ -20,6 +22,84 @@ class TemplateVarsConfig:
     host: str
     sender: str
     confirm_url_format: str = "https://{host}/confirm/{email}?token={token}"
+    unsubscribe_url_format: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class RetryConfig:
+    base_delay_minutes: float = 5
+    max_delay_minutes: float = 12 * 60
+    max_attempts: int = 8
+
+
+@dataclass(frozen=True)
+class DigestConfig:
+    threshold: int = 2
+    window_minutes: Optional[float] = None
+
+
+@dataclass(frozen=True)
+class BatchDeliveryConfig:
+    max_recipients: int = 100
+    personalized: Optional[bool] = None
+
+
+@dataclass(frozen=True)
+class ThrottleConfig:
+    initial_rate_per_second: float = 2
+    min_rate_per_second: float = 0.05
+    max_rate_per_second: float = 20
+    burst: float = 10
+    additive_increase: float = 0.1
+    multiplicative_decrease: float = 0.5
+    max_deferrals: int = 3
+
+
+@dataclass(frozen=True)
+class SeenItemsConfig:
+    max_age_days: float = 90
+    max_entries: int = 10000
+
+
+@dataclass(frozen=True)
+class DaemonConfig:
+    poll_interval_seconds: float = 300
+    clean_interval_seconds: float = 24 * 60 * 60
+
+
+@dataclass(frozen=True)
+class WebhookConfig:
+    secret: str
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    ip_capacity: float = 20
+    ip_refill_per_hour: float = 60
+    email_capacity: float = 3
+    email_refill_per_hour: float = 6
+    max_entries: int = 10000
+    db: Optional[str] = None
+    trusted_proxies: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class LookupFilterConfig:
+    capacity: int = 100000
+    false_positive_rate: float = 0.01
+
+
+@dataclass(frozen=True)
+class BouncesConfig:
+    threshold: int = 3
+
+
+@dataclass(frozen=True)
+class FeedConfig:
+    db: str
+    rss: str
+    template_vars: Optional[TemplateVarsConfig] = None
+    email_templates: Optional[str] = None
 
 
 @dataclass(frozen=True)
@@ -29,4 +109,20 @@ class Config:
     template_vars: TemplateVarsConfig
     email_templates: str
     confirm_timeout_minutes: int
+    confirm_resend_window_minutes: float = 1
+    request_deadline_seconds: Optional[float] = 15
+    feed_timeout_seconds: float = 30
+    confirm_token_secret: Optional[str] = None
+    unsubscribe_token_secret: Optional[str] = None
     smtp: Optional[SmtpConfig] = None
+    retry: RetryConfig = RetryConfig()
+    digest: Optional[DigestConfig] = None
+    batch_delivery: Optional[BatchDeliveryConfig] = None
+    throttle: Optional[ThrottleConfig] = None
+    seen_items: SeenItemsConfig = SeenItemsConfig()
+    daemon: DaemonConfig = DaemonConfig()
+    webhook: Optional[WebhookConfig] = None
+    rate_limit: Optional[RateLimitConfig] = None
+    lookup_filter: Optional[LookupFilterConfig] = None
+    bounces: BouncesConfig = BouncesConfig()
+    feeds: Dict[str, FeedConfig] = field(default_factory=dict, compare=False)
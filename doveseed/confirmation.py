@@ -1,9 +1,12 @@
 from email.message import EmailMessage
+from smtplib import SMTPException
+from typing import Optional
 
 from typing_extensions import Protocol
 
+from .deadline import Deadline, DeadlineExceeded
 from .domain_types import Action, Email, Token
-from .smtp import ConnectionManager
+from .smtp import DeadlineConnectionManager
 
 
 class EmailMessageProvider(Protocol):
@@ -14,16 +17,31 @@ class EmailMessageProvider(Protocol):
 
 class EmailConfirmationRequester:
     def __init__(
-        self, *, connection: ConnectionManager, message_provider: EmailMessageProvider
+        self,
+        *,
+        connection: DeadlineConnectionManager,
+        message_provider: EmailMessageProvider,
     ):
         self._connection = connection
         self._message_provider = message_provider
 
     def request_confirmation(
-        self, email: Email, *, action: Action, confirm_token: Token
+        self,
+        email: Email,
+        *,
+        action: Action,
+        confirm_token: Token,
+        deadline: Optional[Deadline] = None,
     ) -> None:
         message = self._message_provider.get_confirmation_request_msg(
             email, action=action, confirm_token=confirm_token
         )
-        with self._connection() as connection:
-            connection.send_message(message)
+        if deadline is not None:
+            deadline.check()
+        try:
+            with self._connection(deadline=deadline) as connection:
+                connection.send_message(message)
+        except (SMTPException, OSError) as err:
+            if deadline is not None and deadline.expired:
+                raise DeadlineExceeded() from err
+            raise
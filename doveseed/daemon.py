@@ -0,0 +1,69 @@
+import logging
+import threading
+import time
+from typing import Callable, Optional
+
+Logger = logging.getLogger(__name__)
+
+
+class NotifierDaemon:
+    def __init__(
+        self,
+        *,
+        poll: Callable[[], None],
+        clean: Callable[[], None],
+        poll_interval_seconds: float,
+        clean_interval_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+        stop_event: Optional[threading.Event] = None,
+    ):
+        self._poll = poll
+        self._clean = clean
+        self._poll_interval_seconds = poll_interval_seconds
+        self._clean_interval_seconds = clean_interval_seconds
+        self._clock = clock
+        self._stop_event = stop_event or threading.Event()
+
+    def run(self) -> None:
+        next_clean = self._clock()
+        while not self._stop_event.is_set():
+            if self._clock() >= next_clean:
+                self._run_guarded("clean", self._clean)
+                next_clean = self._clock() + self._clean_interval_seconds
+            self._run_guarded("poll", self._poll)
+            self._stop_event.wait(self._poll_interval_seconds)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    def _run_guarded(self, name: str, task: Callable[[], None]) -> None:
+        try:
+            task()
+        except Exception:
+            Logger.exception("Notifier daemon failed to %s.", name)
+
+
+class CoalescingRunner:
+    def __init__(self, task: Callable[[], None]):
+        self._task = task
+        self._lock = threading.Lock()
+        self._running = False
+        self._rerun = False
+
+    def __call__(self) -> None:
+        with self._lock:
+            if self._running:
+                self._rerun = True
+                return
+            self._running = True
+
+        while True:
+            try:
+                self._task()
+            except Exception:
+                Logger.exception("Triggered notification run failed.")
+            with self._lock:
+                if not self._rerun:
+                    self._running = False
+                    return
+                self._rerun = False
@@ -0,0 +1,34 @@
+import time
+from typing import Callable, Optional
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self):
+        super().__init__("Deadline exceeded.")
+
+
+class Deadline:
+    def __init__(self, seconds: float, *, clock: Callable[[], float] = time.monotonic):
+        self._clock = clock
+        self._expires_at = clock() + seconds
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def remaining(self) -> float:
+        return max(0.0, self._expires_at - self._clock())
+
+    def check(self) -> None:
+        if self.expired:
+            raise DeadlineExceeded()
+
+    def timeout(self, limit: float) -> float:
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded()
+        return min(limit, remaining)
+
+
+def bounded_timeout(timeout: float, deadline: Optional[Deadline]) -> float:
+    return timeout if deadline is None else deadline.timeout(timeout)
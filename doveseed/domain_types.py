@@ -18,6 +18,7 @@ class FeedItem:
     pub_date: datetime
     description: str
     image: Optional[str]
+    guid: Optional[str] = None
 
 
 @dataclass
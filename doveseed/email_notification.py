@@ -1,38 +1,331 @@
+import logging
+import time
+from contextlib import ExitStack
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from email.message import EmailMessage
-from typing import Iterable
+from smtplib import (
+    SMTPException,
+    SMTPRecipientsRefused,
+    SMTPResponseException,
+    SMTPServerDisconnected,
+)
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
 
 from typing_extensions import Protocol
 
 from .domain_types import Email, FeedItem
 from .registration import Registration
 from .smtp import ConnectionManager
+from .throttle import DomainScheduler, email_domain
+
+Logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingDelivery:
+    email: Email
+    feed_items: List[FeedItem]
+    attempts: int
+    next_attempt: datetime
+    last_error: str
+
+
+@dataclass
+class FailedDelivery:
+    email: Email
+    feed_items: List[FeedItem]
+    attempts: int
+    failed_at: datetime
+    error: str
 
 
 class Storage(Protocol):
     def get_all_active_subscribers(self) -> Iterable[Registration]: ...
 
+    def get_due_deliveries(self, now: datetime) -> Iterable[PendingDelivery]: ...
+
+    def upsert_pending_delivery(self, delivery: PendingDelivery) -> None: ...
+
+    def delete_pending_delivery(
+        self, email: Email, feed_items: Sequence[FeedItem]
+    ) -> None: ...
+
+    def add_failed_delivery(self, delivery: FailedDelivery) -> None: ...
+
 
 class EmailMessageProvider(Protocol):
     def get_new_post_msg(
         self, feed_item: FeedItem, to_email: Email
     ) -> EmailMessage: ...
 
+    def get_new_posts_msg(
+        self, feed_items: Sequence[FeedItem], to_email: Email
+    ) -> EmailMessage: ...
+
+    def is_personalized(self, feed_items: Sequence[FeedItem]) -> bool: ...
+
+    def get_shared_msg(self, feed_items: Sequence[FeedItem]) -> EmailMessage: ...
+
 
 class EmailNotifier:
+    @dataclass(frozen=True)
+    class RetryPolicy:
+        base_delay_minutes: float = 5
+        max_delay_minutes: float = 12 * 60
+        max_attempts: int = 8
+
+        def delay(self, attempts: int) -> timedelta:
+            return timedelta(
+                minutes=min(
+                    self.base_delay_minutes * 2 ** (attempts - 1),
+                    self.max_delay_minutes,
+                )
+            )
+
+    @dataclass(frozen=True)
+    class BatchPolicy:
+        max_recipients: int = 100
+
     def __init__(
         self,
         storage: Storage,
         connection: ConnectionManager,
         message_provider: EmailMessageProvider,
+        *,
+        retry_policy: Optional[RetryPolicy] = None,
+        batch_policy: Optional[BatchPolicy] = None,
+        throttle_policy: Optional[DomainScheduler.Policy] = None,
+        utcnow: Callable[[], datetime] = datetime.utcnow,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
     ):
-        self._subscribers = list(storage.get_all_active_subscribers())
+        self._storage = storage
+        self._subscribers: Optional[List[Registration]] = None
         self._connection = connection
         self._message_provider = message_provider
+        self._retry_policy = retry_policy or self.RetryPolicy()
+        self._batch_policy = batch_policy
+        self._throttle_policy = throttle_policy
+        self._utcnow = utcnow
+        self._clock = clock
+        self._sleep = sleep
 
     def __call__(self, feed_item: FeedItem):
+        self._deliver_to_subscribers([feed_item])
+
+    def send_digest(self, feed_items: Sequence[FeedItem]):
+        self._deliver_to_subscribers(list(feed_items))
+
+    def _get_subscribers(self) -> List[Registration]:
+        if self._subscribers is None:
+            self._subscribers = list(self._storage.get_all_active_subscribers())
+        return self._subscribers
+
+    def _deliver_to_subscribers(self, feed_items: List[FeedItem]):
+        with ExitStack() as connections:
+            connection = connections.enter_context(self._connection())
+            shared_message: Optional[EmailMessage] = None
+            if self._batch_policy is not None and (
+                not self._message_provider.is_personalized(feed_items)
+            ):
+                shared_message = self._message_provider.get_shared_msg(feed_items)
+                max_recipients = self._batch_policy.max_recipients
+                if connection.max_recipients is not None:
+                    max_recipients = min(max_recipients, connection.max_recipients)
+            emails = [subscriber.email for subscriber in self._get_subscribers()]
+            batches = (
+                _batches_by_domain(emails, max_recipients)
+                if shared_message is not None
+                else ([email] for email in emails)
+            )
+
+            if self._throttle_policy is None:
+                for batch in batches:
+                    failures = self._send(connection, batch, feed_items, shared_message)
+                    if _is_disconnected(failures):
+                        connection = self._reconnect(connections, failures)
+                    self._handle_failures(feed_items, failures)
+            else:
+                self._deliver_throttled(
+                    connections,
+                    connection,
+                    batches,
+                    feed_items,
+                    shared_message,
+                    self._throttle_policy,
+                )
+
+    def _deliver_throttled(
+        self,
+        connections: ExitStack,
+        connection,
+        batches: Iterable[List[Email]],
+        feed_items: List[FeedItem],
+        shared_message: Optional[EmailMessage],
+        throttle_policy: DomainScheduler.Policy,
+    ):
+        scheduler: DomainScheduler[List[Email]] = DomainScheduler(
+            throttle_policy, clock=self._clock, sleep=self._sleep
+        )
+        for batch in batches:
+            scheduler.add(email_domain(batch[0]), batch)
+        for domain, batch in scheduler:
+            failures = self._send(connection, batch, feed_items, shared_message)
+            disconnected = _is_disconnected(failures)
+            if disconnected:
+                connection = self._reconnect(connections, failures)
+            throttled = [
+                email
+                for email, err in failures.items()
+                if disconnected or _is_throttled(_smtp_error_code(err, email))
+            ]
+            if len(throttled) == 0:
+                scheduler.succeed()
+            elif scheduler.defer(throttled):
+                Logger.info("Throttling delivery to %s: %s", domain, failures)
+                for email in throttled:
+                    del failures[email]
+            self._handle_failures(feed_items, failures)
+
+    def _reconnect(self, connections: ExitStack, failures: Dict[Email, SMTPException]):
+        Logger.warning("Reconnecting after the SMTP server hung up: %s", failures)
+        connections.pop_all().close()
+        return connections.enter_context(self._connection())
+
+    def _send(
+        self,
+        connection,
+        batch: List[Email],
+        feed_items: List[FeedItem],
+        shared_message: Optional[EmailMessage],
+    ) -> Dict[Email, SMTPException]:
+        try:
+            if shared_message is None:
+                (email,) = batch
+                connection.send_message(self._create_message(email, feed_items))
+                return {}
+            refused = connection.send_message(shared_message, to_addrs=batch)
+        except SMTPException as err:
+            return {email: err for email in batch}
+        return {
+            Email(email): SMTPRecipientsRefused({email: response})
+            for email, response in refused.items()
+        }
+
+    def _handle_failures(
+        self, feed_items: List[FeedItem], failures: Dict[Email, SMTPException]
+    ):
+        for email, err in failures.items():
+            self._handle_failure(email, feed_items, 1, err)
+
+    def retry_pending(self) -> None:
+        due_deliveries = list(self._storage.get_due_deliveries(self._utcnow()))
+        if len(due_deliveries) == 0:
+            return
+
+        active = {subscriber.email for subscriber in self._get_subscribers()}
+        due = []
+        for delivery in due_deliveries:
+            if delivery.email in active:
+                due.append(delivery)
+            else:
+                self._storage.delete_pending_delivery(
+                    delivery.email, delivery.feed_items
+                )
+        if len(due) == 0:
+            return
+
         with self._connection() as connection:
-            for subscriber in self._subscribers:
-                message = self._message_provider.get_new_post_msg(
-                    feed_item, subscriber.email
+            for delivery in due:
+                self._deliver(
+                    connection,
+                    delivery.email,
+                    delivery.feed_items,
+                    attempts=delivery.attempts,
+                )
+
+    def _deliver(
+        self, connection, email: Email, feed_items: List[FeedItem], *, attempts
+    ):
+        try:
+            connection.send_message(self._create_message(email, feed_items))
+        except SMTPException as err:
+            self._handle_failure(email, feed_items, attempts + 1, err)
+        else:
+            if attempts > 0:
+                self._storage.delete_pending_delivery(email, feed_items)
+
+    def _create_message(self, email: Email, feed_items: List[FeedItem]):
+        if len(feed_items) == 1:
+            return self._message_provider.get_new_post_msg(feed_items[0], email)
+        return self._message_provider.get_new_posts_msg(feed_items, email)
+
+    def _handle_failure(
+        self,
+        email: Email,
+        feed_items: List[FeedItem],
+        attempts: int,
+        err: SMTPException,
+    ):
+        now = self._utcnow()
+        code = _smtp_error_code(err, email)
+        if _is_transient(code) and attempts < self._retry_policy.max_attempts:
+            Logger.warning("Deferring delivery to %s: %s", email, err)
+            self._storage.upsert_pending_delivery(
+                PendingDelivery(
+                    email=email,
+                    feed_items=feed_items,
+                    attempts=attempts,
+                    next_attempt=now + self._retry_policy.delay(attempts),
+                    last_error=str(err),
                 )
-                connection.send_message(message)
+            )
+        else:
+            Logger.error("Delivery to %s failed permanently: %s", email, err)
+            self._storage.add_failed_delivery(
+                FailedDelivery(
+                    email=email,
+                    feed_items=feed_items,
+                    attempts=attempts,
+                    failed_at=now,
+                    error=str(err),
+                )
+            )
+            if attempts > 1:
+                self._storage.delete_pending_delivery(email, feed_items)
+
+
+def _batches_by_domain(
+    emails: Iterable[Email], max_recipients: int
+) -> Iterator[List[Email]]:
+    by_domain: Dict[str, List[Email]] = {}
+    for email in emails:
+        by_domain.setdefault(email_domain(email), []).append(email)
+    for domain_emails in by_domain.values():
+        for start in range(0, len(domain_emails), max_recipients):
+            yield domain_emails[start : start + max_recipients]
+
+
+def _smtp_error_code(err: SMTPException, email: Email) -> Optional[int]:
+    if isinstance(err, SMTPRecipientsRefused):
+        code, _ = err.recipients.get(email, (None, b""))
+        return code
+    if isinstance(err, SMTPResponseException):
+        return err.smtp_code
+    return None
+
+
+def _is_disconnected(failures: Dict[Email, SMTPException]) -> bool:
+    return any(
+        isinstance(err, SMTPServerDisconnected) or _smtp_error_code(err, email) == 421
+        for email, err in failures.items()
+    )
+
+
+def _is_transient(code: Optional[int]) -> bool:
+    return code is None or 400 <= code < 500
+
+
+def _is_throttled(code: Optional[int]) -> bool:
+    return code is not None and 400 <= code < 500
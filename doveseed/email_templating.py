@@ -3,13 +3,18 @@ import os.path
 from base64 import b64encode
 from dataclasses import dataclass
 from email.message import EmailMessage, Message, MIMEPart
-from typing import List, Mapping, Optional, Tuple, cast
+from typing import Dict, List, Mapping, Optional, Sequence, Set, Tuple, cast
 from urllib.parse import quote
 from uuid import uuid1
 
-from jinja2 import Environment
+from jinja2 import Environment, meta
 
 from .domain_types import Action, Email, FeedItem, Token
+from .token_gen import UnsubscribeTokenSigner
+
+MAX_HEADER_LINE_LENGTH = 998
+UNDISCLOSED_RECIPIENTS = Email("undisclosed-recipients:;")
+RECIPIENT_VARIABLES = frozenset(("to_email",))
 
 
 class FileSystemBinaryLoader:
@@ -28,10 +33,22 @@ class EmailFromTemplateProvider:
         sender: str
         host: str
         confirm_url_format: str
+        unsubscribe_url_format: Optional[str] = None
 
-    def __init__(self, *, settings: Settings, template_loader, binary_loader):
+    def __init__(
+        self,
+        *,
+        settings: Settings,
+        template_loader,
+        binary_loader,
+        unsubscribe_signer: Optional[UnsubscribeTokenSigner] = None,
+        personalized: Optional[bool] = None,
+    ):
         self.settings = settings
         self._binary_loader = binary_loader
+        self._unsubscribe_signer = unsubscribe_signer
+        self._personalized = personalized
+        self._personalized_templates: Dict[str, bool] = {}
         self._env = Environment(loader=template_loader)
         self._env.filters["b64encode"] = lambda x: b64encode(x).decode("ascii")
         self._env.filters["urlquote"] = quote
@@ -67,7 +84,74 @@ class EmailFromTemplateProvider:
             }
         )
 
-        return self._msg_from_template("new-post", to_email, substitutions)
+        msg = self._msg_from_template("new-post", to_email, substitutions)
+        self._add_list_unsubscribe_headers(msg, to_email)
+        return msg
+
+    def get_new_posts_msg(
+        self, feed_items: Sequence[FeedItem], to_email: Email
+    ) -> EmailMessage:
+        substitutions = {
+            "display_name": self.settings.display_name,
+            "host": self.settings.host,
+            "to_email": to_email,
+            "posts": sorted(feed_items, key=lambda item: item.pub_date),
+        }
+
+        msg = self._msg_from_template("new-posts", to_email, substitutions)
+        self._add_list_unsubscribe_headers(msg, to_email)
+        return msg
+
+    def is_personalized(self, feed_items: Sequence[FeedItem]) -> bool:
+        if self._has_list_unsubscribe_headers():
+            return True
+        if self._personalized is not None:
+            return self._personalized
+        template = "new-post" if len(feed_items) == 1 else "new-posts"
+        if template not in self._personalized_templates:
+            self._personalized_templates[template] = any(
+                self._references_recipient(f"{template}{suffix}", set())
+                for suffix in (".subject.txt", ".txt", ".html")
+            )
+        return self._personalized_templates[template]
+
+    def get_shared_msg(self, feed_items: Sequence[FeedItem]) -> EmailMessage:
+        if len(feed_items) == 1:
+            return self.get_new_post_msg(feed_items[0], UNDISCLOSED_RECIPIENTS)
+        return self.get_new_posts_msg(feed_items, UNDISCLOSED_RECIPIENTS)
+
+    def _references_recipient(self, template: str, seen: Set[str]) -> bool:
+        seen.add(template)
+        assert self._env.loader is not None
+        source, _, _ = self._env.loader.get_source(self._env, template)
+        ast = self._env.parse(source)
+        if not RECIPIENT_VARIABLES.isdisjoint(meta.find_undeclared_variables(ast)):
+            return True
+        return any(
+            referenced is None
+            or (referenced not in seen and self._references_recipient(referenced, seen))
+            for referenced in meta.find_referenced_templates(ast)
+        )
+
+    def _has_list_unsubscribe_headers(self) -> bool:
+        return (
+            self._unsubscribe_signer is not None
+            and self.settings.unsubscribe_url_format is not None
+        )
+
+    def _add_list_unsubscribe_headers(self, msg: EmailMessage, to_email: Email):
+        if not self._has_list_unsubscribe_headers():
+            return
+        assert self._unsubscribe_signer is not None
+        assert self.settings.unsubscribe_url_format is not None
+        unsubscribe_link = self.settings.unsubscribe_url_format.format(
+            email=quote(to_email),
+            host=self.settings.host,
+            token=quote(self._unsubscribe_signer.sign(to_email).to_string()),
+        )
+        msg.policy = msg.policy.clone(max_line_length=MAX_HEADER_LINE_LENGTH)
+        msg["List-Unsubscribe"] = f"<{unsubscribe_link}>"
+        msg["List-Unsubscribe-Post"] = "List-Unsubscribe=One-Click"
 
     def _msg_from_template(
         self, template: str, to_email: str, substitutions: Mapping[str, object]
@@ -1,14 +1,69 @@
+import gzip
+import urllib.error
 import urllib.request
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
 from email.utils import parsedate_to_datetime
-from typing import Iterable
+from http import HTTPStatus
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple, cast
 from xml.etree import ElementTree
 
 from .domain_types import FeedItem
 
+DEFAULT_TIMEOUT_SECONDS = 30.0
 
-def get_feed(url: str) -> ElementTree.Element:
-    with urllib.request.urlopen(url) as response:
-        return ElementTree.fromstringlist(response)
+
+@dataclass(frozen=True)
+class CacheValidators:
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class FeedNotModified(Exception):
+    pass
+
+
+@contextmanager
+def open_feed(
+    url: str,
+    *,
+    validators: Optional[CacheValidators] = None,
+    timeout: float = DEFAULT_TIMEOUT_SECONDS,
+) -> Iterator[Tuple[IO[bytes], CacheValidators]]:
+    headers = {"Accept-Encoding": "gzip"}
+    if validators is not None and validators.etag is not None:
+        headers["If-None-Match"] = validators.etag
+    if validators is not None and validators.last_modified is not None:
+        headers["If-Modified-Since"] = validators.last_modified
+
+    try:
+        response = urllib.request.urlopen(
+            urllib.request.Request(url, headers=headers), timeout=timeout
+        )
+    except urllib.error.HTTPError as err:
+        if err.code == HTTPStatus.NOT_MODIFIED:
+            raise FeedNotModified(url) from err
+        raise
+
+    with response:
+        stream: IO[bytes] = response
+        if response.headers.get("Content-Encoding", "").lower() == "gzip":
+            stream = cast(IO[bytes], gzip.GzipFile(fileobj=response))
+        yield (
+            stream,
+            CacheValidators(
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            ),
+        )
+
+
+def get_feed(
+    url: str, *, timeout: float = DEFAULT_TIMEOUT_SECONDS
+) -> ElementTree.Element:
+    with open_feed(url, timeout=timeout) as (stream, _):
+        return ElementTree.parse(stream).getroot()
 
 
 def parse_rss(rss: ElementTree.Element) -> Iterable[FeedItem]:
@@ -17,17 +72,69 @@ def parse_rss(rss: ElementTree.Element) -> Iterable[FeedItem]:
         return
     for item in channel.findall("item"):
         try:
-            yield FeedItem(
-                title=_get_optional(item, "title", ""),
-                link=_get_required(item, "link"),
-                pub_date=parsedate_to_datetime(_get_required(item, "pubDate")),
-                description=_get_optional(item, "description", ""),
-                image=_get_optional(item, "og:image"),
-            )
+            yield _parse_item(item)
         except RequiredElementError:
             pass
 
 
+def iter_rss(
+    source: IO[bytes],
+    *,
+    is_seen: Optional[Callable[[FeedItem], bool]] = None,
+    seen_cutoff: Optional[datetime] = None,
+) -> Iterator[FeedItem]:
+    path: List[ElementTree.Element] = []
+    previous_pub_date: Optional[datetime] = None
+    reverse_chronological = True
+    decreasing = False
+
+    for event, elem in ElementTree.iterparse(source, events=("start", "end")):
+        if event == "start":
+            path.append(elem)
+            continue
+
+        path.pop()
+        if len(path) != 2 or path[1].tag != "channel" or elem.tag != "item":
+            continue
+
+        try:
+            feed_item: Optional[FeedItem] = _parse_item(elem)
+        except RequiredElementError:
+            feed_item = None
+        path[-1].remove(elem)
+        if feed_item is None:
+            continue
+
+        if previous_pub_date is not None:
+            if feed_item.pub_date > previous_pub_date:
+                reverse_chronological = False
+            elif feed_item.pub_date < previous_pub_date:
+                decreasing = True
+        previous_pub_date = feed_item.pub_date
+        stop = (
+            reverse_chronological
+            and decreasing
+            and seen_cutoff is not None
+            and feed_item.pub_date <= seen_cutoff
+            and is_seen is not None
+            and is_seen(feed_item)
+        )
+        yield feed_item
+        if stop:
+            return
+
+
+def _parse_item(item: ElementTree.Element) -> FeedItem:
+    return FeedItem(
+        title=_get_optional(item, "title", ""),
+        link=_get_required(item, "link"),
+        pub_date=parsedate_to_datetime(_get_required(item, "pubDate")),
+        description=_get_optional(item, "description", ""),
+        image=_get_optional(item, "og:image"),
+        guid=_get_optional(item, "guid"),
+    )
+
+
 _ns = {"og": "http://ogp.me/ns#"}
 
 
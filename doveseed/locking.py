@@ -0,0 +1,51 @@
+import fcntl
+import threading
+from typing import IO, Optional
+
+
+class FileLock:
+    def __init__(self, path: str):
+        self._path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file: Optional[IO] = None
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        if not self._thread_lock.acquire(blocking=blocking):
+            return False
+        try:
+            if self._depth == 0:
+                self._file = open(self._path, "a", encoding="utf-8")
+                fcntl.flock(
+                    self._file,
+                    fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB,
+                )
+            self._depth += 1
+        except BlockingIOError:
+            self._close()
+            return False
+        except BaseException:
+            self._close()
+            raise
+        return True
+
+    def release(self) -> None:
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def _close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.release()
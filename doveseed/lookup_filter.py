@@ -0,0 +1,94 @@
+import hashlib
+import math
+import threading
+from contextlib import AbstractContextManager
+from typing import Callable, Hashable, Iterable, Iterator, Optional
+
+from typing_extensions import Protocol
+
+from .domain_types import Email
+from .registration import Transition
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, false_positive_rate: float):
+        capacity = max(capacity, 1)
+        self._size = max(
+            8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        )
+        self._num_hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    def add(self, key: str) -> None:
+        for index in self._indices(key):
+            self._bits[index // 8] |= 1 << (index % 8)
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[index // 8] & (1 << (index % 8)) for index in self._indices(key)
+        )
+
+    def _indices(self, key: str) -> Iterator[int]:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self._size for i in range(self._num_hashes))
+
+
+class Storage(Protocol):
+    def update(self, email: Email, transition: Transition) -> None: ...
+
+    def emails(self) -> Iterable[Email]: ...
+
+    def clear_cache(self) -> None: ...
+
+
+class FilteredStorage:
+    def __init__(
+        self,
+        storage: Storage,
+        *,
+        capacity: int,
+        false_positive_rate: float,
+        version: Callable[[], Hashable] = lambda: None,
+        lock: Optional[AbstractContextManager] = None,
+    ):
+        self._storage = storage
+        self._capacity = capacity
+        self._false_positive_rate = false_positive_rate
+        self._version = version
+        self._lock = lock if lock is not None else threading.RLock()
+        with self._lock:
+            self._rebuild()
+
+    def _rebuild(self) -> None:
+        version = self._version()
+        bloom_filter = BloomFilter(self._capacity, self._false_positive_rate)
+        self._storage.clear_cache()
+        for email in self._storage.emails():
+            bloom_filter.add(email)
+        self._filter = bloom_filter
+        self._filter_version = version
+
+    def update(self, email: Email, transition: Transition) -> None:
+        if not self._might_contain(email) and transition(None) is None:
+            return
+        with self._lock:
+            up_to_date = self._version() == self._filter_version
+            self._filter.add(email)
+            self._storage.update(email, transition)
+            if up_to_date:
+                self._filter_version = self._version()
+
+    def _might_contain(self, email: Email) -> bool:
+        if email in self._filter:
+            return True
+        with self._lock:
+            if self._version() == self._filter_version:
+                return False
+            self._rebuild()
+        return email in self._filter
@@ -1,5 +1,9 @@
-from datetime import datetime, timezone
-from typing import Iterable, Optional
+import heapq
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from hashlib import sha256
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Sequence
 
 from typing_extensions import Protocol
 
@@ -9,37 +13,131 @@ from .domain_types import FeedItem
 class Storage(Protocol):
     def get_last_seen(self) -> Optional[datetime]: ...
 
-    def set_last_seen(self, value: datetime) -> None: ...
+    def get_seen_items(self) -> Optional[Dict[str, datetime]]: ...
+
+    def set_seen_items(self, seen_items: Mapping[str, datetime]) -> None: ...
 
 
 class Consumer(Protocol):
     def __call__(self, feed_item: FeedItem) -> None: ...
 
 
+class DigestConsumer(Protocol):
+    def __call__(self, feed_items: Sequence[FeedItem]) -> None: ...
+
+
 Feed = Iterable[FeedItem]
 
 
+def seen_item_key(feed_item: FeedItem) -> str:
+    identifier = feed_item.guid or feed_item.link
+    return sha256(identifier.encode("utf-8")).hexdigest()[:16]
+
+
 class NewPostNotifier:
-    def __init__(self, storage: Storage, consumer: Consumer):
+    @dataclass(frozen=True)
+    class DigestPolicy:
+        threshold: int = 2
+        window_minutes: Optional[float] = None
+
+        def __post_init__(self):
+            if self.threshold < 2:
+                raise ValueError("Digest threshold must be at least 2.")
+
+        def group(self, chronological: Sequence[FeedItem]) -> List[List[FeedItem]]:
+            if self.window_minutes is None:
+                return [list(chronological)] if len(chronological) > 0 else []
+
+            window = timedelta(minutes=self.window_minutes)
+            groups: List[List[FeedItem]] = []
+            for item in chronological:
+                if len(groups) > 0 and item.pub_date - groups[-1][0].pub_date <= window:
+                    groups[-1].append(item)
+                else:
+                    groups.append([item])
+            return groups
+
+    @dataclass(frozen=True)
+    class SeenItemsPolicy:
+        max_age_days: float = 90
+        max_entries: int = 10000
+
+    def __init__(
+        self,
+        storage: Storage,
+        consumer: Consumer,
+        *,
+        digest_consumer: Optional[DigestConsumer] = None,
+        digest_policy: Optional[DigestPolicy] = None,
+        seen_items_policy: Optional[SeenItemsPolicy] = None,
+        utcnow: Callable[[], datetime] = partial(datetime.now, tz=timezone.utc),
+    ):
         self._storage = storage
         self._consumer = consumer
+        self._digest_consumer = digest_consumer
+        self._digest_policy = digest_policy or self.DigestPolicy()
+        self._seen_items_policy = seen_items_policy or self.SeenItemsPolicy()
+        self._now = utcnow()
+        self._seen_items: Optional[Dict[str, datetime]] = None
+        self._seen_cutoff: Optional[datetime] = None
+
+    @property
+    def seen_cutoff(self) -> Optional[datetime]:
+        self._get_seen_items()
+        return self._seen_cutoff
+
+    def is_seen(self, feed_item: FeedItem) -> bool:
+        seen_items = self._get_seen_items()
+        if seen_item_key(feed_item) in seen_items:
+            return True
+        return self._seen_cutoff is not None and feed_item.pub_date <= self._seen_cutoff
+
+    def _get_seen_items(self) -> Dict[str, datetime]:
+        if self._seen_items is None:
+            self._seen_items = self._storage.get_seen_items()
+            self._seen_cutoff = self._now - timedelta(
+                days=self._seen_items_policy.max_age_days
+            )
+            if self._seen_items is None:
+                self._seen_items = {}
+                self._seen_cutoff = self._storage.get_last_seen()
+        return self._seen_items
 
     def __call__(self, feed: Feed) -> None:
-        cutoff = self._storage.get_last_seen()
-        feed = list(feed)
-        last_seen = (
-            max(item.pub_date for item in feed)
-            if len(feed) > 0
-            else datetime.now(tz=timezone.utc)
-        )
-        self._storage.set_last_seen(last_seen)
-        chronological = sorted(
-            self._select_new_posts(feed, cutoff), key=lambda item: item.pub_date
-        )
-        for item in chronological:
-            self._consumer(item)
+        seen_items = self._get_seen_items()
+        new_posts = []
+        for item in feed:
+            if not self.is_seen(item):
+                new_posts.append(item)
+            seen_items[seen_item_key(item)] = self._now
+        self._storage.set_seen_items(self._evict(seen_items))
+
+        chronological = sorted(new_posts, key=lambda item: item.pub_date)
+        if self._digest_consumer is None:
+            for item in chronological:
+                self._consumer(item)
+            return
 
-    def _select_new_posts(self, feed: Feed, cutoff: Optional[datetime]):
-        if cutoff is None:
-            return feed
-        return (item for item in feed if item.pub_date > cutoff)
+        for group in self._digest_policy.group(chronological):
+            if len(group) >= self._digest_policy.threshold:
+                self._digest_consumer(group)
+            else:
+                for item in group:
+                    self._consumer(item)
+
+    def _evict(self, seen_items: Dict[str, datetime]) -> Dict[str, datetime]:
+        max_age = timedelta(days=self._seen_items_policy.max_age_days)
+        recent = {
+            key: seen_at
+            for key, seen_at in seen_items.items()
+            if self._now - seen_at <= max_age
+        }
+        if len(recent) <= self._seen_items_policy.max_entries:
+            return recent
+        return dict(
+            heapq.nlargest(
+                self._seen_items_policy.max_entries,
+                recent.items(),
+                key=lambda entry: entry[1],
+            )
+        )
@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from typing_extensions import Protocol
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, retry_after_seconds: float):
+        super().__init__("Too many requests.")
+        self.retry_after_seconds = retry_after_seconds
+
+
+class BucketStore(Protocol):
+    def take(
+        self, key: str, *, capacity: float, refill_per_second: float, now: float
+    ) -> float: ...
+
+
+def _refill(
+    bucket: Optional[Tuple[float, float]],
+    *,
+    capacity: float,
+    refill_per_second: float,
+    now: float,
+) -> Tuple[float, float]:
+    if bucket is None:
+        tokens = capacity
+    else:
+        tokens, updated = bucket
+        tokens = min(capacity, tokens + max(0.0, now - updated) * refill_per_second)
+    if tokens >= 1:
+        return tokens - 1, 0.0
+    return tokens, (1 - tokens) / refill_per_second
+
+
+class MemoryBucketStore:
+    def __init__(self, max_entries: int = 10000):
+        self._max_entries = max_entries
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(
+        self, key: str, *, capacity: float, refill_per_second: float, now: float
+    ) -> float:
+        with self._lock:
+            tokens, retry_after = _refill(
+                self._buckets.pop(key, None),
+                capacity=capacity,
+                refill_per_second=refill_per_second,
+                now=now,
+            )
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self._max_entries:
+                self._buckets.popitem(last=False)
+            return retry_after
+
+
+class SqliteBucketStore:
+    PRUNE_INTERVAL = 100
+
+    def __init__(self, path: str, max_entries: int = 10000):
+        self._path = path
+        self._max_entries = max_entries
+        self._local = threading.local()
+        self._takes = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets "
+            "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def take(
+        self, key: str, *, capacity: float, refill_per_second: float, now: float
+    ) -> float:
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            tokens, retry_after = _refill(
+                connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (key,)
+                ).fetchone(),
+                capacity=capacity,
+                refill_per_second=refill_per_second,
+                now=now,
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            self._takes += 1
+            if self._takes % self.PRUNE_INTERVAL == 0:
+                connection.execute(
+                    "DELETE FROM buckets WHERE key IN "
+                    "(SELECT key FROM buckets ORDER BY updated DESC LIMIT -1 OFFSET ?)",
+                    (self._max_entries,),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return retry_after
+
+
+class RateLimiter:
+    @dataclass(frozen=True)
+    class Rate:
+        capacity: float
+        refill_per_hour: float
+
+    def __init__(
+        self,
+        store: BucketStore,
+        *,
+        per_ip: Rate,
+        per_email: Rate,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._store = store
+        self._per_ip = per_ip
+        self._per_email = per_email
+        self._clock = clock
+
+    def acquire(self, *, ip: Optional[str], email: str) -> None:
+        if ip is not None:
+            self._take(f"ip:{ip}", self._per_ip)
+        self._take(f"email:{email.strip().lower()}", self._per_email)
+
+    def _take(self, key: str, rate: Rate) -> None:
+        retry_after = self._store.take(
+            key,
+            capacity=rate.capacity,
+            refill_per_second=rate.refill_per_hour / 3600,
+            now=self._clock(),
+        )
+        if retry_after > 0:
+            raise RateLimitExceeded(retry_after)
@@ -1,54 +1,230 @@
+import asyncio
 import json
 import logging
 import re
 import socket
-from typing import Optional
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
 
 import aiohttp
-from fastapi import Request, status
+from fastapi import status
 from fastapi.responses import PlainTextResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .client_address import TrustedProxies, parse_ip_address
 
 Logger = logging.getLogger(__name__)
 
+DEFAULT_VERIFY_URL = "https://www.google.com/recaptcha/api/siteverify"
+RESOLVED_HOSTS_TTL_SECONDS = 300
+RESOLVED_HOSTS_MAX_SIZE = 1024
+VERIFICATIONS_MAX_SIZE = 10000
+
+
+class VerificationOverloadedError(Exception):
+    pass
+
 
-class ReCaptchaMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, paths, config_path):
-        super().__init__(app)
+@dataclass(frozen=True)
+class _Verification:
+    success: bool
+    path: str
+    expires: float
+
+
+class ReCaptchaMiddleware:
+    def __init__(self, app: ASGIApp, paths: str, config_path: str):
+        self.app = app
         self.paths = re.compile(paths)
         with open(config_path, encoding="utf-8") as f:
             config = json.load(f)
         self.valid_hostnames = config["hostnames"]
         self._secret = config["secret"]
+        self._verify_url = config.get("verify_url", DEFAULT_VERIFY_URL)
+        self._trusted_proxies = TrustedProxies(config.get("trusted_proxies", []))
+        self._cache_ttl_seconds = config.get("cache_ttl_seconds", 120)
+        self._max_concurrent_verifications = config.get(
+            "max_concurrent_verifications", 10
+        )
+        self._max_waiting_verifications = config.get("max_waiting_verifications", 100)
+        self._retry_after_seconds = config.get("retry_after_seconds", 5)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._resolved_hosts: Dict[str, Tuple[Optional[str], float]] = {}
+        self._verifications: Dict[str, _Verification] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._waiting_verifications = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self._handle_lifespan(scope, receive, send)
+            return
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not self.paths.match(scope["path"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        body = await _read_body(receive)
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict) or "captcha" not in data:
+            response = PlainTextResponse(
+                status_code=status.HTTP_400_BAD_REQUEST, content="Missing captcha."
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            is_valid = await self._is_valid_captcha(str(data["captcha"]), scope)
+        except VerificationOverloadedError:
+            response = PlainTextResponse(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                content="Too many pending captcha verifications.",
+                headers={"Retry-After": str(self._retry_after_seconds)},
+            )
+            await response(scope, receive, send)
+            return
+        if not is_valid:
+            response = PlainTextResponse(
+                status_code=status.HTTP_401_UNAUTHORIZED, content="Invalid captcha."
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, _replay_body(body, receive), send)
+
+    async def _is_valid_captcha(self, captcha: str, scope: Scope) -> bool:
+        now = time.monotonic()
+        verification = self._verifications.get(captcha)
+        if verification is not None and verification.expires > now:
+            return verification.success and verification.path == scope["path"]
+
+        success = await self._verify_limited(captcha, await self.get_remote_ip(scope))
+
+        if len(self._verifications) >= VERIFICATIONS_MAX_SIZE:
+            self._verifications = {
+                key: value
+                for key, value in self._verifications.items()
+                if value.expires > now
+            }
+        if len(self._verifications) >= VERIFICATIONS_MAX_SIZE:
+            del self._verifications[next(iter(self._verifications))]
+        self._verifications[captcha] = _Verification(
+            success=success,
+            path=scope["path"],
+            expires=now + self._cache_ttl_seconds,
+        )
+        return success
+
+    async def _verify_limited(self, captcha: str, remote_ip: Optional[str]) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._max_concurrent_verifications)
+        if (
+            self._semaphore.locked()
+            and self._waiting_verifications >= self._max_waiting_verifications
+        ):
+            raise VerificationOverloadedError()
+
+        self._waiting_verifications += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self._waiting_verifications -= 1
+        try:
+            return await self.verify_captcha(captcha, remote_ip)
+        finally:
+            self._semaphore.release()
 
-    async def dispatch(self, request: Request, call_next):
-        if self.paths.match(request.url.path) and request.method == "POST":
-            data = await request.json()
-            # pylint: disable=unsupported-membership-test,unsubscriptable-object
-            if data is None or "captcha" not in data:
-                return PlainTextResponse(
-                    status_code=status.HTTP_400_BAD_REQUEST, content="Missing captcha."
-                )
-            if not await self.verify_captcha(
-                data["captcha"],
-                socket.gethostbyname(request.client.host) if request.client else None,
-            ):
-                return PlainTextResponse(
-                    status_code=status.HTTP_401_UNAUTHORIZED, content="Invalid captcha."
-                )
-        return await call_next(request)
+    async def _handle_lifespan(self, scope: Scope, receive: Receive, send: Send):
+        async def lifespan_receive() -> Message:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._get_session()
+            return message
+
+        async def lifespan_send(message: Message) -> None:
+            if message["type"] == "lifespan.shutdown.complete":
+                await self.close()
+            await send(message)
+
+        await self.app(scope, lifespan_receive, lifespan_send)
+
+    async def get_remote_ip(self, scope: Scope) -> Optional[str]:
+        host = self._trusted_proxies.get_client_host(scope)
+        if host is None:
+            return None
+        return await self._resolve(host)
+
+    async def _resolve(self, host: str) -> Optional[str]:
+        if parse_ip_address(host) is not None:
+            return host
+
+        now = time.monotonic()
+        if host in self._resolved_hosts:
+            cached_address, expires = self._resolved_hosts[host]
+            if expires > now:
+                return cached_address
+
+        address: Optional[str]
+        try:
+            address_infos = await asyncio.get_running_loop().getaddrinfo(
+                host, None, type=socket.SOCK_STREAM
+            )
+            address = str(address_infos[0][4][0])
+        except OSError as err:
+            Logger.warning("Failed to resolve client host %s: %s", host, err)
+            address = None
+
+        self._resolved_hosts.pop(host, None)
+        if len(self._resolved_hosts) >= RESOLVED_HOSTS_MAX_SIZE:
+            del self._resolved_hosts[next(iter(self._resolved_hosts))]
+        self._resolved_hosts[host] = (address, now + RESOLVED_HOSTS_TTL_SECONDS)
+        return address
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
 
     async def verify_captcha(self, captcha: str, remote_ip: Optional[str]):
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://www.google.com/recaptcha/api/siteverify",
-                data={
-                    "secret": self._secret,
-                    "response": captcha,
-                    "remoteip": remote_ip,
-                },
-            ) as response:
-                result = await response.json()
+        data = {"secret": self._secret, "response": captcha}
+        if remote_ip is not None:
+            data["remoteip"] = remote_ip
+        async with self._get_session().post(self._verify_url, data=data) as response:
+            result = await response.json()
         if len(result.get("error-codes", [])) > 0:
             Logger.warning(result["error-codes"])
         return result["success"] and result["hostname"] in self.valid_hostnames
+
+
+async def _read_body(receive: Receive) -> bytes:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+def _replay_body(body: bytes, receive: Receive) -> Receive:
+    replayed = False
+
+    async def replay() -> Message:
+        nonlocal replayed
+        if replayed:
+            return await receive()
+        replayed = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return replay
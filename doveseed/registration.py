@@ -1,11 +1,16 @@
+import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from email.utils import getaddresses
-from typing import Callable, Iterator, Optional
+from typing import Callable, Iterator, Optional, Tuple
 
 from typing_extensions import Protocol
 
+from .deadline import Deadline
 from .domain_types import Action, Email, State, Token
+from .token_gen import TokenSigner, UnsubscribeTokenSigner
 
 
 @dataclass
@@ -17,20 +22,27 @@ class Registration:
     confirm_action: Optional[Action] = None
 
 
-class Storage(Protocol):
-    def upsert(self, registration: Registration) -> None: ...
+Transition = Callable[[Optional[Registration]], Optional[Registration]]
 
-    def find(self, email: Email) -> Optional[Registration]: ...
 
-    def delete(self, email: Email) -> None: ...
+class Storage(Protocol):
+    def update(self, email: Email, transition: Transition) -> None: ...
 
 
 class ConfirmationRequester(Protocol):
     def request_confirmation(
-        self, email: Email, *, action: Action, confirm_token: Token
+        self,
+        email: Email,
+        *,
+        action: Action,
+        confirm_token: Token,
+        deadline: Optional[Deadline] = None,
     ) -> None: ...
 
 
+RECENT_REQUESTS_MAX_SIZE = 10000
+
+
 class RegistrationService:
     def __init__(
         self,
@@ -39,73 +51,186 @@ class RegistrationService:
         confirmation_requester: ConfirmationRequester,
         token_generator: Iterator[Token],
         utcnow: Callable[[], datetime],
+        resend_window: timedelta = timedelta(0),
+        token_signer: Optional[TokenSigner] = None,
+        unsubscribe_signer: Optional[UnsubscribeTokenSigner] = None,
     ):
         self._storage = storage
         self._confirmation_requester = confirmation_requester
         self._token_generator = token_generator
         self._utcnow = utcnow
+        self._resend_window = resend_window
+        self._token_signer = token_signer
+        self._unsubscribe_signer = unsubscribe_signer
+        self._recent_requests: "OrderedDict[Email, Tuple[Action, datetime]]" = (
+            OrderedDict()
+        )
+        self._recent_requests_lock = threading.Lock()
 
-    def subscribe(self, email: Email):
+    def subscribe(self, email: Email, *, deadline: Optional[Deadline] = None):
         self._check_email(email)
-        registration = self._storage.find(email)
-        if registration is None:
-            registration = Registration(
-                email=email,
-                last_update=self._utcnow(),
-                state=State.pending_subscribe,
-                confirm_action=Action.subscribe,
-            )
+        if deadline is not None:
+            deadline.check()
+        if self._is_recently_requested(email, Action.subscribe):
+            return
+        to_confirm: Optional[Registration] = None
+
+        def transition(registration: Optional[Registration]):
+            nonlocal to_confirm
+            to_confirm = None
+            if registration is None:
+                registration = Registration(
+                    email=email,
+                    last_update=self._utcnow(),
+                    state=State.pending_subscribe,
+                    confirm_action=Action.subscribe,
+                )
+            elif registration.state != State.pending_subscribe:
+                return registration
 
-        if registration.state == State.pending_subscribe:
             registration.last_update = self._utcnow()
-            if registration.confirm_token is None:
+            if registration.confirm_token is None and self._token_signer is None:
                 registration.confirm_token = next(self._token_generator)
+            to_confirm = registration
+            return registration
 
-            self._perform_state_change_requiring_confirmation(registration)
+        self._storage.update(email, transition)
+        if to_confirm is not None:
+            self._request_confirmation(to_confirm, deadline)
 
-    def unsubscribe(self, email: Email):
+    def unsubscribe(self, email: Email, *, deadline: Optional[Deadline] = None):
         self._check_email(email)
-        registration = self._storage.find(email)
-        subscribed_states = (State.subscribed, State.pending_unsubscribe)
-        if registration is not None and registration.state in subscribed_states:
+        if deadline is not None:
+            deadline.check()
+        if self._is_recently_requested(email, Action.unsubscribe):
+            return
+        to_confirm: Optional[Registration] = None
+
+        def transition(registration: Optional[Registration]):
+            nonlocal to_confirm
+            to_confirm = None
+            subscribed_states = (State.subscribed, State.pending_unsubscribe)
+            if registration is None or registration.state not in subscribed_states:
+                return registration
+
             registration.state = State.pending_unsubscribe
             registration.last_update = self._utcnow()
-            registration.confirm_token = next(self._token_generator)
+            registration.confirm_token = (
+                next(self._token_generator) if self._token_signer is None else None
+            )
             registration.confirm_action = Action.unsubscribe
-            self._perform_state_change_requiring_confirmation(registration)
+            to_confirm = registration
+            return registration
 
-    def confirm(self, email: Email, token: Token):
-        registration = self._storage.find(email)
+        self._storage.update(email, transition)
+        if to_confirm is not None:
+            self._request_confirmation(to_confirm, deadline)
 
-        if (
-            registration is None
-            or registration.confirm_action is None
-            or registration.confirm_token != token
-        ):
-            raise UnauthorizedException("Invalid token.")
-
-        if registration.confirm_action == Action.subscribe:
+    def confirm(self, email: Email, token: Token):
+        with self._recent_requests_lock:
+            self._recent_requests.pop(email, None)
+
+        signed_action: Optional[Action] = None
+        if self._token_signer is not None and self._token_signer.is_signed(token):
+            signed_action = self._token_signer.verify(email, token, self._utcnow())
+            if signed_action is None:
+                raise UnauthorizedException("Invalid token.")
+
+        def transition(registration: Optional[Registration]):
+            if registration is None or registration.confirm_action is None:
+                raise UnauthorizedException("Invalid token.")
+            if signed_action is not None:
+                if registration.confirm_action != signed_action:
+                    raise UnauthorizedException("Invalid token.")
+            elif (
+                registration.confirm_token is None
+                or registration.confirm_token != token
+            ):
+                raise UnauthorizedException("Invalid token.")
+
+            if registration.confirm_action == Action.unsubscribe:
+                return None
             registration.state = State.subscribed
             registration.last_update = self._utcnow()
             registration.confirm_token = None
             registration.confirm_action = None
-            self._storage.upsert(registration)
-        elif registration.confirm_action == Action.unsubscribe:
-            self._storage.delete(email)
+            return registration
 
-    def _perform_state_change_requiring_confirmation(self, registration):
-        self._storage.upsert(registration)
+        self._storage.update(email, transition)
+
+    def unsubscribe_one_click(self, email: Email, token: Token):
+        if self._unsubscribe_signer is None or not self._unsubscribe_signer.verify(
+            email, token
+        ):
+            raise UnauthorizedException("Invalid token.")
+        with self._recent_requests_lock:
+            self._recent_requests.pop(email, None)
+        self._storage.update(email, lambda registration: None)
+
+    def _request_confirmation(
+        self, registration: Registration, deadline: Optional[Deadline]
+    ):
+        assert registration.confirm_action is not None
         self._confirmation_requester.request_confirmation(
             registration.email,
             action=registration.confirm_action,
-            confirm_token=registration.confirm_token,
+            confirm_token=self._get_confirm_token(registration),
+            deadline=deadline,
+        )
+        self._remember_request(registration.email, registration.confirm_action)
+
+    def _get_confirm_token(self, registration: Registration) -> Token:
+        if registration.confirm_token is not None:
+            return registration.confirm_token
+        assert self._token_signer is not None
+        assert registration.confirm_action is not None
+        return self._token_signer.sign(
+            registration.email, registration.confirm_action, registration.last_update
+        )
+
+    def _is_within_resend_window(self, requested_at: datetime) -> bool:
+        return self._utcnow() - requested_at < self._resend_window
+
+    def _is_recently_requested(self, email: Email, action: Action) -> bool:
+        with self._recent_requests_lock:
+            recent_request = self._recent_requests.get(email)
+        return (
+            recent_request is not None
+            and recent_request[0] == action
+            and self._is_within_resend_window(recent_request[1])
         )
 
+    def _remember_request(self, email: Email, action: Action) -> None:
+        if self._resend_window <= timedelta(0):
+            return
+        now = self._utcnow()
+        with self._recent_requests_lock:
+            self._recent_requests.pop(email, None)
+            self._recent_requests[email] = (action, now)
+            while self._recent_requests and (
+                len(self._recent_requests) > RECENT_REQUESTS_MAX_SIZE
+                or now - next(iter(self._recent_requests.values()))[1]
+                >= self._resend_window
+            ):
+                self._recent_requests.popitem(last=False)
+
     def _check_email(self, email: Email):
-        addresses = getaddresses([email])
-        if len(addresses) != 1 or addresses[0][1] != email:
+        if not is_valid_email(email):
             raise ValueError("Must provide exactly one valid email address.")
 
 
+_atext = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]"
+_simple_address = re.compile(
+    rf"{_atext}+(?:\.{_atext}+)*@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\Z"
+)
+
+
+def is_valid_email(email: str) -> bool:
+    if _simple_address.match(email):
+        return True
+    addresses = getaddresses([email])
+    return len(addresses) == 1 and addresses[0][1] == email
+
+
 class UnauthorizedException(Exception):
     pass
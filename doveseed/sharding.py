@@ -0,0 +1,111 @@
+from dataclasses import dataclass
+from datetime import datetime
+from hashlib import sha256
+from typing import Dict, Iterable, Mapping, Optional, Sequence
+
+from typing_extensions import Protocol
+
+from .domain_types import Email, FeedItem
+from .email_notification import FailedDelivery, PendingDelivery
+from .feed import CacheValidators
+from .registration import Registration
+
+
+@dataclass(frozen=True)
+class Shard:
+    index: int
+    count: int
+
+    def __post_init__(self):
+        if self.count < 1 or not 0 <= self.index < self.count:
+            raise ValueError("Shard index must be in the range [0, count).")
+
+    @classmethod
+    def from_string(cls, value: str) -> "Shard":
+        index, count = value.split("/", 1)
+        return cls(index=int(index), count=int(count))
+
+    def __str__(self) -> str:
+        return f"{self.index}/{self.count}"
+
+    def contains(self, email: Email) -> bool:
+        digest = sha256(email.lower().encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") % self.count == self.index
+
+
+class Storage(Protocol):
+    def get_last_seen(self) -> Optional[datetime]: ...
+
+    def get_seen_items(
+        self, shard: Optional[Shard] = None
+    ) -> Optional[Dict[str, datetime]]: ...
+
+    def set_seen_items(
+        self, seen_items: Mapping[str, datetime], shard: Optional[Shard] = None
+    ) -> None: ...
+
+    def get_feed_validators(
+        self, shard: Optional[Shard] = None
+    ) -> Optional[CacheValidators]: ...
+
+    def set_feed_validators(
+        self, validators: CacheValidators, shard: Optional[Shard] = None
+    ) -> None: ...
+
+    def get_all_active_subscribers(self) -> Iterable[Registration]: ...
+
+    def get_due_deliveries(self, now: datetime) -> Iterable[PendingDelivery]: ...
+
+    def upsert_pending_delivery(self, delivery: PendingDelivery) -> None: ...
+
+    def delete_pending_delivery(
+        self, email: Email, feed_items: Sequence[FeedItem]
+    ) -> None: ...
+
+    def add_failed_delivery(self, delivery: FailedDelivery) -> None: ...
+
+
+class ShardedStorage:
+    def __init__(self, storage: Storage, shard: Shard):
+        self._storage = storage
+        self._shard = shard
+
+    def get_last_seen(self) -> Optional[datetime]:
+        return self._storage.get_last_seen()
+
+    def get_seen_items(self) -> Optional[Dict[str, datetime]]:
+        return self._storage.get_seen_items(self._shard)
+
+    def set_seen_items(self, seen_items: Mapping[str, datetime]) -> None:
+        self._storage.set_seen_items(seen_items, self._shard)
+
+    def get_feed_validators(self) -> Optional[CacheValidators]:
+        return self._storage.get_feed_validators(self._shard)
+
+    def set_feed_validators(self, validators: CacheValidators) -> None:
+        self._storage.set_feed_validators(validators, self._shard)
+
+    def get_all_active_subscribers(self) -> Iterable[Registration]:
+        return (
+            subscriber
+            for subscriber in self._storage.get_all_active_subscribers()
+            if self._shard.contains(subscriber.email)
+        )
+
+    def get_due_deliveries(self, now: datetime) -> Iterable[PendingDelivery]:
+        return (
+            delivery
+            for delivery in self._storage.get_due_deliveries(now)
+            if self._shard.contains(delivery.email)
+        )
+
+    def upsert_pending_delivery(self, delivery: PendingDelivery) -> None:
+        self._storage.upsert_pending_delivery(delivery)
+
+    def delete_pending_delivery(
+        self, email: Email, feed_items: Sequence[FeedItem]
+    ) -> None:
+        self._storage.delete_pending_delivery(email, feed_items)
+
+    def add_failed_delivery(self, delivery: FailedDelivery) -> None:
+        self._storage.add_failed_delivery(delivery)
@@ -1,27 +1,84 @@
 import ssl
-from contextlib import contextmanager
+import threading
+from contextlib import AbstractContextManager, ExitStack, contextmanager, nullcontext
 from email.message import EmailMessage
 from enum import Enum
-from smtplib import SMTP, SMTP_SSL
-from typing import Callable, ContextManager, Generator
+from smtplib import SMTP, SMTP_SSL, SMTPException, SMTPServerDisconnected
+from typing import (
+    Callable,
+    ContextManager,
+    Dict,
+    Generator,
+    Iterator,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from typing_extensions import Protocol
+
+from .deadline import Deadline, bounded_timeout
+
+RefusedRecipients = Dict[str, Tuple[int, bytes]]
+
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 10.0
+DEFAULT_COMMAND_TIMEOUT_SECONDS = 30.0
+
+
+def _limit_timeout(smtp: SMTP, deadline: Optional[Deadline]) -> None:
+    if smtp.sock is not None:
+        smtp.sock.settimeout(bounded_timeout(smtp.timeout, deadline))
 
 
 class _EstablishedSmtpConnection:
-    def __init__(self, smtp: SMTP):
+    def __init__(
+        self,
+        smtp: SMTP,
+        *,
+        deadline: Optional[Deadline] = None,
+        lock: Optional[AbstractContextManager] = None,
+    ):
         self._smtp = smtp
+        self._deadline = deadline
+        self._lock = lock if lock is not None else nullcontext()
+
+    @property
+    def max_recipients(self) -> Optional[int]:
+        for limit in self._smtp.esmtp_features.get("limits", "").split():
+            name, _, value = limit.partition("=")
+            if name.upper() == "RCPTMAX" and value.isdigit():
+                return int(value)
+        return None
 
-    def send_message(self, msg: EmailMessage) -> None:
-        self._smtp.send_message(msg)
+    def send_message(
+        self, msg: EmailMessage, to_addrs: Optional[Sequence[str]] = None
+    ) -> RefusedRecipients:
+        with self._lock:
+            _limit_timeout(self._smtp, self._deadline)
+            return self._smtp.send_message(msg, to_addrs=to_addrs)
 
 
 class _NoopConnection:
-    def send_message(self, msg: EmailMessage) -> None:
-        pass
+    max_recipients: Optional[int] = None
+
+    def send_message(
+        self, msg: EmailMessage, to_addrs: Optional[Sequence[str]] = None
+    ) -> RefusedRecipients:
+        return {}
 
 
 ConnectionManager = Callable[[], ContextManager[_EstablishedSmtpConnection]]
 
 
+class DeadlineConnectionManager(Protocol):
+    def __call__(
+        self, *, deadline: Optional[Deadline] = None
+    ) -> ContextManager[_EstablishedSmtpConnection]: ...
+
+
+SmtpConnector = Callable[[Optional[Deadline]], ContextManager[SMTP]]
+
+
 class SslMode(Enum):
     NO_SSL = "no-ssl"
     START_TLS = "start-tls"
@@ -37,15 +94,15 @@ class SslMode(Enum):
 
 @contextmanager
 def _connect_smtp(
-    host: str, port: int, *, context: ssl.SSLContext
+    host: str, port: int, *, context: Optional[ssl.SSLContext], timeout: float
 ) -> Generator[SMTP, None, None]:
-    with SMTP(host, port) as smtp:
+    with SMTP(host, port, timeout=timeout) as smtp:
         if context is not None:
             smtp.starttls(context=context)
         yield smtp
 
 
-def smtp_connection(
+def _smtp_connector(
     *,
     host: str,
     user: str,
@@ -53,7 +110,9 @@ def smtp_connection(
     port: int = 0,
     ssl_mode: str = SslMode.START_TLS.value,
     check_hostname: bool = True,
-) -> ConnectionManager:
+    connect_timeout_seconds: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+    command_timeout_seconds: float = DEFAULT_COMMAND_TIMEOUT_SECONDS,
+) -> SmtpConnector:
     _ssl_mode = SslMode.from_str(ssl_mode)
     context = None
     if _ssl_mode != SslMode.NO_SSL:
@@ -66,17 +125,129 @@ def smtp_connection(
         connect = _connect_smtp
 
     @contextmanager
-    def connection_manager():
-        with connect(host, port, context=context) as smtp:
+    def logged_in_smtp(deadline: Optional[Deadline] = None):
+        with connect(
+            host,
+            port,
+            context=context,
+            timeout=bounded_timeout(connect_timeout_seconds, deadline),
+        ) as smtp:
+            smtp.timeout = command_timeout_seconds
+            _limit_timeout(smtp, deadline)
             smtp.login(user, password)
-            yield _EstablishedSmtpConnection(smtp)
+            yield smtp
+
+    return logged_in_smtp
+
+
+def smtp_connection(
+    *,
+    host: str,
+    user: str,
+    password: str,
+    port: int = 0,
+    ssl_mode: str = SslMode.START_TLS.value,
+    check_hostname: bool = True,
+    connect_timeout_seconds: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+    command_timeout_seconds: float = DEFAULT_COMMAND_TIMEOUT_SECONDS,
+) -> DeadlineConnectionManager:
+    connect = _smtp_connector(
+        host=host,
+        user=user,
+        password=password,
+        port=port,
+        ssl_mode=ssl_mode,
+        check_hostname=check_hostname,
+        connect_timeout_seconds=connect_timeout_seconds,
+        command_timeout_seconds=command_timeout_seconds,
+    )
+
+    @contextmanager
+    def connection_manager(*, deadline: Optional[Deadline] = None):
+        with connect(deadline) as smtp:
+            yield _EstablishedSmtpConnection(smtp, deadline=deadline)
 
     return connection_manager
 
 
-def noop_connection() -> ConnectionManager:
+class PersistentConnectionManager:
+    def __init__(self, connect: SmtpConnector):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._exit_stack: Optional[ExitStack] = None
+        self._smtp: Optional[SMTP] = None
+
+    @contextmanager
+    def __call__(
+        self, *, deadline: Optional[Deadline] = None
+    ) -> Iterator[_EstablishedSmtpConnection]:
+        with self._lock:
+            smtp = self._ensure_connected(deadline)
+        try:
+            yield _EstablishedSmtpConnection(smtp, deadline=deadline, lock=self._lock)
+        except SMTPServerDisconnected:
+            with self._lock:
+                if self._smtp is smtp:
+                    self._discard()
+            raise
+
+    def _ensure_connected(self, deadline: Optional[Deadline]) -> SMTP:
+        if self._smtp is not None:
+            _limit_timeout(self._smtp, deadline)
+            try:
+                status, _ = self._smtp.noop()
+            except (SMTPException, OSError):
+                status = -1
+            if status == 250:
+                return self._smtp
+            self._discard()
+
+        exit_stack = ExitStack()
+        self._smtp = exit_stack.enter_context(self._connect(deadline))
+        self._exit_stack = exit_stack
+        return self._smtp
+
+    def _discard(self) -> None:
+        exit_stack, self._exit_stack, self._smtp = self._exit_stack, None, None
+        if exit_stack is not None:
+            try:
+                exit_stack.close()
+            except (SMTPException, OSError):
+                pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._discard()
+
+
+def persistent_smtp_connection(
+    *,
+    host: str,
+    user: str,
+    password: str,
+    port: int = 0,
+    ssl_mode: str = SslMode.START_TLS.value,
+    check_hostname: bool = True,
+    connect_timeout_seconds: float = DEFAULT_CONNECT_TIMEOUT_SECONDS,
+    command_timeout_seconds: float = DEFAULT_COMMAND_TIMEOUT_SECONDS,
+) -> PersistentConnectionManager:
+    return PersistentConnectionManager(
+        _smtp_connector(
+            host=host,
+            user=user,
+            password=password,
+            port=port,
+            ssl_mode=ssl_mode,
+            check_hostname=check_hostname,
+            connect_timeout_seconds=connect_timeout_seconds,
+            command_timeout_seconds=command_timeout_seconds,
+        )
+    )
+
+
+def noop_connection() -> DeadlineConnectionManager:
     @contextmanager
-    def connection_manager():
+    def connection_manager(*, deadline: Optional[Deadline] = None):
         yield _NoopConnection()
 
     return connection_manager
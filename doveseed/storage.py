@@ -1,35 +1,134 @@
+import threading
 from base64 import b64decode, b64encode
 from collections.abc import Mapping
-from dataclasses import asdict, fields, is_dataclass
+from contextlib import AbstractContextManager, contextmanager
+from dataclasses import asdict, fields, is_dataclass, replace
 from datetime import datetime, timezone
 from enum import Enum
 from inspect import isclass
-from typing import Any, Dict, Optional, Type, Union, cast
+from typing import (
+    Any,
+    Collection,
+    Dict,
+    Iterator,
+    Optional,
+    Sequence,
+    Set,
+    Type,
+    Union,
+    cast,
+    get_args,
+    get_origin,
+)
 
 from tinydb import Query, TinyDB
+from tinydb.table import Document, Table
 
-from .domain_types import Email, State
-from .registration import Registration
+from .bounces import Suppression
+from .domain_types import Email, FeedItem, State
+from .email_notification import FailedDelivery, PendingDelivery
+from .feed import CacheValidators
+from .registration import Registration, Transition
+from .sharding import Shard
 
 
 class TinyDbStorage:
-    def __init__(self, tinydb: TinyDB):
+    def __init__(
+        self, tinydb: TinyDB, *, lock: Optional[AbstractContextManager] = None
+    ):
         self._tinydb = tinydb
+        self._lock = lock if lock is not None else threading.RLock()
 
-    def all(self):
-        for data in self._tinydb.all():
+    def clear_cache(self) -> None:
+        for name in self._tinydb.tables() | {self._tinydb.default_table_name}:
+            self._tinydb.table(name).clear_cache()
+
+    def all(self) -> Iterator[Registration]:
+        for document in self._tinydb.search(Query().email.exists()):
+            data = dict(document)
             self._deserialize_in_place(Registration, data)
             yield Registration(**data)
 
+    def emails(self) -> Iterator[Email]:
+        for data in self._tinydb.search(Query().email.exists()):
+            yield Email(data["email"])
+
+    def insert_multiple(self, registrations: Sequence[Registration]) -> None:
+        documents = [self._to_document(registration) for registration in registrations]
+        with self._lock:
+            with self._locked_table() as table:
+                table.insert_multiple(documents)
+
+    def apply_changes(
+        self,
+        *,
+        upserts: Sequence[Registration] = (),
+        deletes: Collection[Email] = (),
+    ) -> None:
+        documents = {
+            registration.email: self._to_document(registration)
+            for registration in upserts
+        }
+        deleted = set(deletes)
+        updated: Set[str] = set()
+
+        def update_document(document):
+            document.update(documents[document["email"]])
+            updated.add(document["email"])
+
+        with self._lock:
+            if len(deleted) > 0:
+                self._tinydb.remove(Query().email.test(lambda email: email in deleted))
+            if len(documents) > 0:
+                self._tinydb.update(
+                    update_document,
+                    Query().email.test(lambda email: email in documents),
+                )
+            inserted = [
+                document
+                for email, document in documents.items()
+                if email not in updated
+            ]
+            if len(inserted) > 0:
+                with self._locked_table() as table:
+                    table.insert_multiple(inserted)
+
+    @contextmanager
+    def _locked_table(self, name: Optional[str] = None) -> Iterator[Table]:
+        name = name if name is not None else self._tinydb.default_table_name
+        try:
+            yield self._tinydb.table_class(self._tinydb.storage, name)
+        finally:
+            self._tinydb.table(name).clear_cache()
+
+    def _to_document(self, registration: Registration) -> Dict[str, Any]:
+        data = {
+            field.name: (
+                asdict(value)
+                if is_dataclass(value) and not isinstance(value, type)
+                else value
+            )
+            for field in fields(Registration)
+            for value in (getattr(registration, field.name),)
+        }
+        self._serialize_in_place(data)
+        return data
+
     def upsert(self, registration: Registration) -> None:
         data = asdict(registration)
         self._serialize_in_place(data)
-        self._tinydb.upsert(data, Query().email == registration.email)
+        with self._lock:
+            with self._locked_table() as table:
+                table.upsert(data, Query().email == registration.email)
 
     def _serialize_in_place(self, data: Dict[str, Any]):
         for k, value in data.items():
             if isinstance(value, Mapping):
                 self._serialize_in_place(data[k])
+            elif isinstance(value, list):
+                for element in value:
+                    if isinstance(element, dict):
+                        self._serialize_in_place(element)
             if isinstance(value, bytes):
                 data[k] = b64encode(value).decode("ascii")
             elif isinstance(value, datetime):
@@ -38,15 +137,16 @@ class TinyDbStorage:
                 data[k] = value.name
 
     def find(self, email: Email) -> Optional[Registration]:
-        data = self._tinydb.get(Query().email == email)
-        if data is None:
+        document = self._tinydb.get(Query().email == email)
+        if document is None:
             return None
+        data = dict(document)
         self._deserialize_in_place(Registration, data)
         return Registration(**data)
 
     def _deserialize_in_place(self, to_type: Type, data: Dict[str, Any]):
         for field in fields(to_type):
-            if data[field.name] is None:
+            if data.get(field.name) is None:
                 continue
 
             type_info = field.type
@@ -65,48 +165,223 @@ class TinyDbStorage:
             elif isclass(type_info) and issubclass(type_info, Enum):
                 data[field.name] = type_info[data[field.name]]
             elif is_dataclass(type_info) and isinstance(type_info, type):
-                self._deserialize_in_place(type_info, data[field.name])
-                data[field.name] = type_info(**data[field.name])
+                nested = dict(data[field.name])
+                self._deserialize_in_place(type_info, nested)
+                data[field.name] = type_info(**nested)
+            elif get_origin(type_info) is list:
+                (element_type,) = get_args(type_info)
+                if is_dataclass(element_type) and isinstance(element_type, type):
+                    elements = [dict(element) for element in data[field.name]]
+                    for element in elements:
+                        self._deserialize_in_place(element_type, element)
+                    data[field.name] = [element_type(**element) for element in elements]
 
     def delete(self, email: Email) -> None:
-        self._tinydb.remove(Query().email == email)
+        with self._lock:
+            self._tinydb.remove(Query().email == email)
+
+    def update(self, email: Email, transition: Transition) -> None:
+        with self._lock:
+            document = self._tinydb.get(Query().email == email)
+            current: Optional[Registration] = None
+            if isinstance(document, Document):
+                data = dict(document)
+                self._deserialize_in_place(Registration, data)
+                current = Registration(**data)
+
+            updated = transition(replace(current) if current is not None else None)
+            if updated == current:
+                return
+            if updated is None:
+                assert isinstance(document, Document)
+                self._tinydb.remove(doc_ids=[document.doc_id])
+                return
+
+            data = asdict(updated)
+            self._serialize_in_place(data)
+            if isinstance(document, Document):
+                self._tinydb.update(data, doc_ids=[document.doc_id])
+            else:
+                with self._locked_table() as table:
+                    table.insert(data)
 
     def drop_old_unconfirmed(self, *, drop_before: datetime):
         def is_before(value):
             return datetime.fromisoformat(value) < drop_before
 
         registration = Query()
-        self._tinydb.remove(
-            registration.last_update.test(is_before)
-            & (registration.state == State.pending_subscribe.name)
-        )
+        with self._lock:
+            self._tinydb.remove(
+                registration.last_update.test(is_before)
+                & (registration.state == State.pending_subscribe.name)
+            )
 
     def get_last_seen(self):
+        return self._get_timestamp(Query().key == "last_seen")
+
+    def set_last_seen(self, value: datetime):
+        with self._lock:
+            with self._locked_table() as table:
+                table.upsert(
+                    {
+                        "key": "last_seen",
+                        "value": value.astimezone(tz=timezone.utc).isoformat(),
+                    },
+                    Query().key == "last_seen",
+                )
+
+    def get_seen_items(
+        self, shard: Optional[Shard] = None
+    ) -> Optional[Dict[str, datetime]]:
+        data = self._tinydb.table("seen_items").get(self._shard_scope_query(shard))
+        if data is None:
+            return None
+        return {
+            key: datetime.fromisoformat(value) for key, value in data["items"].items()
+        }
+
+    def set_seen_items(
+        self, seen_items: Mapping[str, datetime], shard: Optional[Shard] = None
+    ) -> None:
+        with self._lock:
+            with self._locked_table("seen_items") as table:
+                table.upsert(
+                    {
+                        "shard": shard.index if shard else None,
+                        "shards": shard.count if shard else None,
+                        "items": {
+                            key: value.astimezone(tz=timezone.utc).isoformat()
+                            for key, value in seen_items.items()
+                        },
+                    },
+                    self._shard_scope_query(shard),
+                )
+
+    def _shard_scope_query(self, shard: Optional[Shard]):
+        entry = Query()
+        return (entry.shard == (shard.index if shard else None)) & (
+            entry.shards == (shard.count if shard else None)
+        )
+
+    def get_feed_validators(
+        self, shard: Optional[Shard] = None
+    ) -> Optional[CacheValidators]:
+        data = self._tinydb.get(self._feed_validators_query(shard))
+        if data is None:
+            return None
+        return CacheValidators(etag=data["etag"], last_modified=data["last_modified"])
+
+    def set_feed_validators(
+        self, validators: CacheValidators, shard: Optional[Shard] = None
+    ) -> None:
+        with self._lock:
+            with self._locked_table() as table:
+                table.upsert(
+                    {
+                        "key": "feed_validators",
+                        "shard": shard.index if shard else None,
+                        "shards": shard.count if shard else None,
+                        "etag": validators.etag,
+                        "last_modified": validators.last_modified,
+                    },
+                    self._feed_validators_query(shard),
+                )
+
+    def _feed_validators_query(self, shard: Optional[Shard]):
+        return (Query().key == "feed_validators") & self._shard_scope_query(shard)
+
+    def _get_timestamp(self, query) -> Optional[datetime]:
         try:
-            value = datetime.fromisoformat(
-                self._tinydb.get(Query().key == "last_seen")["value"]
-            )
+            value = datetime.fromisoformat(self._tinydb.get(query)["value"])
             if value.tzinfo is None:
                 value = value.replace(tzinfo=timezone.utc)
             return value
         except (KeyError, TypeError):
             return None
 
-    def set_last_seen(self, value: datetime):
-        self._tinydb.upsert(
-            {
-                "key": "last_seen",
-                "value": value.astimezone(tz=timezone.utc).isoformat(),
-            },
-            Query().key == "last_seen",
-        )
-
     def get_all_active_subscribers(self):
         registration = Query()
         subscribers = self._tinydb.search(
             (registration.state == State.subscribed.name)
             | (registration.state == State.pending_unsubscribe.name)
         )
+        suppressed = {
+            data["email"].lower(): data["last_bounce"]
+            for data in self._tinydb.table("suppressions").all()
+        }
         for subscriber in subscribers:
-            self._deserialize_in_place(Registration, subscriber)
-            yield Registration(**subscriber)
+            last_bounce = suppressed.get(subscriber["email"].lower())
+            if last_bounce is not None and datetime.fromisoformat(
+                last_bounce
+            ) >= datetime.fromisoformat(subscriber["last_update"]):
+                continue
+            data = dict(subscriber)
+            self._deserialize_in_place(Registration, data)
+            yield Registration(**data)
+
+    def get_due_deliveries(self, now: datetime):
+        def is_due(value):
+            return datetime.fromisoformat(value) <= now
+
+        pending = self._tinydb.table("pending_deliveries")
+        for document in pending.search(Query().next_attempt.test(is_due)):
+            data = dict(document)
+            self._deserialize_in_place(PendingDelivery, data)
+            yield PendingDelivery(**data)
+
+    def upsert_pending_delivery(self, delivery: PendingDelivery) -> None:
+        data = asdict(delivery)
+        self._serialize_in_place(data)
+        with self._lock:
+            with self._locked_table("pending_deliveries") as table:
+                table.upsert(
+                    data, self._delivery_query(delivery.email, delivery.feed_items)
+                )
+
+    def delete_pending_delivery(
+        self, email: Email, feed_items: Sequence[FeedItem]
+    ) -> None:
+        with self._lock:
+            self._tinydb.table("pending_deliveries").remove(
+                self._delivery_query(email, feed_items)
+            )
+
+    def _delivery_query(self, email: Email, feed_items: Sequence[FeedItem]):
+        links = [item.link for item in feed_items]
+
+        def has_same_links(value):
+            return [item["link"] for item in value] == links
+
+        delivery = Query()
+        return (delivery.email == email) & delivery.feed_items.test(has_same_links)
+
+    def add_failed_delivery(self, delivery: FailedDelivery) -> None:
+        data = asdict(delivery)
+        self._serialize_in_place(data)
+        with self._lock:
+            with self._locked_table("failed_deliveries") as table:
+                table.insert(data)
+
+    def get_failed_deliveries(self):
+        for document in self._tinydb.table("failed_deliveries").all():
+            data = dict(document)
+            self._deserialize_in_place(FailedDelivery, data)
+            yield FailedDelivery(**data)
+
+    def get_suppressions(self) -> Iterator[Suppression]:
+        for document in self._tinydb.table("suppressions").all():
+            data = dict(document)
+            self._deserialize_in_place(Suppression, data)
+            yield Suppression(**data)
+
+    def upsert_suppressions(self, suppressions: Sequence[Suppression]) -> None:
+        documents = []
+        for suppression in suppressions:
+            data = asdict(suppression)
+            self._serialize_in_place(data)
+            documents.append(data)
+        emails = {suppression.email for suppression in suppressions}
+        with self._lock:
+            with self._locked_table("suppressions") as table:
+                table.remove(Query().email.test(lambda email: email in emails))
+                table.insert_multiple(documents)
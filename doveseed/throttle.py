@@ -0,0 +1,133 @@
+import heapq
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Callable,
+    Deque,
+    Dict,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+T = TypeVar("T")
+
+
+def email_domain(email: str) -> str:
+    return email.rpartition("@")[2].lower()
+
+
+@dataclass
+class _DomainState(Generic[T]):
+    rate: float
+    tokens: float
+    updated: float
+    not_before: float = 0.0
+    queue: Deque[Tuple[T, int]] = field(default_factory=deque)
+
+
+class DomainScheduler(Generic[T]):
+    @dataclass(frozen=True)
+    class Policy:
+        initial_rate_per_second: float = 2
+        min_rate_per_second: float = 0.05
+        max_rate_per_second: float = 20
+        burst: float = 10
+        additive_increase: float = 0.1
+        multiplicative_decrease: float = 0.5
+        max_deferrals: int = 3
+
+    def __init__(
+        self,
+        policy: Policy,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._policy = policy
+        self._clock = clock
+        self._sleep = sleep
+        self._domains: Dict[str, _DomainState[T]] = {}
+        self._ready: List[Tuple[float, int, str]] = []
+        self._sequence = 0
+        self._in_flight: Optional[Tuple[str, int]] = None
+
+    def add(self, domain: str, item: T) -> None:
+        state = self._domains.get(domain)
+        if state is None:
+            state = _DomainState(
+                rate=self._policy.initial_rate_per_second,
+                tokens=self._policy.burst,
+                updated=self._clock(),
+            )
+            self._domains[domain] = state
+        state.queue.append((item, 0))
+        if len(state.queue) == 1 and self._in_flight_domain() != domain:
+            self._schedule(domain)
+
+    def __iter__(self) -> Iterator[Tuple[str, T]]:
+        while self._ready:
+            ready_at, _, domain = heapq.heappop(self._ready)
+            wait = ready_at - self._clock()
+            if wait > 0:
+                self._sleep(wait)
+            state = self._domains[domain]
+            item, deferrals = state.queue.popleft()
+            self._refill(state)
+            state.tokens -= 1
+            self._in_flight = (domain, deferrals)
+            yield domain, item
+            self._in_flight = None
+            if state.queue:
+                self._schedule(domain)
+
+    def succeed(self) -> None:
+        domain, _ = self._require_in_flight()
+        state = self._domains[domain]
+        state.rate = min(
+            self._policy.max_rate_per_second,
+            state.rate + self._policy.additive_increase,
+        )
+
+    def defer(self, item: T) -> bool:
+        domain, deferrals = self._require_in_flight()
+        state = self._domains[domain]
+        state.rate = max(
+            self._policy.min_rate_per_second,
+            state.rate * self._policy.multiplicative_decrease,
+        )
+        state.tokens = min(state.tokens, 0.0)
+        state.not_before = self._clock() + 1 / state.rate
+        if deferrals >= self._policy.max_deferrals:
+            return False
+        state.queue.append((item, deferrals + 1))
+        return True
+
+    def _require_in_flight(self) -> Tuple[str, int]:
+        if self._in_flight is None:
+            raise RuntimeError("No delivery in progress.")
+        return self._in_flight
+
+    def _in_flight_domain(self) -> Optional[str]:
+        return self._in_flight[0] if self._in_flight is not None else None
+
+    def _refill(self, state: _DomainState[T]) -> None:
+        now = self._clock()
+        state.tokens = min(
+            self._policy.burst, state.tokens + (now - state.updated) * state.rate
+        )
+        state.updated = now
+
+    def _schedule(self, domain: str) -> None:
+        state = self._domains[domain]
+        self._refill(state)
+        ready_at = max(
+            state.not_before,
+            state.updated + max(0.0, 1 - state.tokens) / state.rate,
+        )
+        self._sequence += 1
+        heapq.heappush(self._ready, (ready_at, self._sequence, domain))
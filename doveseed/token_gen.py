@@ -1,8 +1,75 @@
+import calendar
+import hashlib
+import hmac
 import os
+import struct
+from datetime import datetime, timedelta
+from typing import Optional
 
-from .domain_types import Token
+from .domain_types import Action, Email, Token
+
+SIGNED_TOKEN_VERSION = b"\x01"
+CLOCK_SKEW_SECONDS = 60
+
+_header = struct.Struct(">QB")
+_signature_size = hashlib.sha256().digest_size
 
 
 def gen_secure_token():
     while True:
         yield Token(os.urandom(16))
+
+
+class TokenSigner:
+    def __init__(self, secret: bytes, *, max_age: timedelta):
+        self._secret = secret
+        self._max_age_seconds = max_age.total_seconds()
+
+    def sign(self, email: Email, action: Action, issued_at: datetime) -> Token:
+        header = _header.pack(calendar.timegm(issued_at.utctimetuple()), action.value)
+        return Token(SIGNED_TOKEN_VERSION + header + self._signature(email, header))
+
+    @staticmethod
+    def is_signed(token: Optional[Token]) -> bool:
+        return (
+            token is not None
+            and len(token.data)
+            == len(SIGNED_TOKEN_VERSION) + _header.size + _signature_size
+            and token.data.startswith(SIGNED_TOKEN_VERSION)
+        )
+
+    def verify(self, email: Email, token: Token, now: datetime) -> Optional[Action]:
+        if not self.is_signed(token):
+            return None
+        header = token.data[len(SIGNED_TOKEN_VERSION) : -_signature_size]
+        if not hmac.compare_digest(
+            token.data[-_signature_size:], self._signature(email, header)
+        ):
+            return None
+
+        issued_at, action_value = _header.unpack(header)
+        age = calendar.timegm(now.utctimetuple()) - issued_at
+        if not -CLOCK_SKEW_SECONDS <= age <= self._max_age_seconds:
+            return None
+        try:
+            return Action(action_value)
+        except ValueError:
+            return None
+
+    def _signature(self, email: Email, header: bytes) -> bytes:
+        return hmac.new(
+            self._secret, header + email.encode("utf-8"), hashlib.sha256
+        ).digest()
+
+
+class UnsubscribeTokenSigner:
+    def __init__(self, secret: bytes):
+        self._key = hmac.new(secret, b"list-unsubscribe", hashlib.sha256).digest()
+
+    def sign(self, email: Email) -> Token:
+        return Token(
+            hmac.new(self._key, email.encode("utf-8"), hashlib.sha256).digest()
+        )
+
+    def verify(self, email: Email, token: Token) -> bool:
+        return hmac.compare_digest(token.data, self.sign(email).data)
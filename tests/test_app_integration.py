@@ -1,24 +1,62 @@
-from typing import Dict
+import hashlib
+import hmac
+import json
+from dataclasses import replace
+from pathlib import Path
+from typing import Dict, Optional
+from unittest.mock import MagicMock
 
 import pytest
-from fastapi import status
+from fastapi import Depends, status
 from fastapi.testclient import TestClient
 from httpx import Response
+from jinja2 import TemplateNotFound
 from tinydb import Query, TinyDB
 from tinydb.storages import MemoryStorage
 
-from doveseed.app import app, get_confirmation_requester, get_db
+from doveseed.app import (
+    app,
+    get_config,
+    get_confirmation_requester,
+    get_connection,
+    get_db,
+    get_db_lock,
+    get_feed_config,
+    get_message_provider,
+    get_notification_runner,
+    get_rate_limiter,
+    get_registration_service,
+    get_storage,
+    get_trusted_proxies,
+)
+from doveseed.config import (
+    Config,
+    FeedConfig,
+    RateLimitConfig,
+    TemplateVarsConfig,
+    WebhookConfig,
+)
+from doveseed.deadline import Deadline
 from doveseed.domain_types import Action, Email, Token
+from doveseed.rate_limit import MemoryBucketStore, RateLimiter
+from doveseed.token_gen import UnsubscribeTokenSigner
 
 
 class ConfirmationRequester:
     def __init__(self):
         self.tokens: Dict[Email, str] = {}
+        self.deadlines: Dict[Email, Optional[Deadline]] = {}
 
     def request_confirmation(
-        self, email: Email, *, action: Action, confirm_token: Token
+        self,
+        email: Email,
+        *,
+        action: Action,
+        confirm_token: Token,
+        deadline: Optional[Deadline] = None,
     ):
         self.tokens[email] = confirm_token.to_string()
+        self.deadlines[email] = deadline
 
 
 def assert_success(response: Response):
@@ -36,14 +74,40 @@ def db():
 
 
 @pytest.fixture
-def client(db, confirmation_requester):
+def rate_limiter():
+    return RateLimiter(
+        MemoryBucketStore(),
+        per_ip=RateLimiter.Rate(capacity=20, refill_per_hour=60),
+        per_email=RateLimiter.Rate(capacity=3, refill_per_hour=6),
+    )
+
+
+@pytest.fixture
+def config(tmp_path):
+    return Config(
+        db=str(tmp_path / "primary.json"),
+        rss="https://primary.local/index.xml",
+        template_vars=TemplateVarsConfig(
+            display_name="Primary", host="primary.local", sender="primary@local"
+        ),
+        email_templates="templates/example",
+        confirm_timeout_minutes=60,
+    )
+
+
+@pytest.fixture
+def client(config, db, confirmation_requester, rate_limiter):
+    app.dependency_overrides[get_config] = lambda: config
     app.dependency_overrides[get_db] = lambda: db
     app.dependency_overrides[get_confirmation_requester] = (
         lambda: confirmation_requester
     )
+    app.dependency_overrides[get_rate_limiter] = lambda: rate_limiter
     yield TestClient(app)
+    del app.dependency_overrides[get_config]
     del app.dependency_overrides[get_db]
     del app.dependency_overrides[get_confirmation_requester]
+    del app.dependency_overrides[get_rate_limiter]
 
 
 def test_subscription_and_unsubscription_flow(client, db, confirmation_requester):
@@ -110,3 +174,344 @@ def test_confirm_unauthorized(client, db, confirmation_requester):
     assert known_email_response.status_code == status.HTTP_401_UNAUTHORIZED
 
     assert known_email_response.read() == unknown_email_response.read()
+
+
+def test_rate_limits_requests_per_email(client, db, confirmation_requester):
+    for _ in range(3):
+        assert_success(client.post("/unsubscribe/foo@test.org"))
+    response = client.post("/subscribe/Foo@Test.org")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.headers["Retry-After"] == "600"
+    assert db.get(Query().email == "Foo@Test.org") is None
+    assert "Foo@Test.org" not in confirmation_requester.tokens
+    assert_success(client.post("/subscribe/bar@test.org"))
+
+
+def test_rate_limits_requests_per_client(client):
+    rate_limiter = RateLimiter(
+        MemoryBucketStore(),
+        per_ip=RateLimiter.Rate(capacity=2, refill_per_hour=1),
+        per_email=RateLimiter.Rate(capacity=3, refill_per_hour=6),
+    )
+    app.dependency_overrides[get_rate_limiter] = lambda: rate_limiter
+    for i in range(2):
+        assert_success(client.post(f"/subscribe/foo{i}@test.org"))
+    response = client.post("/subscribe/foo2@test.org")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test_rate_limits_forwarded_client_of_trusted_proxy(client, config):
+    app.dependency_overrides[get_config] = lambda: replace(
+        config, rate_limit=RateLimitConfig(trusted_proxies=("10.0.0.0/8",))
+    )
+    rate_limiter = RateLimiter(
+        MemoryBucketStore(),
+        per_ip=RateLimiter.Rate(capacity=1, refill_per_hour=1),
+        per_email=RateLimiter.Rate(capacity=3, refill_per_hour=6),
+    )
+    app.dependency_overrides[get_rate_limiter] = lambda: rate_limiter
+    proxied_client = TestClient(app, client=("10.0.0.1", 50000))
+
+    def subscribe(email: str, forwarded_for: str) -> Response:
+        return proxied_client.post(
+            f"/subscribe/{email}", headers={"X-Forwarded-For": forwarded_for}
+        )
+
+    assert_success(subscribe("foo@test.org", "203.0.113.1"))
+    assert_success(subscribe("bar@test.org", "203.0.113.2"))
+    response = subscribe("baz@test.org", "203.0.113.1")
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+
+def test_does_not_rate_limit_without_config(config):
+    assert get_rate_limiter(config=config) is None
+
+
+def test_passes_request_deadline_to_confirmation(client, confirmation_requester):
+    assert_success(client.post("/subscribe/foo@test.org"))
+    deadline = confirmation_requester.deadlines["foo@test.org"]
+    assert deadline is not None
+    assert 0 < deadline.remaining() <= 15
+
+
+def test_fails_fast_if_request_deadline_exceeded(
+    client, config, db, confirmation_requester
+):
+    app.dependency_overrides[get_config] = lambda: replace(
+        config, request_deadline_seconds=0
+    )
+    response = client.post("/subscribe/foo@test.org")
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert db.get(Query().email == "foo@test.org") is None
+    assert "foo@test.org" not in confirmation_requester.tokens
+
+
+class TestOneClickUnsubscribe:
+    @pytest.fixture
+    def config(self, config):
+        return replace(config, unsubscribe_token_secret="unsubscribe-secret")
+
+    @pytest.fixture
+    def subscribed_email(self, db):
+        db.insert(
+            {
+                "email": "foo@test.org",
+                "last_update": "2019-10-25T13:37:00",
+                "state": "subscribed",
+                "confirm_token": None,
+                "confirm_action": None,
+            }
+        )
+        return Email("foo@test.org")
+
+    def test_removes_subscription(self, client, db, subscribed_email):
+        token = UnsubscribeTokenSigner(b"unsubscribe-secret").sign(subscribed_email)
+        response = client.post(
+            f"/one-click-unsubscribe/{subscribed_email}",
+            params={"token": token.to_string()},
+            data={"List-Unsubscribe": "One-Click"},
+        )
+
+        assert_success(response)
+        assert db.get(Query().email == subscribed_email) is None
+
+    @pytest.mark.parametrize("token", ("", "not-base64!", "dG9rZW4="))
+    def test_rejects_invalid_token(self, token, client, db, subscribed_email):
+        response = client.post(
+            f"/one-click-unsubscribe/{subscribed_email}", params={"token": token}
+        )
+
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert db.get(Query().email == subscribed_email) is not None
+
+
+@pytest.fixture
+def multi_feed_client(tmp_path, confirmation_requester, rate_limiter):
+    dbs = {
+        "primary.json": TinyDB(storage=MemoryStorage),
+        "blog.json": TinyDB(storage=MemoryStorage),
+    }
+    config = Config(
+        db=str(tmp_path / "primary.json"),
+        rss="https://primary.local/index.xml",
+        template_vars=TemplateVarsConfig(
+            display_name="Primary", host="primary.local", sender="primary@local"
+        ),
+        email_templates="templates/example",
+        confirm_timeout_minutes=60,
+        feeds={
+            "blog": FeedConfig(
+                db=str(tmp_path / "blog.json"), rss="https://blog.local/index.xml"
+            )
+        },
+    )
+
+    def get_test_db(config: Config = Depends(get_feed_config)):
+        return dbs[Path(config.db).name]
+
+    app.dependency_overrides[get_config] = lambda: config
+    app.dependency_overrides[get_db] = get_test_db
+    app.dependency_overrides[get_confirmation_requester] = (
+        lambda: confirmation_requester
+    )
+    app.dependency_overrides[get_rate_limiter] = lambda: rate_limiter
+    yield TestClient(app), dbs
+    del app.dependency_overrides[get_config]
+    del app.dependency_overrides[get_db]
+    del app.dependency_overrides[get_confirmation_requester]
+    del app.dependency_overrides[get_rate_limiter]
+
+
+def test_subscription_to_selected_feed(multi_feed_client):
+    client, dbs = multi_feed_client
+    given_email = Email("foo@test.org")
+
+    assert_success(client.post(f"/subscribe/{given_email}?feed=blog"))
+
+    assert dbs["blog.json"].get(Query().email == given_email) is not None
+    assert dbs["primary.json"].get(Query().email == given_email) is None
+
+
+def test_subscription_to_unknown_feed(multi_feed_client):
+    client, _ = multi_feed_client
+    response = client.post("/subscribe/foo@test.org?feed=unknown")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.fixture
+def notification_runner():
+    return MagicMock()
+
+
+@pytest.fixture
+def webhook_client(notification_runner):
+    config = Config(
+        db="primary.json",
+        rss="https://primary.local/index.xml",
+        template_vars=TemplateVarsConfig(
+            display_name="Primary", host="primary.local", sender="primary@local"
+        ),
+        email_templates="templates/example",
+        confirm_timeout_minutes=60,
+        webhook=WebhookConfig(secret="webhook-secret"),
+    )
+    app.dependency_overrides[get_config] = lambda: config
+    app.dependency_overrides[get_notification_runner] = lambda: notification_runner
+    yield TestClient(app)
+    del app.dependency_overrides[get_config]
+    del app.dependency_overrides[get_notification_runner]
+
+
+def sign(body: bytes, secret: str = "webhook-secret") -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+class TestFeedUpdated:
+    body = b"<rss></rss>"
+
+    def test_triggers_notification_for_signed_request(
+        self, webhook_client, notification_runner
+    ):
+        response = webhook_client.post(
+            "/feed-updated",
+            content=self.body,
+            headers={"X-Hub-Signature-256": sign(self.body)},
+        )
+        assert response.status_code == status.HTTP_202_ACCEPTED
+        notification_runner.assert_called_once()
+
+    @pytest.mark.parametrize(
+        "headers",
+        [{}, {"X-Hub-Signature-256": sign(b"<rss></rss>", secret="wrong-secret")}],
+    )
+    def test_rejects_unsigned_requests(
+        self, headers, webhook_client, notification_runner
+    ):
+        response = webhook_client.post(
+            "/feed-updated", content=self.body, headers=headers
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        notification_runner.assert_not_called()
+
+    def test_is_disabled_without_webhook_config(self, notification_runner):
+        app.dependency_overrides[get_notification_runner] = lambda: notification_runner
+        app.dependency_overrides[get_config] = lambda: Config(
+            db="primary.json",
+            rss="https://primary.local/index.xml",
+            template_vars=TemplateVarsConfig(
+                display_name="Primary", host="primary.local", sender="primary@local"
+            ),
+            email_templates="templates/example",
+            confirm_timeout_minutes=60,
+        )
+        try:
+            response = TestClient(app).post(
+                "/feed-updated",
+                content=self.body,
+                headers={"X-Hub-Signature-256": sign(self.body)},
+            )
+        finally:
+            del app.dependency_overrides[get_config]
+            del app.dependency_overrides[get_notification_runner]
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    def test_verifies_websub_subscription_intent(self, webhook_client):
+        response = webhook_client.get(
+            "/feed-updated",
+            params={
+                "hub.mode": "subscribe",
+                "hub.topic": "https://primary.local/index.xml",
+                "hub.challenge": "challenge-value",
+            },
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.text == "challenge-value"
+
+    def test_denies_websub_subscription_for_other_topic(self, webhook_client):
+        response = webhook_client.get(
+            "/feed-updated",
+            params={
+                "hub.mode": "subscribe",
+                "hub.topic": "https://other.local/index.xml",
+                "hub.challenge": "challenge-value",
+            },
+        )
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+def clear_dependency_caches():
+    for dependency in (
+        get_config,
+        get_db,
+        get_db_lock,
+        get_connection,
+        get_message_provider,
+        get_confirmation_requester,
+        get_storage,
+        get_registration_service,
+        get_notification_runner,
+        get_rate_limiter,
+        get_trusted_proxies,
+    ):
+        dependency.cache_clear()
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    config = {
+        "db": str(tmp_path / "db.json"),
+        "rss": "https://primary.local/index.xml",
+        "template_vars": {
+            "display_name": "Primary",
+            "host": "primary.local",
+            "sender": "primary@local",
+        },
+        "email_templates": str(Path(__file__).parent.parent / "templates" / "example"),
+        "confirm_timeout_minutes": 60,
+    }
+    config_path = tmp_path / "config.json"
+    config_path.write_text(json.dumps(config))
+    monkeypatch.setenv("DOVESEED_CONFIG", str(config_path))
+    clear_dependency_caches()
+    yield config_path, config
+    clear_dependency_caches()
+
+
+class TestLifespan:
+    def test_reports_ready_after_warm_up(self, config_file):
+        with TestClient(app) as client:
+            assert get_config.cache_info().currsize == 1
+            assert get_registration_service.cache_info().currsize == 1
+            response = client.get("/health")
+        assert response.status_code == status.HTTP_204_NO_CONTENT
+
+    def test_requests_use_warmed_up_dependencies(self, config_file):
+        warmed_up = (
+            get_db,
+            get_db_lock,
+            get_storage,
+            get_connection,
+            get_message_provider,
+            get_confirmation_requester,
+            get_registration_service,
+            get_rate_limiter,
+            get_trusted_proxies,
+        )
+        with TestClient(app) as client:
+            misses = [dependency.cache_info().misses for dependency in warmed_up]
+            assert_success(client.post("/subscribe/foo@test.org"))
+            assert [
+                dependency.cache_info().misses for dependency in warmed_up
+            ] == misses
+
+    def test_reports_not_ready_without_warm_up(self, config_file):
+        response = TestClient(app).get("/health")
+        assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+
+    def test_fails_startup_for_invalid_config(self, config_file):
+        config_path, config = config_file
+        config["email_templates"] = str(config_path.parent / "missing")
+        config_path.write_text(json.dumps(config))
+        with pytest.raises(TemplateNotFound):
+            with TestClient(app):
+                pass
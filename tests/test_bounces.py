@@ -0,0 +1,174 @@
+import mailbox
+from datetime import datetime
+from email import message_from_string
+from unittest.mock import MagicMock
+
+import pytest
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from doveseed.bounces import (
+    Bounce,
+    Suppression,
+    is_delivery_report,
+    open_mailbox,
+    parse_dsn,
+    process_bounces,
+)
+from doveseed.domain_types import Email, FeedItem, State
+from doveseed.email_notification import EmailNotifier
+from doveseed.registration import Registration
+from doveseed.storage import TinyDbStorage
+
+NOW = datetime(2019, 10, 25, 13, 37)
+
+
+def create_dsn(*recipients):
+    blocks = "\n".join(
+        f"Final-Recipient: rfc822; {email}\nAction: {action}\nStatus: {status}\n"
+        for email, action, status in recipients
+    )
+    return message_from_string(
+        "From: MAILER-DAEMON@mail.test.org\n"
+        "To: newsletter@test.org\n"
+        "Subject: Undelivered Mail Returned to Sender\n"
+        "MIME-Version: 1.0\n"
+        'Content-Type: multipart/report; report-type=delivery-status; boundary="b"\n'
+        "\n"
+        "--b\n"
+        "Content-Type: text/plain\n"
+        "\n"
+        "Delivery failed.\n"
+        "--b\n"
+        "Content-Type: message/delivery-status\n"
+        "\n"
+        "Reporting-MTA: dns; mail.test.org\n"
+        "\n"
+        f"{blocks}"
+        "--b--\n"
+    )
+
+
+@pytest.fixture
+def storage():
+    return TinyDbStorage(TinyDB(storage=MemoryStorage))
+
+
+def test_parse_dsn():
+    message = create_dsn(
+        ("gone@test.org", "failed", "5.1.1"),
+        ("full@test.org", "failed", "4.2.2"),
+        ("later@test.org", "delayed", "4.4.1"),
+    )
+
+    assert is_delivery_report(message)
+    assert parse_dsn(message) == [
+        Bounce(email=Email("gone@test.org"), status="5.1.1"),
+        Bounce(email=Email("full@test.org"), status="4.2.2"),
+    ]
+
+
+def test_ignores_regular_messages():
+    message = message_from_string("Subject: Hello\n\nJust a reply.\n")
+
+    assert not is_delivery_report(message)
+    assert parse_dsn(message) == []
+
+
+def test_process_bounces_records_hard_bounces_and_unsubscribes(storage):
+    storage.insert_multiple(
+        [
+            Registration(
+                email=Email(email),
+                last_update=datetime(2019, 1, 1),
+                state=State.subscribed,
+            )
+            for email in ("ok@test.org", "Gone@Test.org", "full@test.org")
+        ]
+    )
+    storage.upsert_suppressions(
+        [
+            Suppression(
+                email=Email("gone@test.org"),
+                bounces=1,
+                last_bounce=datetime(2019, 10, 1),
+            )
+        ]
+    )
+
+    result = process_bounces(
+        storage,
+        [
+            create_dsn(("GONE@test.org", "failed", "5.1.1")),
+            create_dsn(
+                ("full@test.org", "failed", "5.2.2"),
+                ("ok@test.org", "failed", "4.2.2"),
+            ),
+        ],
+        now=NOW,
+        threshold=2,
+    )
+
+    assert result.hard_bounces == 2
+    assert result.soft_bounces == 1
+    assert result.unsubscribed == ["Gone@Test.org"]
+    assert sorted(storage.emails()) == ["full@test.org", "ok@test.org"]
+    assert sorted(storage.get_suppressions(), key=lambda s: s.email) == [
+        Suppression(email=Email("full@test.org"), bounces=1, last_bounce=NOW),
+        Suppression(email=Email("gone@test.org"), bounces=2, last_bounce=NOW),
+    ]
+    assert [
+        subscriber.email for subscriber in storage.get_all_active_subscribers()
+    ] == ["ok@test.org"]
+
+
+def test_skips_address_below_threshold_on_next_send(storage):
+    storage.insert_multiple(
+        [
+            Registration(
+                email=Email(email),
+                last_update=datetime(2019, 1, 1),
+                state=State.subscribed,
+            )
+            for email in ("ok@test.org", "Bounced@Test.org")
+        ]
+    )
+    process_bounces(
+        storage,
+        [create_dsn(("bounced@test.org", "failed", "5.1.1"))],
+        now=NOW,
+        threshold=3,
+    )
+    connection = MagicMock()
+    connection_manager = MagicMock()
+    connection_manager.__enter__.return_value = connection
+    message_provider = MagicMock()
+    message_provider.get_new_post_msg.side_effect = lambda feed_item, to_email: to_email
+
+    EmailNotifier(storage, lambda: connection_manager, message_provider)(
+        FeedItem(
+            title="title",
+            link="link",
+            pub_date=NOW,
+            description="description",
+            image=None,
+        )
+    )
+
+    assert sorted(storage.emails()) == ["Bounced@Test.org", "ok@test.org"]
+    connection.send_message.assert_called_once_with("ok@test.org")
+
+
+def test_open_mailbox(tmp_path):
+    mbox = mailbox.mbox(tmp_path / "bounces.mbox")
+    mbox.add(create_dsn(("gone@test.org", "failed", "5.1.1")))
+    mbox.close()
+    mailbox.Maildir(tmp_path / "maildir").add(
+        create_dsn(("gone@test.org", "failed", "5.1.1"))
+    )
+
+    for path in (tmp_path / "bounces.mbox", tmp_path / "maildir"):
+        messages = list(open_mailbox(str(path)))
+        assert [parse_dsn(message) for message in messages] == [
+            [Bounce(email=Email("gone@test.org"), status="5.1.1")]
+        ]
@@ -0,0 +1,269 @@
+import io
+from datetime import datetime
+
+import pytest
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from doveseed.bulk import (
+    export_registrations,
+    import_registrations,
+    purge_emails,
+    read_emails,
+    request_reconfirmation,
+    select_subscribers,
+    unsubscribe_domain,
+)
+from doveseed.domain_types import Action, Email, State, Token
+from doveseed.registration import Registration
+from doveseed.storage import TinyDbStorage
+
+NOW = datetime(2019, 10, 25, 13, 37)
+
+
+@pytest.fixture
+def tiny_db():
+    return TinyDB(storage=MemoryStorage)
+
+
+@pytest.fixture
+def storage(tiny_db):
+    return TinyDbStorage(tiny_db)
+
+
+class TestReadEmails:
+    def test_reads_email_column_from_csv(self):
+        source = io.StringIO("name,email\nFoo,foo@test.org\nBar,bar@test.org\n")
+        assert list(read_emails(source, "csv")) == ["foo@test.org", "bar@test.org"]
+
+    def test_requires_email_column_in_csv(self):
+        with pytest.raises(ValueError):
+            list(read_emails(io.StringIO("name\nFoo\n"), "csv"))
+
+    def test_reads_jsonl(self):
+        source = io.StringIO('{"email": "foo@test.org"}\n\n{"email": "bar@test.org"}\n')
+        assert list(read_emails(source, "jsonl")) == ["foo@test.org", "bar@test.org"]
+
+
+class TestImportRegistrations:
+    def test_imports_valid_new_addresses_in_batches(self, storage, tiny_db):
+        storage.upsert(
+            Registration(
+                email=Email("known@test.org"),
+                last_update=datetime(2019, 1, 1),
+                state=State.subscribed,
+            )
+        )
+        writes = []
+        original_write = tiny_db.storage.write
+
+        def write(data):
+            writes.append(data)
+            original_write(data)
+
+        tiny_db.storage.write = write
+
+        result = import_registrations(
+            storage,
+            [
+                "a@test.org",
+                "invalid address@test.org, other@test.org",
+                "known@test.org",
+                " b@test.org ",
+                "a@test.org",
+                "c@test.org",
+            ],
+            state=State.subscribed,
+            now=NOW,
+            batch_size=3,
+        )
+
+        assert (result.imported, result.invalid, result.duplicates) == (3, 1, 2)
+        assert len(writes) == 2
+        assert storage.find(Email("b@test.org")) == Registration(
+            email=Email("b@test.org"), last_update=NOW, state=State.subscribed
+        )
+        assert storage.find(Email("known@test.org")) == Registration(
+            email=Email("known@test.org"),
+            last_update=datetime(2019, 1, 1),
+            state=State.subscribed,
+        )
+
+    def test_imports_as_pending_subscriptions(self, storage):
+        import_registrations(
+            storage, ["a@test.org"], state=State.pending_subscribe, now=NOW
+        )
+        assert storage.find(Email("a@test.org")) == Registration(
+            email=Email("a@test.org"),
+            last_update=NOW,
+            state=State.pending_subscribe,
+            confirm_action=Action.subscribe,
+        )
+
+    def test_assigns_confirm_tokens_to_pending_subscriptions(self, storage):
+        result = import_registrations(
+            storage,
+            ["a@test.org"],
+            state=State.pending_subscribe,
+            now=NOW,
+            token_generator=iter([Token(b"token")]),
+        )
+        expected = Registration(
+            email=Email("a@test.org"),
+            last_update=NOW,
+            state=State.pending_subscribe,
+            confirm_action=Action.subscribe,
+            confirm_token=Token(b"token"),
+        )
+        assert result.imported == 1
+        assert storage.find(Email("a@test.org")) == expected
+
+    def test_requests_confirmation_per_committed_batch(self, storage):
+        batches = []
+
+        def send_confirmations(registrations):
+            batches.append(
+                (
+                    [registration.email for registration in registrations],
+                    sorted(storage.emails()),
+                )
+            )
+            return [r for r in registrations if r.email == "b@test.org"]
+
+        result = import_registrations(
+            storage,
+            ["a@test.org", "b@test.org", "c@test.org"],
+            state=State.pending_subscribe,
+            now=NOW,
+            batch_size=2,
+            token_generator=(Token(bytes([i])) for i in range(3)),
+            send_confirmations=send_confirmations,
+        )
+
+        assert batches == [
+            (["a@test.org", "b@test.org"], ["a@test.org", "b@test.org"]),
+            (["c@test.org"], ["a@test.org", "c@test.org"]),
+        ]
+        assert sorted(storage.emails()) == ["a@test.org", "c@test.org"]
+        assert result.imported == 3
+        assert result.confirmations_requested == 2
+        assert result.confirmations_failed == 1
+
+
+class TestExportRegistrations:
+    @pytest.fixture
+    def storage_with_registrations(self, storage):
+        storage.insert_multiple(
+            [
+                Registration(
+                    email=Email("a@test.org"), last_update=NOW, state=State.subscribed
+                ),
+                Registration(
+                    email=Email("b@test.org"),
+                    last_update=NOW,
+                    state=State.pending_subscribe,
+                    confirm_action=Action.subscribe,
+                ),
+            ]
+        )
+        storage.set_last_seen(datetime(2019, 10, 25).astimezone())
+        return storage
+
+    def test_exports_csv(self, storage_with_registrations):
+        destination = io.StringIO()
+        assert export_registrations(storage_with_registrations, destination, "csv") == 2
+        assert destination.getvalue().splitlines() == [
+            "email,state,last_update",
+            "a@test.org,subscribed,2019-10-25T13:37:00",
+            "b@test.org,pending_subscribe,2019-10-25T13:37:00",
+        ]
+
+    def test_roundtrip_through_jsonl(self, storage_with_registrations, storage):
+        destination = io.StringIO()
+        export_registrations(storage_with_registrations, destination, "jsonl")
+
+        target = TinyDbStorage(TinyDB(storage=MemoryStorage))
+        destination.seek(0)
+        result = import_registrations(
+            target, read_emails(destination, "jsonl"), state=State.subscribed, now=NOW
+        )
+
+        assert result.imported == 2
+        assert sorted(target.emails()) == ["a@test.org", "b@test.org"]
+
+
+class TestAdminOperations:
+    @pytest.fixture
+    def storage_with_registrations(self, storage):
+        storage.insert_multiple(
+            [
+                Registration(
+                    email=Email("a@test.org"),
+                    last_update=datetime(2019, 1, 1),
+                    state=State.subscribed,
+                ),
+                Registration(
+                    email=Email("b@Example.org"),
+                    last_update=datetime(2019, 1, 1),
+                    state=State.subscribed,
+                ),
+                Registration(
+                    email=Email("c@example.org"),
+                    last_update=NOW,
+                    state=State.subscribed,
+                ),
+                Registration(
+                    email=Email("d@example.org"),
+                    last_update=datetime(2019, 1, 1),
+                    state=State.pending_subscribe,
+                    confirm_action=Action.subscribe,
+                    confirm_token=Token(b"pending"),
+                ),
+            ]
+        )
+        return storage
+
+    def test_unsubscribe_domain(self, storage_with_registrations):
+        assert unsubscribe_domain(storage_with_registrations, "EXAMPLE.org") == 3
+        assert list(storage_with_registrations.emails()) == ["a@test.org"]
+
+    def test_purge_emails(self, storage_with_registrations):
+        purged = purge_emails(
+            storage_with_registrations,
+            ["a@test.org ", "c@example.org", "unknown@test.org"],
+        )
+
+        assert purged == 2
+        assert sorted(storage_with_registrations.emails()) == [
+            "b@Example.org",
+            "d@example.org",
+        ]
+
+    def test_request_reconfirmation_of_cohort(self, storage_with_registrations):
+        cohort = select_subscribers(
+            storage_with_registrations,
+            domain="example.org",
+            updated_before=datetime(2019, 6, 1),
+        )
+        pending = request_reconfirmation(
+            storage_with_registrations,
+            cohort,
+            token_generator=iter([Token(b"token")]),
+            now=NOW,
+        )
+
+        expected = Registration(
+            email=Email("b@Example.org"),
+            last_update=NOW,
+            state=State.pending_subscribe,
+            confirm_action=Action.subscribe,
+            confirm_token=Token(b"token"),
+        )
+        assert [registration.email for registration in cohort] == ["b@Example.org"]
+        assert cohort[0].state == State.subscribed
+        assert pending == [expected]
+        assert storage_with_registrations.find(Email("b@Example.org")) == expected
+        assert (
+            storage_with_registrations.find(Email("a@test.org")).state
+            == State.subscribed
+        )
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from smtplib import SMTPRecipientsRefused
+from unittest.mock import MagicMock
+
+from tinydb import TinyDB
+
+from doveseed import cli
+from doveseed.cli import run_exclusively
+from doveseed.domain_types import Email, State
+from doveseed.registration import Registration
+from doveseed.sharding import Shard
+from doveseed.storage import TinyDbStorage
+
+
+def test_run_exclusively_skips_run_while_another_one_is_in_progress(tmp_path):
+    config = {"db": str(tmp_path / "db.json"), "rss": "https://test.local/index.xml"}
+    overlapping = MagicMock()
+    other_shard = MagicMock()
+
+    def run():
+        run_exclusively(config, overlapping)
+        run_exclusively(config, other_shard, shard=Shard(index=0, count=2))
+
+    run_exclusively(config, run)
+    assert not overlapping.called
+    assert other_shard.called
+
+    run_exclusively(config, overlapping)
+    assert overlapping.called
+
+
+class FakeConnection:
+    def __init__(self, connection):
+        self._connection = connection
+
+    @contextmanager
+    def __call__(self, *, deadline=None):
+        yield self._connection
+
+    def close(self):
+        pass
+
+
+def given_failing_connection(monkeypatch):
+    connection = MagicMock()
+
+    def send_message(message):
+        if message["To"] == "fails@test.org":
+            raise SMTPRecipientsRefused({"fails@test.org": (550, b"unknown")})
+
+    connection.send_message.side_effect = send_message
+    monkeypatch.setattr(
+        cli, "persistent_smtp_connection", lambda **kwargs: FakeConnection(connection)
+    )
+    return connection
+
+
+def given_config(tmp_path):
+    return {
+        "db": str(tmp_path / "db.json"),
+        "rss": "https://test.local/index.xml",
+        "smtp": {},
+        "template_vars": {
+            "display_name": "Test",
+            "host": "test.local",
+            "sender": "test@test.local",
+            "confirm_url_format": "https://{host}/confirm/{email}?token={token}",
+        },
+        "email_templates": str(Path(__file__).parent.parent / "templates" / "example"),
+    }
+
+
+def test_import_requests_confirmation_of_pending_subscriptions(tmp_path, monkeypatch):
+    connection = given_failing_connection(monkeypatch)
+    config = given_config(tmp_path)
+    (tmp_path / "import.csv").write_text("email\nok@test.org\nfails@test.org\n")
+
+    result = cli.import_subscribers(config, str(tmp_path / "import.csv"))
+
+    assert result.imported == 2
+    assert result.confirmations_requested == 1
+    assert result.confirmations_failed == 1
+    assert connection.send_message.call_count == 2
+    with TinyDB(config["db"]) as db:
+        assert list(TinyDbStorage(db).emails()) == ["ok@test.org"]
+
+
+class UnreachableConnection:
+    def __call__(self, *, deadline=None):
+        raise ConnectionRefusedError()
+
+    def close(self):
+        pass
+
+
+def test_import_removes_pending_subscriptions_if_server_is_unreachable(
+    tmp_path, monkeypatch
+):
+    monkeypatch.setattr(
+        cli, "persistent_smtp_connection", lambda **kwargs: UnreachableConnection()
+    )
+    config = given_config(tmp_path)
+    (tmp_path / "import.csv").write_text("email\na@test.org\nb@test.org\n")
+
+    result = cli.import_subscribers(config, str(tmp_path / "import.csv"))
+
+    assert result.confirmations_requested == 0
+    assert result.confirmations_failed == 2
+    with TinyDB(config["db"]) as db:
+        assert list(TinyDbStorage(db).emails()) == []
+
+
+def test_reconfirm_restores_subscriptions_whose_request_failed(tmp_path, monkeypatch):
+    connection = given_failing_connection(monkeypatch)
+    config = given_config(tmp_path)
+    subscribed = [
+        Registration(
+            email=Email(email),
+            state=State.subscribed,
+            last_update=datetime(2019, 1, 1),
+        )
+        for email in ("ok@test.org", "fails@test.org")
+    ]
+    with TinyDB(config["db"]) as db:
+        TinyDbStorage(db).apply_changes(upserts=subscribed)
+
+    assert cli.reconfirm_subscribers(config) == 1
+
+    assert connection.send_message.call_count == 2
+    with TinyDB(config["db"]) as db:
+        registrations = {
+            registration.email: registration for registration in TinyDbStorage(db).all()
+        }
+    assert registrations[Email("ok@test.org")].state == State.pending_subscribe
+    assert registrations[Email("fails@test.org")] == subscribed[1]
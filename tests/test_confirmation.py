@@ -1,7 +1,11 @@
 from email.message import EmailMessage
+from smtplib import SMTPServerDisconnected
 from unittest.mock import MagicMock
 
+import pytest
+
 from doveseed.confirmation import EmailConfirmationRequester
+from doveseed.deadline import Deadline, DeadlineExceeded
 from doveseed.domain_types import Action, Email, Token
 
 
@@ -19,7 +23,8 @@ def test_email_confirmation_requester():
     message_provider.get_confirmation_request_msg.return_value = message
 
     requester = EmailConfirmationRequester(
-        connection=lambda: connection_manager, message_provider=message_provider
+        connection=lambda deadline=None: connection_manager,
+        message_provider=message_provider,
     )
     requester.request_confirmation(email, action=action, confirm_token=confirm_token)
 
@@ -27,3 +32,66 @@ def test_email_confirmation_requester():
         email, action=action, confirm_token=confirm_token
     )
     connection.send_message.assert_called_once_with(message)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_email_confirmation_requester_passes_deadline_to_connection():
+    connection_manager = MagicMock()
+    requester = EmailConfirmationRequester(
+        connection=connection_manager, message_provider=MagicMock()
+    )
+    deadline = Deadline(10)
+    requester.request_confirmation(
+        Email("email"),
+        action=Action.subscribe,
+        confirm_token=Token(b"token"),
+        deadline=deadline,
+    )
+
+    connection_manager.assert_called_once_with(deadline=deadline)
+
+
+def test_email_confirmation_requester_does_not_connect_after_deadline():
+    connection_manager = MagicMock()
+    requester = EmailConfirmationRequester(
+        connection=connection_manager, message_provider=MagicMock()
+    )
+    with pytest.raises(DeadlineExceeded):
+        requester.request_confirmation(
+            Email("email"),
+            action=Action.subscribe,
+            confirm_token=Token(b"token"),
+            deadline=Deadline(0),
+        )
+
+    assert not connection_manager.called
+
+
+def test_email_confirmation_requester_reports_timeouts_as_exceeded_deadline():
+    clock = Clock()
+    connection = MagicMock()
+    connection_manager = MagicMock()
+    connection_manager.return_value.__enter__.return_value = connection
+
+    def time_out(message):
+        clock.now += 10
+        raise SMTPServerDisconnected("Connection unexpectedly closed: timed out")
+
+    connection.send_message.side_effect = time_out
+    requester = EmailConfirmationRequester(
+        connection=connection_manager, message_provider=MagicMock()
+    )
+    with pytest.raises(DeadlineExceeded):
+        requester.request_confirmation(
+            Email("email"),
+            action=Action.subscribe,
+            confirm_token=Token(b"token"),
+            deadline=Deadline(5, clock=clock),
+        )
@@ -0,0 +1,112 @@
+import threading
+from typing import List
+from unittest.mock import MagicMock
+
+from doveseed.daemon import CoalescingRunner, NotifierDaemon
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_polls_and_cleans_until_stopped():
+    clock = FakeClock()
+    clean = MagicMock()
+    polls: List[float] = []
+
+    def poll():
+        polls.append(clock.now)
+        clock.now += 10
+        if len(polls) == 5:
+            daemon.stop()
+
+    daemon = NotifierDaemon(
+        poll=poll,
+        clean=clean,
+        poll_interval_seconds=0,
+        clean_interval_seconds=25,
+        clock=clock,
+    )
+    daemon.run()
+
+    assert polls == [0, 10, 20, 30, 40]
+    assert clean.call_count == 2
+
+
+def test_finishes_running_poll_when_stopped():
+    finished: List[bool] = []
+
+    def poll():
+        daemon.stop()
+        finished.append(True)
+
+    daemon = NotifierDaemon(
+        poll=poll,
+        clean=MagicMock(),
+        poll_interval_seconds=60,
+        clean_interval_seconds=60,
+    )
+    daemon.run()
+
+    assert finished == [True]
+
+
+def test_keeps_running_after_failing_poll():
+    polls: List[bool] = []
+
+    def poll():
+        polls.append(True)
+        if len(polls) == 1:
+            raise RuntimeError("feed unavailable")
+        daemon.stop()
+
+    daemon = NotifierDaemon(
+        poll=poll,
+        clean=MagicMock(),
+        poll_interval_seconds=0,
+        clean_interval_seconds=60,
+    )
+    daemon.run()
+
+    assert len(polls) == 2
+
+
+class TestCoalescingRunner:
+    def test_runs_task(self):
+        task = MagicMock()
+        CoalescingRunner(task)()
+        task.assert_called_once()
+
+    def test_coalesces_triggers_during_run_into_single_rerun(self):
+        started = threading.Event()
+        proceed = threading.Event()
+        runs: List[bool] = []
+
+        def task():
+            runs.append(True)
+            if len(runs) == 1:
+                started.set()
+                proceed.wait(timeout=5)
+
+        runner = CoalescingRunner(task)
+        thread = threading.Thread(target=runner)
+        thread.start()
+        assert started.wait(timeout=5)
+        for _ in range(3):
+            runner()
+        assert len(runs) == 1
+        proceed.set()
+        thread.join(timeout=5)
+
+        assert len(runs) == 2
+
+    def test_recovers_from_failing_task(self):
+        task = MagicMock(side_effect=[RuntimeError("feed unavailable"), None])
+        runner = CoalescingRunner(task)
+        runner()
+        runner()
+        assert task.call_count == 2
@@ -1,10 +1,116 @@
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from email.message import EmailMessage
+from smtplib import SMTPRecipientsRefused, SMTPSenderRefused, SMTPServerDisconnected
+from typing import List
 from unittest.mock import MagicMock, call
 
+import pytest
+
 from doveseed.domain_types import Email, FeedItem, State
-from doveseed.email_notification import EmailNotifier
+from doveseed.email_notification import EmailNotifier, PendingDelivery
 from doveseed.registration import Registration
+from doveseed.throttle import DomainScheduler
+
+NOW = datetime(2019, 11, 22, 13, 37)
+
+
+@pytest.fixture
+def subscribers():
+    return [
+        Registration(
+            email=Email("mail1@test.org"),
+            last_update=datetime.utcnow(),
+            state=State.subscribed,
+        ),
+        Registration(
+            email=Email("mail2@test.org"),
+            last_update=datetime.utcnow(),
+            state=State.subscribed,
+        ),
+    ]
+
+
+@pytest.fixture
+def feed_item():
+    return FeedItem(
+        title="title",
+        link="link",
+        pub_date=datetime.now(),
+        description="description",
+        image=None,
+    )
+
+
+@pytest.fixture
+def storage(subscribers):
+    storage = MagicMock()
+    storage.get_all_active_subscribers.return_value = subscribers
+    storage.get_due_deliveries.return_value = []
+    return storage
+
+
+@pytest.fixture
+def connection():
+    return MagicMock()
+
+
+@pytest.fixture
+def connection_manager(connection):
+    connection_manager = MagicMock()
+    connection_manager.__enter__.return_value = connection
+    return connection_manager
+
+
+@pytest.fixture
+def message_provider():
+    message_provider = MagicMock()
+    message_provider.get_new_post_msg.side_effect = lambda feed_item, to_email: (
+        _message_to(to_email)
+    )
+    return message_provider
+
+
+@pytest.fixture
+def email_notifier(storage, connection_manager, message_provider):
+    return EmailNotifier(
+        storage,
+        lambda: connection_manager,
+        message_provider,
+        retry_policy=EmailNotifier.RetryPolicy(
+            base_delay_minutes=5, max_delay_minutes=60, max_attempts=3
+        ),
+        utcnow=lambda: NOW,
+    )
+
+
+def _message_to(to_email: Email) -> EmailMessage:
+    message = EmailMessage()
+    message["To"] = to_email
+    return message
+
+
+class ClosingConnection:
+    def __init__(self, attempts: List[str], closing_email: Email):
+        self.attempts = attempts
+        self.closing_email = closing_email
+        self.closed = False
+
+    def send_message(self, message):
+        self.attempts.append(message["To"])
+        if self.closed:
+            raise SMTPServerDisconnected("please run connect() first")
+        if self.attempts == [self.closing_email]:
+            self.closed = True
+            raise SMTPSenderRefused(421, b"closing", "sender@test.org")
+
+
+def _refuse(refused_email: Email, code: int):
+    def send_message(message):
+        if message["To"] == refused_email:
+            raise SMTPRecipientsRefused({refused_email: (code, b"refused")})
+
+    return send_message
 
 
 def test_email_notifier():
@@ -51,3 +157,407 @@ def test_email_notifier():
         any_order=True,
     )
     connection.send_message.assert_has_calls((call(message), call(message)))
+
+
+class TestEmailNotifierFailureIsolation:
+    @pytest.mark.parametrize("code", (450, 550))
+    def test_refused_recipient_does_not_abort_delivery(
+        self, code, email_notifier, connection, feed_item
+    ):
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), code)
+        email_notifier(feed_item)
+        assert [c.args[0]["To"] for c in connection.send_message.call_args_list] == [
+            "mail1@test.org",
+            "mail2@test.org",
+        ]
+
+    def test_transient_failure_is_queued_for_retry(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 451)
+        email_notifier(feed_item)
+        storage.upsert_pending_delivery.assert_called_once_with(
+            PendingDelivery(
+                email=Email("mail1@test.org"),
+                feed_items=[feed_item],
+                attempts=1,
+                next_attempt=NOW + timedelta(minutes=5),
+                last_error=str(
+                    SMTPRecipientsRefused({"mail1@test.org": (451, b"refused")})
+                ),
+            )
+        )
+        assert not storage.add_failed_delivery.called
+
+    def test_transient_sender_failure_is_queued_for_retry(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = SMTPSenderRefused(
+            421, b"try again later", "sender@test.org"
+        )
+        email_notifier(feed_item)
+        assert storage.upsert_pending_delivery.call_count == 2
+
+    def test_permanent_failure_is_recorded(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 550)
+        email_notifier(feed_item)
+        assert not storage.upsert_pending_delivery.called
+        storage.add_failed_delivery.assert_called_once()
+        failure = storage.add_failed_delivery.call_args.args[0]
+        assert failure.email == "mail1@test.org"
+        assert failure.feed_items == [feed_item]
+        assert failure.failed_at == NOW
+
+
+class TestEmailNotifierRetryPending:
+    def _pending(self, email, feed_item, attempts=1):
+        return PendingDelivery(
+            email=Email(email),
+            feed_items=[feed_item],
+            attempts=attempts,
+            next_attempt=NOW,
+            last_error="error",
+        )
+
+    def test_resends_due_deliveries(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        storage.get_due_deliveries.return_value = [
+            self._pending("mail1@test.org", feed_item)
+        ]
+        email_notifier.retry_pending()
+        storage.get_due_deliveries.assert_called_once_with(NOW)
+        assert connection.send_message.call_args.args[0]["To"] == "mail1@test.org"
+        storage.delete_pending_delivery.assert_called_once_with(
+            "mail1@test.org", [feed_item]
+        )
+
+    def test_drops_deliveries_to_inactive_subscribers(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        storage.get_due_deliveries.return_value = [
+            self._pending("gone@test.org", feed_item)
+        ]
+        email_notifier.retry_pending()
+        assert not connection.send_message.called
+        storage.delete_pending_delivery.assert_called_once_with(
+            "gone@test.org", [feed_item]
+        )
+
+    def test_backs_off_exponentially(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        storage.get_due_deliveries.return_value = [
+            self._pending("mail1@test.org", feed_item, attempts=1)
+        ]
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 451)
+        email_notifier.retry_pending()
+        pending = storage.upsert_pending_delivery.call_args.args[0]
+        assert pending.attempts == 2
+        assert pending.next_attempt == NOW + timedelta(minutes=10)
+
+    def test_gives_up_after_max_attempts(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        storage.get_due_deliveries.return_value = [
+            self._pending("mail1@test.org", feed_item, attempts=2)
+        ]
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 451)
+        email_notifier.retry_pending()
+        assert not storage.upsert_pending_delivery.called
+        storage.add_failed_delivery.assert_called_once()
+        storage.delete_pending_delivery.assert_called_once_with(
+            "mail1@test.org", [feed_item]
+        )
+
+
+@pytest.mark.parametrize(
+    "attempts,expected",
+    ((1, timedelta(minutes=5)), (2, timedelta(minutes=10)), (10, timedelta(hours=1))),
+)
+def test_retry_policy_delay(attempts, expected):
+    policy = EmailNotifier.RetryPolicy(base_delay_minutes=5, max_delay_minutes=60)
+    assert policy.delay(attempts) == expected
+
+
+class TestEmailNotifierDigest:
+    def test_sends_one_message_per_subscriber(
+        self, email_notifier, message_provider, connection, feed_item
+    ):
+        message_provider.get_new_posts_msg.side_effect = lambda feed_items, to_email: (
+            _message_to(to_email)
+        )
+        email_notifier.send_digest((feed_item, feed_item))
+        message_provider.get_new_posts_msg.assert_has_calls(
+            (
+                call([feed_item, feed_item], Email("mail1@test.org")),
+                call([feed_item, feed_item], Email("mail2@test.org")),
+            )
+        )
+        assert not message_provider.get_new_post_msg.called
+        assert connection.send_message.call_count == 2
+
+    def test_retries_digest_with_digest_template(
+        self, email_notifier, storage, message_provider, connection, feed_item
+    ):
+        storage.get_due_deliveries.return_value = [
+            PendingDelivery(
+                email=Email("mail1@test.org"),
+                feed_items=[feed_item, feed_item],
+                attempts=1,
+                next_attempt=NOW,
+                last_error="error",
+            )
+        ]
+        email_notifier.retry_pending()
+        message_provider.get_new_posts_msg.assert_called_once_with(
+            [feed_item, feed_item], Email("mail1@test.org")
+        )
+
+
+class TestEmailNotifierSharedDelivery:
+    @pytest.fixture
+    def subscribers(self):
+        return [
+            Registration(
+                email=Email(email),
+                last_update=datetime.utcnow(),
+                state=State.subscribed,
+            )
+            for email in (
+                "mail1@test.org",
+                "mail1@other.org",
+                "mail2@Test.org",
+                "mail3@test.org",
+            )
+        ]
+
+    @pytest.fixture
+    def message_provider(self):
+        message_provider = MagicMock()
+        message_provider.is_personalized.return_value = False
+        message_provider.get_shared_msg.return_value = _message_to(
+            Email("undisclosed-recipients:;")
+        )
+        return message_provider
+
+    @pytest.fixture
+    def connection(self):
+        connection = MagicMock()
+        connection.max_recipients = None
+        connection.send_message.return_value = {}
+        return connection
+
+    @pytest.fixture
+    def email_notifier(self, storage, connection_manager, message_provider):
+        return EmailNotifier(
+            storage,
+            lambda: connection_manager,
+            message_provider,
+            batch_policy=EmailNotifier.BatchPolicy(max_recipients=2),
+            utcnow=lambda: NOW,
+        )
+
+    def test_sends_shared_message_in_batches_per_domain(
+        self, email_notifier, message_provider, connection, feed_item
+    ):
+        email_notifier(feed_item)
+
+        message_provider.get_shared_msg.assert_called_once_with([feed_item])
+        assert not message_provider.get_new_post_msg.called
+        assert [
+            c.kwargs["to_addrs"] for c in connection.send_message.call_args_list
+        ] == [
+            ["mail1@test.org", "mail2@Test.org"],
+            ["mail3@test.org"],
+            ["mail1@other.org"],
+        ]
+
+    def test_respects_recipient_limit_of_server(
+        self, email_notifier, connection, feed_item
+    ):
+        connection.max_recipients = 1
+        email_notifier(feed_item)
+        assert connection.send_message.call_count == 4
+
+    def test_queues_refused_recipients_for_retry(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = [
+            {"mail1@test.org": (452, b"too many recipients")},
+            {},
+            {},
+        ]
+        email_notifier(feed_item)
+
+        (pending,) = [c.args[0] for c in storage.upsert_pending_delivery.call_args_list]
+        assert pending.email == "mail1@test.org"
+        assert pending.feed_items == [feed_item]
+        assert pending.attempts == 1
+
+    def test_queues_batch_for_retry_on_transaction_failure(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = [
+            SMTPSenderRefused(451, b"try later", "sender@test.org"),
+            {},
+            {},
+        ]
+        email_notifier(feed_item)
+
+        assert [
+            c.args[0].email for c in storage.upsert_pending_delivery.call_args_list
+        ] == ["mail1@test.org", "mail2@Test.org"]
+
+    def test_sends_personalized_messages_individually(
+        self, email_notifier, message_provider, connection, feed_item
+    ):
+        message_provider.is_personalized.return_value = True
+        message_provider.get_new_post_msg.side_effect = lambda feed_item, to_email: (
+            _message_to(to_email)
+        )
+        email_notifier(feed_item)
+
+        assert not message_provider.get_shared_msg.called
+        assert connection.send_message.call_count == 4
+
+
+class TestEmailNotifierThrottling:
+    @pytest.fixture
+    def subscribers(self):
+        return [
+            Registration(
+                email=Email(email),
+                last_update=datetime.utcnow(),
+                state=State.subscribed,
+            )
+            for email in ("mail1@test.org", "mail2@test.org", "mail1@other.org")
+        ]
+
+    @pytest.fixture
+    def sleeps(self):
+        return []
+
+    @pytest.fixture
+    def email_notifier(self, storage, connection_manager, message_provider, sleeps):
+        return EmailNotifier(
+            storage,
+            lambda: connection_manager,
+            message_provider,
+            throttle_policy=DomainScheduler.Policy(max_deferrals=1),
+            utcnow=lambda: NOW,
+            clock=lambda: sum(sleeps),
+            sleep=sleeps.append,
+        )
+
+    def test_interleaves_deferred_recipients_with_other_domains(
+        self, email_notifier, storage, connection, feed_item, sleeps
+    ):
+        attempts = []
+
+        def send_message(message):
+            attempts.append(message["To"])
+            if (
+                message["To"] == "mail1@test.org"
+                and attempts.count("mail1@test.org") == 1
+            ):
+                raise SMTPSenderRefused(421, b"slow down", "sender@test.org")
+
+        connection.send_message.side_effect = send_message
+        email_notifier(feed_item)
+
+        assert attempts == [
+            "mail1@test.org",
+            "mail1@other.org",
+            "mail2@test.org",
+            "mail1@test.org",
+        ]
+        assert not storage.upsert_pending_delivery.called
+        assert not storage.add_failed_delivery.called
+
+    def test_reconnects_and_requeues_after_server_closes_connection(
+        self, storage, message_provider, feed_item, sleeps
+    ):
+        attempts: List[str] = []
+        connections: List[ClosingConnection] = []
+
+        @contextmanager
+        def connection_manager():
+            connections.append(ClosingConnection(attempts, Email("mail1@test.org")))
+            yield connections[-1]
+
+        email_notifier = EmailNotifier(
+            storage,
+            connection_manager,
+            message_provider,
+            throttle_policy=DomainScheduler.Policy(max_deferrals=1),
+            utcnow=lambda: NOW,
+            clock=lambda: sum(sleeps),
+            sleep=sleeps.append,
+        )
+        email_notifier(feed_item)
+
+        assert len(connections) == 2
+        assert attempts == [
+            "mail1@test.org",
+            "mail1@other.org",
+            "mail2@test.org",
+            "mail1@test.org",
+        ]
+        assert not storage.upsert_pending_delivery.called
+        assert not storage.add_failed_delivery.called
+
+    def test_queues_recipient_for_retry_after_max_deferrals(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 451)
+        email_notifier(feed_item)
+
+        assert [c.args[0]["To"] for c in connection.send_message.call_args_list] == [
+            "mail1@test.org",
+            "mail1@other.org",
+            "mail2@test.org",
+            "mail1@test.org",
+        ]
+        storage.upsert_pending_delivery.assert_called_once()
+        assert storage.upsert_pending_delivery.call_args.args[0].email == (
+            "mail1@test.org"
+        )
+
+    def test_does_not_retry_permanent_failures(
+        self, email_notifier, storage, connection, feed_item
+    ):
+        connection.send_message.side_effect = _refuse(Email("mail1@test.org"), 550)
+        email_notifier(feed_item)
+
+        assert connection.send_message.call_count == 3
+        storage.add_failed_delivery.assert_called_once()
+
+
+def test_reconnects_after_server_closes_connection(
+    storage, message_provider, feed_item
+):
+    attempts: List[str] = []
+    connections: List[ClosingConnection] = []
+
+    @contextmanager
+    def connection_manager():
+        connections.append(ClosingConnection(attempts, Email("mail1@test.org")))
+        yield connections[-1]
+
+    email_notifier = EmailNotifier(
+        storage, connection_manager, message_provider, utcnow=lambda: NOW
+    )
+    email_notifier(feed_item)
+
+    assert len(connections) == 2
+    assert attempts == ["mail1@test.org", "mail2@test.org"]
+    storage.upsert_pending_delivery.assert_called_once()
+    assert storage.upsert_pending_delivery.call_args.args[0].email == "mail1@test.org"
+
+
+def test_loads_subscribers_only_when_needed(email_notifier, storage):
+    email_notifier.retry_pending()
+    assert not storage.get_all_active_subscribers.called
@@ -12,6 +12,7 @@ from doveseed.email_templating import (
     RelatedPartInfo,
     _RelatedPartsCollector,
 )
+from doveseed.token_gen import UnsubscribeTokenSigner
 
 
 class MockTemplateLoader(BaseLoader):
@@ -327,6 +328,142 @@ class TestGetNewPostMsg:
             if part.get("Content-ID", None) == content_id
         ] == [binary_content]
 
+    def test_list_unsubscribe_headers(self, feed_item, settings):
+        settings.unsubscribe_url_format = (
+            "https://api.{host}/one-click-unsubscribe/{email}?token={token}"
+        )
+        signer = UnsubscribeTokenSigner(b"secret")
+        provider = EmailFromTemplateProvider(
+            settings=settings,
+            template_loader=MockTemplateLoader(
+                {
+                    "new-post.subject.txt": "subject",
+                    "new-post.txt": "",
+                    "new-post.html": "",
+                }
+            ),
+            binary_loader=MockBinaryLoader({}),
+            unsubscribe_signer=signer,
+        )
+        msg = provider.get_new_post_msg(feed_item, Email("to.email@test.org"))
+
+        unsubscribe_link = (
+            "https://api.test.local/one-click-unsubscribe/to.email%40test.org?token="
+            + quote(signer.sign(Email("to.email@test.org")).to_string())
+        )
+        assert msg["List-Unsubscribe"] == f"<{unsubscribe_link}>"
+        assert msg["List-Unsubscribe-Post"] == "List-Unsubscribe=One-Click"
+        assert f"List-Unsubscribe: <{unsubscribe_link}>" in msg.as_string()
+
+    def test_no_list_unsubscribe_headers_without_signer(self, feed_item, settings):
+        settings.unsubscribe_url_format = "https://{host}/{email}?token={token}"
+        provider = EmailFromTemplateProvider(
+            settings=settings,
+            template_loader=MockTemplateLoader(
+                {
+                    "new-post.subject.txt": "subject",
+                    "new-post.txt": "",
+                    "new-post.html": "",
+                }
+            ),
+            binary_loader=MockBinaryLoader({}),
+        )
+        msg = provider.get_new_post_msg(feed_item, Email("to.email@test.org"))
+
+        assert "List-Unsubscribe" not in msg
+        assert "List-Unsubscribe-Post" not in msg
+
+
+class TestGetNewPostsMsg:
+    def test_renders_posts_in_chronological_order(self, feed_item, settings):
+        later_item = FeedItem(
+            title="later title",
+            link="later link",
+            pub_date=datetime(2019, 11, 23),
+            description="later description",
+            image=None,
+        )
+        template = "{% for post in posts %}{{ post.title }};{% endfor %}"
+        provider = EmailFromTemplateProvider(
+            settings=settings,
+            template_loader=MockTemplateLoader(
+                {
+                    "new-posts.subject.txt": "{{ posts | length }} {{ to_email }}",
+                    "new-posts.txt": template,
+                    "new-posts.html": template,
+                }
+            ),
+            binary_loader=MockBinaryLoader({}),
+        )
+        msg = provider.get_new_posts_msg((later_item, feed_item), Email("email"))
+
+        assert msg["Subject"] == "2 email"
+        assert msg["To"] == "email"
+        assert (
+            msg.get_body("plain").get_content().strip()  # type: ignore
+            == "title;later title;"
+        )
+
+
+class TestPersonalization:
+    @staticmethod
+    def create_provider(settings, templates, **kwargs):
+        return EmailFromTemplateProvider(
+            settings=settings,
+            template_loader=MockTemplateLoader(
+                {
+                    "new-post.subject.txt": "{{ post.title }}",
+                    "new-post.txt": "{{ post.description }}",
+                    "new-post.html": "<p>{{ post.description }}</p>",
+                    **templates,
+                }
+            ),
+            binary_loader=MockBinaryLoader({}),
+            **kwargs,
+        )
+
+    def test_detects_shared_templates(self, feed_item, settings):
+        provider = self.create_provider(settings, {})
+        assert not provider.is_personalized([feed_item])
+
+    @pytest.mark.parametrize(
+        "templates",
+        (
+            {"new-post.html": "<a href='?email={{ to_email | urlquote }}'>x</a>"},
+            {
+                "new-post.txt": "{% include 'footer.txt' %}",
+                "footer.txt": "{{to_email}}",
+            },
+            {"new-post.txt": "{% include footer %}"},
+        ),
+    )
+    def test_detects_personalized_templates(self, templates, feed_item, settings):
+        provider = self.create_provider(settings, templates)
+        assert provider.is_personalized([feed_item])
+
+    def test_explicit_flag_overrides_detection(self, feed_item, settings):
+        provider = self.create_provider(
+            settings, {"new-post.txt": "{{ to_email }}"}, personalized=False
+        )
+        assert not provider.is_personalized([feed_item])
+
+    def test_list_unsubscribe_headers_are_personalized(self, feed_item, settings):
+        settings.unsubscribe_url_format = "https://{host}/{email}?token={token}"
+        provider = self.create_provider(
+            settings,
+            {},
+            unsubscribe_signer=UnsubscribeTokenSigner(b"secret"),
+            personalized=False,
+        )
+        assert provider.is_personalized([feed_item])
+
+    def test_shared_msg(self, feed_item, settings):
+        provider = self.create_provider(settings, {})
+        msg = provider.get_shared_msg([feed_item])
+
+        assert msg["To"] == "undisclosed-recipients:;"
+        assert msg["Subject"] == feed_item.title
+
 
 @pytest.mark.parametrize(
     "args,kwargs,expected",
@@ -1,15 +1,26 @@
+import gzip
+import io
+import socket
+import threading
 from datetime import datetime, timedelta, timezone, tzinfo
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
 from xml.etree import ElementTree
 
 import pytest
 
 from doveseed.domain_types import FeedItem
-from doveseed.feed import parse_rss
+from doveseed.feed import (
+    CacheValidators,
+    FeedNotModified,
+    get_feed,
+    iter_rss,
+    open_feed,
+    parse_rss,
+)
 
-sample_rss_feeds = [
-    (
-        ElementTree.fromstring(
-            """
+sample_rss_document = """
 <rss version="2.0" xmlns:atom="http://www.w3.org/2005/Atom" xmlns:og="http://ogp.me/ns#">
   <channel>
     <title>title</title>
@@ -30,7 +41,10 @@ sample_rss_feeds = [
   </channel>
 </rss>
 """
-        ),
+
+sample_rss_feeds = [
+    (
+        ElementTree.fromstring(sample_rss_document),
         [
             FeedItem(
                 title="Item title",
@@ -38,6 +52,7 @@ sample_rss_feeds = [
                 pub_date=datetime(2019, 10, 3, 20, 11, 47, tzinfo=timezone.utc),
                 description="description",
                 image="image",
+                guid="https://link.org/post/",
             )
         ],
     ),
@@ -74,6 +89,7 @@ sample_rss_feeds = [
                 ),
                 description="description",
                 image="image",
+                guid="https://link.org/post/",
             )
         ],
     ),
@@ -97,3 +113,187 @@ class TimezoneOffset(tzinfo):
 @pytest.mark.parametrize("rss,feed_items", sample_rss_feeds)
 def test_parse_rss(rss, feed_items):
     assert list(parse_rss(rss)) == feed_items
+
+
+@pytest.mark.parametrize("rss,feed_items", sample_rss_feeds)
+def test_iter_rss(rss, feed_items):
+    source = io.BytesIO(ElementTree.tostring(rss))
+    assert list(iter_rss(source)) == feed_items
+
+
+def rss_items(days: List[int]) -> str:
+    return "".join(
+        f"""
+    <item>
+      <title>Post {day}</title>
+      <link>https://link.org/post-{day}/</link>
+      <pubDate>{day:02} Oct 2019 12:00:00 GMT</pubDate>
+    </item>"""
+        for day in days
+    )
+
+
+def rss_feed_item(day: int) -> FeedItem:
+    return FeedItem(
+        title=f"Post {day}",
+        link=f"https://link.org/post-{day}/",
+        pub_date=datetime(2019, 10, day, 12, tzinfo=timezone.utc),
+        description="",
+        image=None,
+    )
+
+
+class TestIterRss:
+    seen_cutoff = datetime(2019, 10, 5, 12, tzinfo=timezone.utc)
+
+    @staticmethod
+    def is_seen(feed_item: FeedItem) -> bool:
+        return feed_item.pub_date <= TestIterRss.seen_cutoff
+
+    def test_stops_at_first_seen_item_of_reverse_chronological_feed(self):
+        truncated_document = (
+            "<rss><channel>" + rss_items([7, 6, 5, 4]) + "<item><title>broken"
+        )
+        items = list(
+            iter_rss(
+                io.BytesIO(truncated_document.encode()),
+                is_seen=self.is_seen,
+                seen_cutoff=self.seen_cutoff,
+            )
+        )
+        assert items == [rss_feed_item(day) for day in (7, 6, 5)]
+
+    @pytest.mark.parametrize(
+        "days",
+        [
+            pytest.param([6, 7, 5, 4], id="unordered"),
+            pytest.param([4, 5, 6, 7], id="oldest-first"),
+            pytest.param([1, 7, 6, 5, 4], id="pinned-old-item"),
+        ],
+    )
+    def test_reads_whole_feed_if_not_reverse_chronological(self, days):
+        document = "<rss><channel>" + rss_items(days) + "</channel></rss>"
+        items = list(
+            iter_rss(
+                io.BytesIO(document.encode()),
+                is_seen=self.is_seen,
+                seen_cutoff=self.seen_cutoff,
+            )
+        )
+        assert items == [rss_feed_item(day) for day in days]
+
+    def test_reads_seen_items_newer_than_cutoff(self):
+        document = "<rss><channel>" + rss_items([7, 6, 5, 4]) + "</channel></rss>"
+        items = list(
+            iter_rss(
+                io.BytesIO(document.encode()),
+                is_seen=lambda feed_item: feed_item.pub_date.day != 7,
+                seen_cutoff=self.seen_cutoff,
+            )
+        )
+        assert items == [rss_feed_item(day) for day in (7, 6, 5)]
+
+    def test_reads_whole_feed_without_seen_predicate(self):
+        document = "<rss><channel>" + rss_items([7, 6, 5, 4]) + "</channel></rss>"
+        items = list(iter_rss(io.BytesIO(document.encode())))
+        assert items == [rss_feed_item(day) for day in (7, 6, 5, 4)]
+
+    def test_skips_items_missing_required_elements_and_nested_items(self):
+        document = (
+            "<rss><channel>"
+            + "<item><title>no link</title></item>"
+            + "<other>"
+            + rss_items([3])
+            + "</other>"
+            + rss_items([7])
+            + "</channel></rss>"
+        )
+        items = list(iter_rss(io.BytesIO(document.encode())))
+        assert items == [rss_feed_item(7)]
+
+
+class FeedRequestHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    last_modified = "Thu, 03 Oct 2019 20:11:47 GMT"
+    requests: List[Dict[str, str]] = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+        if (
+            self.headers.get("If-None-Match") == self.etag
+            or self.headers.get("If-Modified-Since") == self.last_modified
+        ):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.end_headers()
+            return
+
+        body = sample_rss_document.encode("utf-8")
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/rss+xml")
+        self.send_header("ETag", self.etag)
+        self.send_header("Last-Modified", self.last_modified)
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def feed_url():
+    FeedRequestHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FeedRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/index.xml"
+    server.shutdown()
+    server.server_close()
+
+
+class TestOpenFeed:
+    def test_returns_decompressed_feed_and_validators(self, feed_url):
+        with open_feed(feed_url) as (stream, validators):
+            items = list(parse_rss(ElementTree.parse(stream).getroot()))
+
+        assert items == sample_rss_feeds[0][1]
+        assert validators == CacheValidators(
+            etag=FeedRequestHandler.etag,
+            last_modified=FeedRequestHandler.last_modified,
+        )
+        assert FeedRequestHandler.requests[0]["Accept-Encoding"] == "gzip"
+
+    @pytest.mark.parametrize(
+        "validators",
+        (
+            CacheValidators(etag=FeedRequestHandler.etag),
+            CacheValidators(last_modified=FeedRequestHandler.last_modified),
+        ),
+    )
+    def test_raises_not_modified_for_matching_validators(self, validators, feed_url):
+        with pytest.raises(FeedNotModified):
+            with open_feed(feed_url, validators=validators):
+                pass
+
+    def test_fetches_feed_for_outdated_validators(self, feed_url):
+        with open_feed(feed_url, validators=CacheValidators(etag='"v0"')) as (
+            stream,
+            _,
+        ):
+            assert len(list(parse_rss(ElementTree.parse(stream).getroot()))) == 1
+        assert FeedRequestHandler.requests[0]["If-None-Match"] == '"v0"'
+
+    def test_times_out_if_server_does_not_respond(self):
+        with socket.socket() as server:
+            server.bind(("127.0.0.1", 0))
+            server.listen()
+            url = f"http://127.0.0.1:{server.getsockname()[1]}/index.xml"
+            with pytest.raises(OSError):
+                with open_feed(url, timeout=0.1):
+                    pass
+
+    def test_get_feed(self, feed_url):
+        assert list(parse_rss(get_feed(feed_url))) == sample_rss_feeds[0][1]
@@ -0,0 +1,36 @@
+import fcntl
+
+import pytest
+
+from doveseed.locking import FileLock
+
+
+@pytest.fixture
+def lock_path(tmp_path):
+    return str(tmp_path / "db.json.lock")
+
+
+def test_file_lock_excludes_other_processes(lock_path):
+    with FileLock(lock_path):
+        with open(lock_path, "a", encoding="utf-8") as f:
+            with pytest.raises(BlockingIOError):
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_file_lock_is_reentrant_and_released(lock_path):
+    lock = FileLock(lock_path)
+    with lock:
+        with lock:
+            pass
+    with open(lock_path, "a", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+
+def test_file_lock_non_blocking_acquire_fails_if_held_by_other_process(lock_path):
+    lock = FileLock(lock_path)
+    with open(lock_path, "a", encoding="utf-8") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        assert not lock.acquire(blocking=False)
+        fcntl.flock(f, fcntl.LOCK_UN)
+    assert lock.acquire(blocking=False)
+    lock.release()
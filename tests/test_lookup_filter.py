@@ -0,0 +1,158 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import pytest
+from tinydb import TinyDB
+
+from doveseed.domain_types import Email, State
+from doveseed.locking import FileLock
+from doveseed.lookup_filter import BloomFilter, FilteredStorage
+from doveseed.registration import Registration, Transition
+from doveseed.storage import TinyDbStorage
+
+
+class InMemoryStorage:
+    def __init__(self):
+        self.data: Dict[Email, Registration] = {}
+        self.updates: List[Email] = []
+
+    def update(self, email: Email, transition: Transition) -> None:
+        self.updates.append(email)
+        updated = transition(self.data.get(email))
+        if updated is None:
+            self.data.pop(email, None)
+        else:
+            self.data[email] = updated
+
+    def emails(self):
+        return iter(self.data)
+
+    def clear_cache(self):
+        pass
+
+
+def registration(email: str) -> Registration:
+    return Registration(
+        email=Email(email), last_update=datetime(2019, 10, 25), state=State.subscribed
+    )
+
+
+class TestBloomFilter:
+    def test_contains_added_keys(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        keys = [f"user{i}@test.org" for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+        assert all(key in bloom_filter for key in keys)
+
+    def test_false_positive_rate(self):
+        bloom_filter = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            bloom_filter.add(f"user{i}@test.org")
+        false_positives = sum(
+            f"other{i}@test.org" in bloom_filter for i in range(10000)
+        )
+        assert false_positives < 300
+
+    def test_size_depends_on_capacity_and_false_positive_rate(self):
+        assert BloomFilter(100000, 0.01).size_bytes == pytest.approx(119814, abs=1)
+        assert BloomFilter(100000, 0.001).size_bytes > 119814
+
+
+def keep(registration: Optional[Registration]) -> Optional[Registration]:
+    return registration
+
+
+class TestFilteredStorage:
+    @pytest.fixture
+    def storage(self):
+        storage = InMemoryStorage()
+        storage.data[Email("known@test.org")] = registration("known@test.org")
+        return storage
+
+    @pytest.fixture
+    def version(self):
+        return [0]
+
+    @pytest.fixture
+    def filtered_storage(self, storage, version):
+        return FilteredStorage(
+            storage,
+            capacity=100,
+            false_positive_rate=0.01,
+            version=lambda: version[0],
+        )
+
+    def test_skips_storage_for_unknown_email_without_change(
+        self, filtered_storage, storage
+    ):
+        filtered_storage.update(Email("unknown@test.org"), keep)
+        assert storage.updates == []
+
+    def test_propagates_transition_errors_for_unknown_email(self, filtered_storage):
+        def reject(registration):
+            raise LookupError()
+
+        with pytest.raises(LookupError):
+            filtered_storage.update(Email("unknown@test.org"), reject)
+
+    def test_updates_known_email(self, filtered_storage, storage):
+        filtered_storage.update(Email("known@test.org"), keep)
+        assert storage.updates == [Email("known@test.org")]
+
+    def test_inserts_new_email_and_remembers_it(self, filtered_storage, storage):
+        filtered_storage.update(
+            Email("new@test.org"), lambda _: registration("new@test.org")
+        )
+        filtered_storage.update(Email("new@test.org"), keep)
+        assert storage.updates == [Email("new@test.org")] * 2
+        assert storage.data[Email("new@test.org")] == registration("new@test.org")
+
+    def test_rebuilds_after_changes_by_other_processes(
+        self, filtered_storage, storage, version
+    ):
+        storage.data[Email("other@test.org")] = registration("other@test.org")
+        version[0] += 1
+        filtered_storage.update(Email("other@test.org"), keep)
+        assert storage.updates == [Email("other@test.org")]
+
+    def test_does_not_rebuild_after_own_changes(
+        self, filtered_storage, storage, version
+    ):
+        original_update = storage.update
+
+        def update_with_version_change(email, transition):
+            original_update(email, transition)
+            version[0] += 1
+
+        storage.update = update_with_version_change
+        filtered_storage.update(
+            Email("new@test.org"), lambda _: registration("new@test.org")
+        )
+        storage.emails = lambda: pytest.fail("filter rebuilt")
+        filtered_storage.update(Email("unknown@test.org"), keep)
+
+
+def test_finds_registrations_of_other_processes_on_shared_file(tmp_path):
+    path = tmp_path / "db.json"
+    lock = FileLock(f"{path}.lock")
+    with TinyDB(path) as db, TinyDB(path) as other_db:
+        filtered_storage = FilteredStorage(
+            TinyDbStorage(db, lock=lock),
+            capacity=100,
+            false_positive_rate=0.01,
+            version=lambda: (path.stat().st_size, path.stat().st_mtime_ns),
+            lock=lock,
+        )
+        TinyDbStorage(other_db, lock=lock).update(
+            Email("other@test.org"), lambda _: registration("other@test.org")
+        )
+
+        found: List[Optional[Registration]] = []
+
+        def record(registration):
+            found.append(registration)
+            return registration
+
+        filtered_storage.update(Email("other@test.org"), record)
+        assert found[-1] == registration("other@test.org")
@@ -1,9 +1,11 @@
+from dataclasses import replace
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Mapping, Optional
 from unittest.mock import MagicMock
 
 import pytest
 
-from doveseed.notifier import FeedItem, NewPostNotifier
+from doveseed.notifier import FeedItem, NewPostNotifier, seen_item_key
 
 ReferenceDatetime = datetime(2019, 11, 22, tzinfo=timezone.utc)
 
@@ -32,13 +34,19 @@ NewestFeedItem = FeedItem(
 
 class InMemoryStorage:
     def __init__(self):
-        self.last_seen = ReferenceDatetime
+        self.last_seen: Optional[datetime] = None
+        self.seen_items: Optional[Dict[str, datetime]] = {
+            seen_item_key(OldFeedItem): ReferenceDatetime
+        }
 
-    def get_last_seen(self) -> datetime:
+    def get_last_seen(self) -> Optional[datetime]:
         return self.last_seen
 
-    def set_last_seen(self, value: datetime) -> None:
-        self.last_seen = value
+    def get_seen_items(self) -> Optional[Dict[str, datetime]]:
+        return None if self.seen_items is None else dict(self.seen_items)
+
+    def set_seen_items(self, seen_items: Mapping[str, datetime]) -> None:
+        self.seen_items = dict(seen_items)
 
 
 @pytest.fixture
@@ -53,15 +61,16 @@ def consumer():
 
 @pytest.fixture
 def new_post_notifier(storage, consumer):
-    return NewPostNotifier(storage, consumer)
+    return NewPostNotifier(storage, consumer, utcnow=lambda: ReferenceDatetime)
 
 
 class TestNewPostNotifier:
-    def test_stores_last_seen_date(self, storage, new_post_notifier):
+    def test_stores_seen_items(self, storage, new_post_notifier):
         new_post_notifier((OldFeedItem, NewestFeedItem))
-        assert storage.get_last_seen() == NewestFeedItem.pub_date.astimezone(
-            timezone.utc
-        )
+        assert storage.seen_items == {
+            seen_item_key(OldFeedItem): ReferenceDatetime,
+            seen_item_key(NewestFeedItem): ReferenceDatetime,
+        }
 
     def test_notifies_consumer_for_new_items(self, consumer, new_post_notifier):
         new_post_notifier((OldFeedItem, NewestFeedItem))
@@ -74,4 +83,124 @@ class TestNewPostNotifier:
 
     def test_handles_empty_feed(self, storage, new_post_notifier):
         new_post_notifier(tuple())
-        assert storage.get_last_seen() is not None
+        assert storage.seen_items == {seen_item_key(OldFeedItem): ReferenceDatetime}
+
+    def test_ignores_edited_pub_date_of_seen_item(self, consumer, new_post_notifier):
+        new_post_notifier(
+            (replace(OldFeedItem, pub_date=ReferenceDatetime + timedelta(days=3)),)
+        )
+        assert not consumer.called
+
+    def test_identifies_items_by_guid(self, storage, consumer, new_post_notifier):
+        item = replace(NewFeedItem, guid="guid")
+        storage.seen_items = {seen_item_key(item): ReferenceDatetime}
+        new_post_notifier((replace(item, link="changed link"),))
+        assert not consumer.called
+
+    def test_is_seen(self, new_post_notifier):
+        assert new_post_notifier.is_seen(OldFeedItem)
+        assert not new_post_notifier.is_seen(NewFeedItem)
+
+    def test_seen_cutoff_falls_back_to_last_seen(self, storage, consumer):
+        storage.seen_items = None
+        storage.last_seen = ReferenceDatetime
+        notifier = NewPostNotifier(storage, consumer, utcnow=lambda: ReferenceDatetime)
+        assert notifier.seen_cutoff == ReferenceDatetime
+
+    def test_bootstraps_seen_items_from_last_seen(self, storage, consumer):
+        storage.seen_items = None
+        storage.last_seen = ReferenceDatetime
+        notifier = NewPostNotifier(storage, consumer, utcnow=lambda: ReferenceDatetime)
+        notifier((OldFeedItem, NewFeedItem))
+        consumer.assert_called_once_with(NewFeedItem)
+
+    def test_considers_items_older_than_max_age_seen(self, storage, consumer):
+        storage.seen_items = {}
+        notifier = NewPostNotifier(
+            storage,
+            consumer,
+            seen_items_policy=NewPostNotifier.SeenItemsPolicy(max_age_days=1),
+            utcnow=lambda: ReferenceDatetime + timedelta(hours=36),
+        )
+        notifier((OldFeedItem, NewFeedItem))
+        consumer.assert_called_once_with(NewFeedItem)
+
+    def test_evicts_old_seen_items(self, storage, consumer):
+        storage.seen_items = {
+            "expired": ReferenceDatetime - timedelta(days=2),
+            "oldest": ReferenceDatetime - timedelta(hours=3),
+            "older": ReferenceDatetime - timedelta(hours=2),
+            "recent": ReferenceDatetime - timedelta(hours=1),
+        }
+        notifier = NewPostNotifier(
+            storage,
+            consumer,
+            seen_items_policy=NewPostNotifier.SeenItemsPolicy(
+                max_age_days=1, max_entries=3
+            ),
+            utcnow=lambda: ReferenceDatetime,
+        )
+        notifier((NewFeedItem,))
+        assert storage.seen_items == {
+            "older": ReferenceDatetime - timedelta(hours=2),
+            "recent": ReferenceDatetime - timedelta(hours=1),
+            seen_item_key(NewFeedItem): ReferenceDatetime,
+        }
+
+
+class TestNewPostNotifierDigest:
+    @pytest.fixture
+    def digest_consumer(self):
+        return MagicMock()
+
+    def test_coalesces_new_posts_into_digest(self, storage, consumer, digest_consumer):
+        notifier = NewPostNotifier(
+            storage,
+            consumer,
+            digest_consumer=digest_consumer,
+            utcnow=lambda: ReferenceDatetime,
+        )
+        notifier((NewestFeedItem, OldFeedItem, NewFeedItem))
+        digest_consumer.assert_called_once_with([NewFeedItem, NewestFeedItem])
+        assert not consumer.called
+
+    def test_sends_individual_notifications_below_threshold(
+        self, storage, consumer, digest_consumer
+    ):
+        notifier = NewPostNotifier(
+            storage,
+            consumer,
+            digest_consumer=digest_consumer,
+            digest_policy=NewPostNotifier.DigestPolicy(threshold=3),
+            utcnow=lambda: ReferenceDatetime,
+        )
+        notifier((NewestFeedItem, OldFeedItem, NewFeedItem))
+        assert not digest_consumer.called
+        assert [c.args[0] for c in consumer.call_args_list] == [
+            NewFeedItem,
+            NewestFeedItem,
+        ]
+
+    def test_groups_posts_by_time_window(self, storage, consumer, digest_consumer):
+        close_to_newest = FeedItem(
+            title="Close to newest item",
+            link="close link",
+            pub_date=NewestFeedItem.pub_date + timedelta(hours=1),
+            description="description",
+            image=None,
+        )
+        notifier = NewPostNotifier(
+            storage,
+            consumer,
+            digest_consumer=digest_consumer,
+            digest_policy=NewPostNotifier.DigestPolicy(window_minutes=120),
+            utcnow=lambda: ReferenceDatetime,
+        )
+        notifier((NewFeedItem, NewestFeedItem, close_to_newest))
+        consumer.assert_called_once_with(NewFeedItem)
+        digest_consumer.assert_called_once_with([NewestFeedItem, close_to_newest])
+
+
+def test_digest_policy_requires_threshold_of_at_least_two():
+    with pytest.raises(ValueError):
+        NewPostNotifier.DigestPolicy(threshold=1)
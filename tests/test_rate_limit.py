@@ -0,0 +1,100 @@
+import pytest
+
+from doveseed.rate_limit import (
+    MemoryBucketStore,
+    RateLimiter,
+    RateLimitExceeded,
+    SqliteBucketStore,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SqliteBucketStore(str(tmp_path / "rate_limit.sqlite"))
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def rate_limiter(store, clock):
+    return RateLimiter(
+        store,
+        per_ip=RateLimiter.Rate(capacity=3, refill_per_hour=60),
+        per_email=RateLimiter.Rate(capacity=2, refill_per_hour=6),
+        clock=clock,
+    )
+
+
+class TestRateLimiter:
+    def test_allows_burst_up_to_capacity(self, rate_limiter):
+        for _ in range(2):
+            rate_limiter.acquire(ip="192.0.2.1", email="foo@test.org")
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            rate_limiter.acquire(ip="192.0.2.1", email="foo@test.org")
+        assert exc_info.value.retry_after_seconds == pytest.approx(600)
+
+    def test_normalizes_email_addresses(self, rate_limiter):
+        rate_limiter.acquire(ip="192.0.2.1", email="foo@test.org")
+        rate_limiter.acquire(ip="192.0.2.2", email=" Foo@Test.org")
+        with pytest.raises(RateLimitExceeded):
+            rate_limiter.acquire(ip="192.0.2.3", email="FOO@test.org")
+
+    def test_limits_per_ip(self, rate_limiter):
+        for i in range(3):
+            rate_limiter.acquire(ip="192.0.2.1", email=f"foo{i}@test.org")
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            rate_limiter.acquire(ip="192.0.2.1", email="bar@test.org")
+        assert exc_info.value.retry_after_seconds == pytest.approx(60)
+        rate_limiter.acquire(ip="192.0.2.2", email="bar@test.org")
+
+    def test_refills_tokens_over_time(self, rate_limiter, clock):
+        for _ in range(2):
+            rate_limiter.acquire(ip=None, email="foo@test.org")
+        clock.now += 300
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            rate_limiter.acquire(ip=None, email="foo@test.org")
+        assert exc_info.value.retry_after_seconds == pytest.approx(300)
+        clock.now += 300
+        rate_limiter.acquire(ip=None, email="foo@test.org")
+
+
+class TestMemoryBucketStore:
+    def test_evicts_least_recently_used_buckets(self):
+        store = MemoryBucketStore(max_entries=2)
+        for key in ("a", "b", "a", "c"):
+            store.take(key, capacity=1, refill_per_second=0.001, now=0)
+        assert store.take("a", capacity=1, refill_per_second=0.001, now=0) > 0
+        assert store.take("b", capacity=1, refill_per_second=0.001, now=0) == 0
+
+
+class TestSqliteBucketStore:
+    def test_shares_buckets_between_instances(self, tmp_path):
+        path = str(tmp_path / "rate_limit.sqlite")
+        SqliteBucketStore(path).take("a", capacity=1, refill_per_second=0.001, now=0)
+        assert (
+            SqliteBucketStore(path).take(
+                "a", capacity=1, refill_per_second=0.001, now=0
+            )
+            > 0
+        )
+
+    def test_prunes_least_recently_used_buckets(self, tmp_path):
+        store = SqliteBucketStore(str(tmp_path / "rate_limit.sqlite"), max_entries=2)
+        store.PRUNE_INTERVAL = 4
+        for now, key in enumerate(("a", "b", "c", "d")):
+            store.take(key, capacity=1, refill_per_second=0.001, now=now)
+        assert store.take("a", capacity=1, refill_per_second=0.001, now=4) == 0
+        assert store.take("d", capacity=1, refill_per_second=0.001, now=4) > 0
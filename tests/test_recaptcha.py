@@ -0,0 +1,302 @@
+import asyncio
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs
+
+import pytest
+from fastapi import FastAPI, Request, status
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from doveseed.recaptcha import ReCaptchaMiddleware
+
+
+class VerifyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: List[Dict[str, List[str]]] = []
+    client_ports: List[int] = []
+
+    def do_POST(self):
+        form = parse_qs(
+            self.rfile.read(int(self.headers["Content-Length"])).decode("utf-8")
+        )
+        self.requests.append(form)
+        self.client_ports.append(self.client_address[1])
+        if form["response"] == ["valid-captcha"]:
+            result = {"success": True, "hostname": "doveseed.local"}
+        else:
+            result = {"success": False, "error-codes": ["invalid-input-response"]}
+        body = json.dumps(result).encode("utf-8")
+        self.send_response(status.HTTP_200_OK)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def verify_url():
+    VerifyRequestHandler.requests = []
+    VerifyRequestHandler.client_ports = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), VerifyRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/siteverify"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def recaptcha_config(tmp_path, verify_url):
+    config_path = tmp_path / "recaptcha.json"
+    config_path.write_text(
+        json.dumps(
+            {
+                "hostnames": ["doveseed.local"],
+                "secret": "recaptcha-secret",
+                "verify_url": verify_url,
+                "trusted_proxies": ["10.0.0.0/8"],
+            }
+        )
+    )
+    return str(config_path)
+
+
+@pytest.fixture
+def client(recaptcha_config):
+    app = FastAPI()
+
+    @app.post("/subscribe/{email}")
+    async def subscribe(email: str, request: Request):
+        return {"email": email, "body": await request.json()}
+
+    @app.post("/unsubscribe/{email}")
+    async def unsubscribe(email: str):
+        return {"email": email}
+
+    @app.get("/subscribe/{email}")
+    async def get_subscribe(email: str):
+        return {"email": email}
+
+    app.add_middleware(
+        ReCaptchaMiddleware,
+        paths="^/(un)?subscribe/.*",
+        config_path=recaptcha_config,
+    )
+    with TestClient(app, client=("127.0.0.1", 50000)) as client:
+        yield client
+
+
+class TestReCaptchaMiddleware:
+    def test_passes_verified_request_with_body_to_app(self, client):
+        response = client.post(
+            "/subscribe/foo@test.org", json={"captcha": "valid-captcha"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json() == {
+            "email": "foo@test.org",
+            "body": {"captcha": "valid-captcha"},
+        }
+        assert VerifyRequestHandler.requests[0]["secret"] == ["recaptcha-secret"]
+        assert VerifyRequestHandler.requests[0]["response"] == ["valid-captcha"]
+        assert VerifyRequestHandler.requests[0]["remoteip"] == ["127.0.0.1"]
+
+    def test_rejects_invalid_captcha(self, client):
+        response = client.post(
+            "/subscribe/foo@test.org", json={"captcha": "invalid-captcha"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+
+    @pytest.mark.parametrize("content", (b"{}", b"not json", b""))
+    def test_rejects_missing_captcha(self, content, client):
+        response = client.post("/subscribe/foo@test.org", content=content)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert len(VerifyRequestHandler.requests) == 0
+
+    def test_ignores_other_requests(self, client):
+        response = client.get("/subscribe/foo@test.org")
+        assert response.status_code == status.HTTP_200_OK
+        assert len(VerifyRequestHandler.requests) == 0
+
+    def test_rejects_replayed_invalid_captcha_without_verification(self, client):
+        for _ in range(2):
+            response = client.post(
+                "/subscribe/foo@test.org", json={"captcha": "invalid-captcha"}
+            )
+            assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert len(VerifyRequestHandler.requests) == 1
+
+    def test_accepts_replayed_valid_captcha_for_same_path_only(self, client):
+        for _ in range(2):
+            response = client.post(
+                "/subscribe/foo@test.org", json={"captcha": "valid-captcha"}
+            )
+            assert response.status_code == status.HTTP_200_OK
+        response = client.post(
+            "/unsubscribe/foo@test.org", json={"captcha": "valid-captcha"}
+        )
+        assert response.status_code == status.HTTP_401_UNAUTHORIZED
+        assert len(VerifyRequestHandler.requests) == 1
+
+    def test_reuses_connection_for_verifications(self, client):
+        for i in range(3):
+            client.post("/subscribe/foo@test.org", json={"captcha": f"captcha-{i}"})
+        assert len(VerifyRequestHandler.client_ports) == 3
+        assert len(set(VerifyRequestHandler.client_ports)) == 1
+
+
+def http_scope(client_host, headers=()):
+    return {
+        "type": "http",
+        "client": (client_host, 50000),
+        "headers": [(name.lower(), value) for name, value in headers],
+    }
+
+
+class TestGetRemoteIp:
+    @pytest.fixture
+    def middleware(self, recaptcha_config):
+        return ReCaptchaMiddleware(
+            FastAPI(), paths="^/subscribe/", config_path=recaptcha_config
+        )
+
+    @pytest.fixture
+    def getaddrinfo_calls(self, monkeypatch):
+        calls: List[str] = []
+        slow_host_released = threading.Event()
+
+        def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+            calls.append(host)
+            if host == "slow.local":
+                assert slow_host_released.wait(timeout=5)
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("192.0.2.1", 0))]
+
+        monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+        return calls, slow_host_released
+
+    def test_uses_client_address(self, middleware, getaddrinfo_calls):
+        remote_ip = asyncio.run(middleware.get_remote_ip(http_scope("203.0.113.7")))
+        assert remote_ip == "203.0.113.7"
+        assert getaddrinfo_calls[0] == []
+
+    def test_ignores_forwarded_for_from_untrusted_client(self, middleware):
+        scope = http_scope("203.0.113.7", [(b"X-Forwarded-For", b"198.51.100.1")])
+        assert asyncio.run(middleware.get_remote_ip(scope)) == "203.0.113.7"
+
+    def test_uses_forwarded_for_from_trusted_proxy(self, middleware):
+        scope = http_scope(
+            "10.0.0.1",
+            [(b"X-Forwarded-For", b"198.51.100.1, 203.0.113.7, 10.0.0.2")],
+        )
+        assert asyncio.run(middleware.get_remote_ip(scope)) == "203.0.113.7"
+
+    def test_resolves_and_caches_host_names(self, middleware, getaddrinfo_calls):
+        async def resolve_twice():
+            return [
+                await middleware.get_remote_ip(http_scope("fast.local"))
+                for _ in range(2)
+            ]
+
+        assert asyncio.run(resolve_twice()) == ["192.0.2.1", "192.0.2.1"]
+        assert getaddrinfo_calls[0] == ["fast.local"]
+
+    def test_slow_resolution_does_not_block_other_requests(
+        self, middleware, getaddrinfo_calls
+    ):
+        _, slow_host_released = getaddrinfo_calls
+
+        async def resolve_concurrently():
+            slow = asyncio.create_task(
+                middleware.get_remote_ip(http_scope("slow.local"))
+            )
+            await asyncio.sleep(0)
+            fast = await asyncio.wait_for(
+                middleware.get_remote_ip(http_scope("fast.local")), timeout=2
+            )
+            assert not slow.done()
+            slow_host_released.set()
+            return fast, await slow
+
+        assert asyncio.run(resolve_concurrently()) == ("192.0.2.1", "192.0.2.1")
+
+
+class TestVerificationLimit:
+    @pytest.fixture
+    def middleware(self, tmp_path):
+        config_path = tmp_path / "recaptcha.json"
+        config_path.write_text(
+            json.dumps(
+                {
+                    "hostnames": ["doveseed.local"],
+                    "secret": "recaptcha-secret",
+                    "max_concurrent_verifications": 1,
+                    "max_waiting_verifications": 1,
+                    "retry_after_seconds": 7,
+                }
+            )
+        )
+
+        async def app(scope, receive, send):
+            await PlainTextResponse("subscribed")(scope, receive, send)
+
+        return ReCaptchaMiddleware(
+            app, paths="^/subscribe/", config_path=str(config_path)
+        )
+
+    @staticmethod
+    async def post(middleware, captcha):
+        messages: List[dict] = []
+        body = json.dumps({"captcha": captcha}).encode("utf-8")
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        await middleware(
+            {
+                "type": "http",
+                "method": "POST",
+                "path": "/subscribe/foo@test.org",
+                "client": ("127.0.0.1", 50000),
+                "headers": [],
+            },
+            receive,
+            send,
+        )
+        return messages[0]
+
+    def test_sheds_load_when_too_many_verifications_wait(self, middleware):
+        released = asyncio.Event()
+
+        async def verify_captcha(captcha, remote_ip):
+            await released.wait()
+            return False
+
+        middleware.verify_captcha = verify_captcha
+
+        async def post_concurrently():
+            pending = [
+                asyncio.create_task(self.post(middleware, f"captcha-{i}"))
+                for i in range(2)
+            ]
+            await asyncio.sleep(0.01)
+            rejected = await asyncio.wait_for(
+                self.post(middleware, "captcha-2"), timeout=2
+            )
+            released.set()
+            return rejected, await asyncio.gather(*pending)
+
+        rejected, completed = asyncio.run(post_concurrently())
+        assert rejected["status"] == status.HTTP_503_SERVICE_UNAVAILABLE
+        assert (b"retry-after", b"7") in rejected["headers"]
+        assert [start["status"] for start in completed] == [
+            status.HTTP_401_UNAUTHORIZED
+        ] * 2
@@ -1,15 +1,20 @@
+from dataclasses import replace
 from datetime import datetime, timedelta
+from smtplib import SMTPException
 from typing import Dict, List, Optional
 from unittest.mock import MagicMock
 
 import pytest
 
+from doveseed.deadline import Deadline, DeadlineExceeded
 from doveseed.domain_types import Action, Email, State, Token
 from doveseed.registration import (
     Registration,
     RegistrationService,
+    Transition,
     UnauthorizedException,
 )
+from doveseed.token_gen import TokenSigner, UnsubscribeTokenSigner
 
 
 class InMemoryStorage:
@@ -27,6 +32,16 @@ class InMemoryStorage:
     def delete(self, email: Email) -> None:
         del self.data[email]
 
+    def update(self, email: Email, transition: Transition) -> None:
+        current = self.data.get(email)
+        updated = transition(replace(current) if current is not None else None)
+        if updated == current:
+            return
+        if updated is None:
+            self.delete(email)
+        else:
+            self.upsert(updated)
+
 
 class MockTokenGenerator:
     def __init__(self):
@@ -104,6 +119,7 @@ class TestRegistrationServiceSubscribe:
             given_email,
             action=Action.subscribe,
             confirm_token=token_generator.generated_tokens[0],
+            deadline=None,
         )
 
     def test_if_subscription_is_pending_bumps_last_update(
@@ -156,6 +172,7 @@ class TestRegistrationServiceSubscribe:
             given_email,
             action=Action.subscribe,
             confirm_token=token_generator.generated_tokens[0],
+            deadline=None,
         )
 
     @pytest.mark.parametrize("state", (State.subscribed, State.pending_unsubscribe))
@@ -277,6 +294,7 @@ class TestRegistrationServiceUnsubscribe:
             given_email,
             action=Action.unsubscribe,
             confirm_token=token_generator.generated_tokens[0],
+            deadline=None,
         )
 
     def test_fails_when_trying_to_unsubscribe_multiple_email_addresses(
@@ -384,3 +402,364 @@ class TestRegistrationServiceConfirm:
 
         with pytest.raises(UnauthorizedException):
             registration_service.confirm(given_email, None)
+
+
+class TestRegistrationServiceResendWindow:
+    @pytest.fixture
+    def clock(self):
+        return [NOW]
+
+    @pytest.fixture
+    def registration_service(
+        self, storage, confirmation_requester, token_generator, clock
+    ):
+        return RegistrationService(
+            storage=storage,
+            confirmation_requester=confirmation_requester,
+            token_generator=token_generator,
+            utcnow=lambda: clock[0],
+            resend_window=timedelta(minutes=1),
+        )
+
+    def test_acknowledges_repeated_subscribe_without_storage_access(
+        self, registration_service, storage, confirmation_requester
+    ):
+        given_email = Email("new@test.org")
+        registration_service.subscribe(given_email)
+        storage.update = MagicMock(side_effect=AssertionError("storage accessed"))
+
+        registration_service.subscribe(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 1
+
+    def test_acknowledges_repeated_unsubscribe_without_storage_access(
+        self, registration_service, storage, confirmation_requester
+    ):
+        given_email = Email("subscribed@test.org")
+        storage.upsert(
+            Registration(
+                email=given_email,
+                state=State.subscribed,
+                last_update=NOW - timedelta(days=1),
+            )
+        )
+        registration_service.unsubscribe(given_email)
+        storage.update = MagicMock(side_effect=AssertionError("storage accessed"))
+
+        registration_service.unsubscribe(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 1
+
+    def test_resends_after_resend_window(
+        self, registration_service, storage, confirmation_requester, clock
+    ):
+        given_email = Email("new@test.org")
+        registration_service.subscribe(given_email)
+        clock[0] = NOW + timedelta(minutes=1)
+
+        registration_service.subscribe(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 2
+        stored = storage.find(given_email)
+        assert stored is not None
+        assert stored.last_update == NOW + timedelta(minutes=1)
+
+    def test_resends_for_recently_updated_pending_registration(
+        self, registration_service, storage, confirmation_requester, token_generator
+    ):
+        given_email = Email("pending@test.org")
+        storage.upsert(
+            Registration(
+                email=given_email,
+                state=State.pending_subscribe,
+                last_update=NOW - timedelta(seconds=30),
+                confirm_token=next(token_generator),
+                confirm_action=Action.subscribe,
+            )
+        )
+
+        registration_service.subscribe(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 1
+
+    @pytest.mark.parametrize("action", ("subscribe", "unsubscribe"))
+    def test_does_not_coalesce_after_failed_send(
+        self, action, registration_service, storage, confirmation_requester
+    ):
+        given_email = Email("subscribed@test.org")
+        if action == "unsubscribe":
+            storage.upsert(
+                Registration(
+                    email=given_email,
+                    state=State.subscribed,
+                    last_update=NOW - timedelta(days=1),
+                )
+            )
+        confirmation_requester.request_confirmation.side_effect = [
+            SMTPException("failed"),
+            None,
+        ]
+
+        with pytest.raises(SMTPException):
+            getattr(registration_service, action)(given_email)
+        getattr(registration_service, action)(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 2
+
+    def test_does_not_coalesce_different_actions(
+        self, registration_service, storage, confirmation_requester
+    ):
+        given_email = Email("new@test.org")
+        registration_service.subscribe(given_email)
+        registration_service.confirm(
+            given_email,
+            confirmation_requester.request_confirmation.call_args[1]["confirm_token"],
+        )
+
+        registration_service.unsubscribe(given_email)
+        registration_service.confirm(
+            given_email,
+            confirmation_requester.request_confirmation.call_args[1]["confirm_token"],
+        )
+        registration_service.subscribe(given_email)
+
+        assert confirmation_requester.request_confirmation.call_count == 3
+        stored = storage.find(given_email)
+        assert stored is not None
+        assert stored.state == State.pending_subscribe
+
+
+class TestRegistrationServiceSignedTokens:
+    @pytest.fixture
+    def token_signer(self):
+        return TokenSigner(b"secret", max_age=timedelta(hours=1))
+
+    @pytest.fixture
+    def registration_service(
+        self, storage, confirmation_requester, token_generator, utcnow, token_signer
+    ):
+        return RegistrationService(
+            storage=storage,
+            confirmation_requester=confirmation_requester,
+            token_generator=token_generator,
+            utcnow=utcnow,
+            token_signer=token_signer,
+        )
+
+    @staticmethod
+    def sent_token(confirmation_requester) -> Token:
+        return confirmation_requester.request_confirmation.call_args[1]["confirm_token"]
+
+    def test_subscribe_sends_signed_token_without_storing_it(
+        self, registration_service, storage, confirmation_requester, token_signer
+    ):
+        given_email = Email("new@test.org")
+        registration_service.subscribe(given_email)
+
+        stored = storage.find(given_email)
+        assert stored is not None
+        assert stored.confirm_token is None
+        assert (
+            token_signer.verify(
+                given_email, self.sent_token(confirmation_requester), NOW
+            )
+            == Action.subscribe
+        )
+
+    @pytest.mark.parametrize("action", (Action.subscribe, Action.unsubscribe))
+    def test_confirm_with_signed_token(
+        self,
+        action,
+        registration_service,
+        storage,
+        confirmation_requester,
+    ):
+        given_email = Email("new@test.org")
+        if action == Action.subscribe:
+            registration_service.subscribe(given_email)
+        else:
+            storage.upsert(
+                Registration(
+                    email=given_email,
+                    state=State.subscribed,
+                    last_update=NOW - timedelta(days=1),
+                )
+            )
+            registration_service.unsubscribe(given_email)
+
+        registration_service.confirm(
+            given_email, self.sent_token(confirmation_requester)
+        )
+
+        stored = storage.find(given_email)
+        if action == Action.subscribe:
+            assert stored is not None
+            assert stored.state == State.subscribed
+        else:
+            assert stored is None
+
+    @pytest.mark.parametrize(
+        "token",
+        (
+            TokenSigner(b"other secret", max_age=timedelta(hours=1)).sign(
+                Email("pending@test.org"), Action.subscribe, NOW
+            ),
+            TokenSigner(b"secret", max_age=timedelta(hours=1)).sign(
+                Email("other@test.org"), Action.subscribe, NOW
+            ),
+            TokenSigner(b"secret", max_age=timedelta(hours=1)).sign(
+                Email("pending@test.org"),
+                Action.subscribe,
+                NOW - timedelta(hours=1, seconds=1),
+            ),
+        ),
+    )
+    def test_rejects_invalid_signed_token_without_storage_access(
+        self, token, registration_service, storage
+    ):
+        storage.update = MagicMock(side_effect=AssertionError("storage accessed"))
+        with pytest.raises(UnauthorizedException):
+            registration_service.confirm(Email("pending@test.org"), token)
+
+    def test_rejects_signed_token_for_other_action(
+        self, registration_service, storage, token_signer
+    ):
+        given_email = Email("subscribed@test.org")
+        storage.upsert(
+            Registration(
+                email=given_email,
+                state=State.pending_unsubscribe,
+                last_update=NOW,
+                confirm_action=Action.unsubscribe,
+            )
+        )
+        with pytest.raises(UnauthorizedException):
+            registration_service.confirm(
+                given_email, token_signer.sign(given_email, Action.subscribe, NOW)
+            )
+
+    def test_accepts_stored_random_tokens(self, registration_service, storage):
+        given_email = Email("pending@test.org")
+        given_token = Token(b"token")
+        storage.upsert(
+            Registration(
+                email=given_email,
+                state=State.pending_subscribe,
+                last_update=NOW - timedelta(days=1),
+                confirm_token=given_token,
+                confirm_action=Action.subscribe,
+            )
+        )
+
+        registration_service.confirm(given_email, given_token)
+
+        stored = storage.find(given_email)
+        assert stored is not None
+        assert stored.state == State.subscribed
+
+    def test_rejects_missing_token_for_registration_without_stored_token(
+        self, registration_service, storage
+    ):
+        given_email = Email("pending@test.org")
+        storage.upsert(
+            Registration(
+                email=given_email,
+                state=State.pending_subscribe,
+                last_update=NOW,
+                confirm_action=Action.subscribe,
+            )
+        )
+        with pytest.raises(UnauthorizedException):
+            registration_service.confirm(given_email, None)
+
+
+class TestRegistrationServiceOneClickUnsubscribe:
+    @pytest.fixture
+    def unsubscribe_signer(self):
+        return UnsubscribeTokenSigner(b"secret")
+
+    @pytest.fixture
+    def registration_service(
+        self,
+        storage,
+        confirmation_requester,
+        token_generator,
+        utcnow,
+        unsubscribe_signer,
+    ):
+        return RegistrationService(
+            storage=storage,
+            confirmation_requester=confirmation_requester,
+            token_generator=token_generator,
+            utcnow=utcnow,
+            unsubscribe_signer=unsubscribe_signer,
+        )
+
+    @pytest.mark.parametrize("state", (State.subscribed, State.pending_unsubscribe))
+    def test_removes_subscription_without_confirmation(
+        self,
+        state,
+        registration_service,
+        storage,
+        confirmation_requester,
+        unsubscribe_signer,
+    ):
+        given_email = Email("subscribed@test.org")
+        storage.upsert(Registration(email=given_email, state=state, last_update=NOW))
+
+        registration_service.unsubscribe_one_click(
+            given_email, unsubscribe_signer.sign(given_email)
+        )
+
+        assert storage.find(given_email) is None
+        assert not confirmation_requester.request_confirmation.called
+
+    def test_rejects_token_of_other_email(
+        self, registration_service, storage, unsubscribe_signer
+    ):
+        storage.update = MagicMock(side_effect=AssertionError("storage accessed"))
+        with pytest.raises(UnauthorizedException):
+            registration_service.unsubscribe_one_click(
+                Email("subscribed@test.org"),
+                unsubscribe_signer.sign(Email("other@test.org")),
+            )
+
+    def test_rejects_tokens_without_signer(self, storage, confirmation_requester):
+        registration_service = RegistrationService(
+            storage=storage,
+            confirmation_requester=confirmation_requester,
+            token_generator=MockTokenGenerator(),
+            utcnow=lambda: NOW,
+        )
+        with pytest.raises(UnauthorizedException):
+            registration_service.unsubscribe_one_click(
+                Email("subscribed@test.org"),
+                UnsubscribeTokenSigner(b"secret").sign(Email("subscribed@test.org")),
+            )
+
+
+class TestRegistrationServiceDeadline:
+    def test_passes_deadline_to_confirmation_requester(
+        self, registration_service, confirmation_requester, token_generator
+    ):
+        given_email = Email("new@test.org")
+        deadline = Deadline(10)
+        registration_service.subscribe(given_email, deadline=deadline)
+
+        confirmation_requester.request_confirmation.assert_called_with(
+            given_email,
+            action=Action.subscribe,
+            confirm_token=token_generator.generated_tokens[0],
+            deadline=deadline,
+        )
+
+    @pytest.mark.parametrize("action", ("subscribe", "unsubscribe"))
+    def test_fails_fast_if_deadline_expired(
+        self, action, registration_service, storage, confirmation_requester
+    ):
+        storage.update = MagicMock(side_effect=AssertionError("storage accessed"))
+        with pytest.raises(DeadlineExceeded):
+            getattr(registration_service, action)(
+                Email("new@test.org"), deadline=Deadline(0)
+            )
+        assert not confirmation_requester.request_confirmation.called
@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from doveseed.domain_types import Email, State
+from doveseed.registration import Registration
+from doveseed.sharding import Shard, ShardedStorage
+from doveseed.storage import TinyDbStorage
+
+ReferenceDatetime = datetime(2019, 11, 22, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def tiny_db_storage():
+    return TinyDbStorage(TinyDB(storage=MemoryStorage))
+
+
+class TestShard:
+    def test_from_string(self):
+        assert Shard.from_string("1/4") == Shard(index=1, count=4)
+
+    @pytest.mark.parametrize("value", ("4/4", "-1/4", "0/0", "1", "a/b"))
+    def test_from_string_rejects_invalid_values(self, value):
+        with pytest.raises(ValueError):
+            Shard.from_string(value)
+
+    def test_str(self):
+        assert str(Shard(index=1, count=4)) == "1/4"
+
+    def test_shards_partition_emails(self):
+        emails = [Email(f"mail{i}@test.org") for i in range(100)]
+        shards = [Shard(index=i, count=3) for i in range(3)]
+        assignments = [
+            [shard for shard in shards if shard.contains(email)] for email in emails
+        ]
+        assert all(len(assigned) == 1 for assigned in assignments)
+        assert all(
+            any(shard in assigned for assigned in assignments) for shard in shards
+        )
+
+    def test_contains_ignores_case(self):
+        shard = next(
+            s
+            for s in (Shard(index=i, count=4) for i in range(4))
+            if s.contains(Email("mail@test.org"))
+        )
+        assert shard.contains(Email("MAIL@test.org"))
+
+
+class TestShardedStorage:
+    def test_filters_active_subscribers(self, tiny_db_storage):
+        for i in range(20):
+            tiny_db_storage.upsert(
+                Registration(
+                    email=Email(f"mail{i}@test.org"),
+                    last_update=datetime(2019, 10, 25, 13, 37),
+                    state=State.subscribed,
+                )
+            )
+        shard = Shard(index=0, count=2)
+        subscribers = list(
+            ShardedStorage(tiny_db_storage, shard).get_all_active_subscribers()
+        )
+        assert len(subscribers) > 0
+        assert all(shard.contains(s.email) for s in subscribers)
+
+    def test_scopes_seen_items_to_shard(self, tiny_db_storage):
+        first = ShardedStorage(tiny_db_storage, Shard(index=0, count=2))
+        second = ShardedStorage(tiny_db_storage, Shard(index=1, count=2))
+
+        first.set_seen_items({"item": ReferenceDatetime})
+
+        assert first.get_seen_items() == {"item": ReferenceDatetime}
+        assert second.get_seen_items() is None
+        assert tiny_db_storage.get_seen_items() is None
+
+    def test_get_last_seen_returns_global_value(self, tiny_db_storage):
+        tiny_db_storage.set_last_seen(ReferenceDatetime)
+
+        sharded = ShardedStorage(tiny_db_storage, Shard(index=0, count=2))
+        assert sharded.get_last_seen() == ReferenceDatetime
@@ -0,0 +1,204 @@
+import threading
+from contextlib import contextmanager
+from email.message import EmailMessage
+from smtplib import SMTPServerDisconnected
+from typing import List, Optional
+from unittest.mock import MagicMock
+
+import pytest
+
+from doveseed import smtp as smtp_module
+from doveseed.deadline import Deadline, DeadlineExceeded
+from doveseed.smtp import (
+    PersistentConnectionManager,
+    _EstablishedSmtpConnection,
+    smtp_connection,
+)
+
+
+class FakeConnector:
+    def __init__(self):
+        self.connections: List[MagicMock] = []
+        self.closed: List[MagicMock] = []
+        self.deadlines: List[Optional[Deadline]] = []
+
+    @contextmanager
+    def __call__(self, deadline=None):
+        smtp = MagicMock()
+        smtp.timeout = 30
+        smtp.noop.return_value = (250, b"OK")
+        self.deadlines.append(deadline)
+        self.connections.append(smtp)
+        try:
+            yield smtp
+        finally:
+            self.closed.append(smtp)
+
+
+@pytest.fixture
+def connector():
+    return FakeConnector()
+
+
+class TestPersistentConnectionManager:
+    def test_reuses_connection(self, connector):
+        manager = PersistentConnectionManager(connector)
+        message = EmailMessage()
+        with manager() as connection:
+            connection.send_message(message)
+        with manager() as connection:
+            connection.send_message(message)
+
+        assert len(connector.connections) == 1
+        assert connector.connections[0].send_message.call_count == 2
+        assert connector.closed == []
+
+    def test_reconnects_if_connection_went_stale(self, connector):
+        manager = PersistentConnectionManager(connector)
+        with manager():
+            pass
+        connector.connections[0].noop.side_effect = SMTPServerDisconnected()
+        with manager():
+            pass
+
+        assert len(connector.connections) == 2
+        assert connector.closed == [connector.connections[0]]
+
+    def test_reconnects_after_disconnect(self, connector):
+        manager = PersistentConnectionManager(connector)
+        with pytest.raises(SMTPServerDisconnected):
+            with manager():
+                raise SMTPServerDisconnected()
+        with manager():
+            pass
+
+        assert len(connector.connections) == 2
+
+    def test_bounds_timeout_of_reused_connection_by_deadline(self, connector):
+        manager = PersistentConnectionManager(connector)
+        with manager():
+            pass
+        with manager(deadline=Deadline(5)):
+            pass
+        with manager():
+            pass
+
+        timeouts = [
+            call.args[0] for call in connector.connections[0].sock.settimeout.mock_calls
+        ]
+        assert len(connector.connections) == 1
+        assert 4 < timeouts[0] <= 5
+        assert timeouts[1] == 30
+
+    def test_passes_deadline_when_connecting(self, connector):
+        manager = PersistentConnectionManager(connector)
+        deadline = Deadline(5)
+        with manager(deadline=deadline):
+            pass
+
+        assert connector.deadlines == [deadline]
+
+    @staticmethod
+    def run_concurrently(task):
+        thread = threading.Thread(target=task, daemon=True)
+        thread.start()
+        thread.join(timeout=5)
+        assert not thread.is_alive()
+
+    def test_shares_connection_between_concurrent_users(self, connector):
+        manager = PersistentConnectionManager(connector)
+        message = EmailMessage()
+
+        def send():
+            with manager() as connection:
+                connection.send_message(message)
+
+        with manager() as connection:
+            self.run_concurrently(send)
+            connection.send_message(message)
+
+        assert len(connector.connections) == 1
+        assert connector.connections[0].send_message.call_count == 2
+
+    def test_keeps_connection_reestablished_by_other_user(self, connector):
+        manager = PersistentConnectionManager(connector)
+
+        def reconnect():
+            with manager():
+                pass
+
+        with pytest.raises(SMTPServerDisconnected):
+            with manager():
+                connector.connections[0].noop.side_effect = SMTPServerDisconnected()
+                self.run_concurrently(reconnect)
+                raise SMTPServerDisconnected()
+        with manager():
+            pass
+
+        assert len(connector.connections) == 2
+        assert connector.closed == [connector.connections[0]]
+
+    def test_close(self, connector):
+        manager = PersistentConnectionManager(connector)
+        with manager():
+            pass
+        manager.close()
+
+        assert connector.closed == connector.connections
+
+
+@pytest.mark.parametrize(
+    "features,expected",
+    (
+        ({}, None),
+        ({"limits": "MAILMAX=10 RCPTMAX=50"}, 50),
+        ({"limits": "RCPTMAX=invalid"}, None),
+    ),
+)
+def test_max_recipients_from_limits_extension(features, expected):
+    smtp = MagicMock()
+    smtp.esmtp_features = features
+    assert _EstablishedSmtpConnection(smtp).max_recipients == expected
+
+
+def test_smtp_connection_applies_timeouts(monkeypatch):
+    smtp = MagicMock()
+    smtp_class = MagicMock()
+    smtp_class.return_value.__enter__.return_value = smtp
+    monkeypatch.setattr(smtp_module, "SMTP", smtp_class)
+    connection_manager = smtp_connection(
+        host="localhost",
+        user="user",
+        password="password",
+        ssl_mode="no-ssl",
+        connect_timeout_seconds=5,
+        command_timeout_seconds=20,
+    )
+
+    with connection_manager():
+        pass
+
+    smtp_class.assert_called_once_with("localhost", 0, timeout=5)
+    assert smtp.timeout == 20
+    smtp.sock.settimeout.assert_called_once_with(20)
+
+
+def test_smtp_connection_fails_fast_after_deadline(monkeypatch):
+    smtp_class = MagicMock()
+    monkeypatch.setattr(smtp_module, "SMTP", smtp_class)
+    connection_manager = smtp_connection(host="localhost", user="user", password="")
+
+    with pytest.raises(DeadlineExceeded):
+        with connection_manager(deadline=Deadline(0)):
+            pass
+
+    assert not smtp_class.called
+
+
+def test_send_message_bounds_timeout_by_deadline():
+    smtp = MagicMock()
+    smtp.timeout = 30
+    _EstablishedSmtpConnection(smtp, deadline=Deadline(5)).send_message(EmailMessage())
+
+    (timeout,) = smtp.sock.settimeout.call_args.args
+    assert 4 < timeout <= 5
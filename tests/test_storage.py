@@ -1,11 +1,18 @@
 from datetime import datetime, timedelta, timezone
+from smtplib import SMTPResponseException
+from unittest.mock import MagicMock
 
 import pytest
 from tinydb import Query, TinyDB
 from tinydb.storages import MemoryStorage
 
-from doveseed.domain_types import Action, Email, State, Token
+from doveseed.bounces import Suppression
+from doveseed.domain_types import Action, Email, FeedItem, State, Token
+from doveseed.email_notification import EmailNotifier, FailedDelivery, PendingDelivery
+from doveseed.feed import CacheValidators
+from doveseed.locking import FileLock
 from doveseed.registration import Registration
+from doveseed.sharding import Shard
 from doveseed.storage import TinyDbStorage
 
 
@@ -100,6 +107,134 @@ class TestTinyDbStorage:
         tiny_db_storage.delete(Email("mail@test.org"))
         assert tiny_db.get(Query().email == "mail@test.org") is None
 
+    def test_update_inserts_new_entity(self, tiny_db_storage):
+        registration = Registration(
+            email=Email("mail@test.org"),
+            last_update=datetime(2019, 10, 25, 13, 37),
+            state=State.pending_subscribe,
+            confirm_action=Action.subscribe,
+        )
+
+        tiny_db_storage.update(Email("mail@test.org"), lambda current: registration)
+
+        assert tiny_db_storage.find(Email("mail@test.org")) == registration
+
+    def test_update_modifies_existing_entity(self, tiny_db, tiny_db_storage):
+        tiny_db_storage.upsert(
+            Registration(
+                email=Email("mail@test.org"),
+                last_update=datetime(2019, 10, 25, 13, 37),
+                state=State.pending_subscribe,
+                confirm_action=Action.subscribe,
+            )
+        )
+
+        def confirm(current):
+            current.state = State.subscribed
+            current.confirm_action = None
+            return current
+
+        tiny_db_storage.update(Email("mail@test.org"), confirm)
+
+        assert len(tiny_db) == 1
+        assert tiny_db_storage.find(Email("mail@test.org")) == Registration(
+            email=Email("mail@test.org"),
+            last_update=datetime(2019, 10, 25, 13, 37),
+            state=State.subscribed,
+        )
+
+    def test_update_deletes_entity(self, tiny_db, tiny_db_storage):
+        tiny_db_storage.upsert(
+            Registration(
+                email=Email("mail@test.org"),
+                last_update=datetime(2019, 10, 25, 13, 37),
+                state=State.subscribed,
+            )
+        )
+
+        tiny_db_storage.update(Email("mail@test.org"), lambda current: None)
+
+        assert tiny_db.get(Query().email == "mail@test.org") is None
+
+    def test_update_without_change_does_not_write(self, tiny_db, tiny_db_storage):
+        tiny_db_storage.upsert(
+            Registration(
+                email=Email("mail@test.org"),
+                last_update=datetime(2019, 10, 25, 13, 37),
+                state=State.subscribed,
+            )
+        )
+        writes = []
+        original_write = tiny_db.storage.write
+
+        def write(data):
+            writes.append(data)
+            original_write(data)
+
+        tiny_db.storage.write = write
+
+        tiny_db_storage.update(Email("mail@test.org"), lambda current: current)
+        tiny_db_storage.update(Email("unknown@test.org"), lambda current: current)
+
+        assert writes == []
+
+    def test_apply_changes_in_single_write_per_kind(self, tiny_db, tiny_db_storage):
+        for email in ("keep@test.org", "change@test.org", "delete@test.org"):
+            tiny_db_storage.upsert(
+                Registration(
+                    email=Email(email),
+                    last_update=datetime(2019, 10, 25, 13, 37),
+                    state=State.subscribed,
+                )
+            )
+        changed = Registration(
+            email=Email("change@test.org"),
+            last_update=datetime(2019, 10, 26, 13, 37),
+            state=State.pending_subscribe,
+            confirm_action=Action.subscribe,
+            confirm_token=Token(b"token"),
+        )
+        added = [
+            Registration(
+                email=Email(f"new{i}@test.org"),
+                last_update=datetime(2019, 10, 26, 13, 37),
+                state=State.subscribed,
+            )
+            for i in range(10)
+        ]
+        writes = []
+        original_write = tiny_db.storage.write
+
+        def write(data):
+            writes.append(data)
+            original_write(data)
+
+        tiny_db.storage.write = write
+
+        tiny_db_storage.apply_changes(
+            upserts=[changed] + added, deletes=[Email("delete@test.org")]
+        )
+
+        assert len(writes) == 3
+        assert tiny_db_storage.find(Email("change@test.org")) == changed
+        assert tiny_db_storage.find(Email("delete@test.org")) is None
+        assert sorted(tiny_db_storage.emails()) == sorted(
+            ["keep@test.org", "change@test.org"] + [r.email for r in added]
+        )
+
+    def test_emails(self, tiny_db_storage):
+        for email in ("mail@test.org", "mail2@test.org"):
+            tiny_db_storage.upsert(
+                Registration(
+                    email=Email(email),
+                    last_update=datetime(2019, 10, 25, 13, 37),
+                    state=State.subscribed,
+                )
+            )
+        tiny_db_storage.set_last_seen(datetime(2019, 10, 25, tzinfo=timezone.utc))
+
+        assert list(tiny_db_storage.emails()) == ["mail@test.org", "mail2@test.org"]
+
     @pytest.mark.parametrize(
         "instance",
         (
@@ -213,3 +348,255 @@ class TestTinyDbStorage:
         result = tiny_db_storage.get_all_active_subscribers()
 
         assert tuple(sorted(result, key=lambda r: r.email)) == active
+
+    def test_get_all_active_subscribers_skips_suppressed(self, tiny_db_storage):
+        for email, last_update in (
+            ("bounced@test.org", datetime(2019, 10, 1)),
+            ("reconfirmed@test.org", datetime(2019, 10, 26)),
+        ):
+            tiny_db_storage.upsert(
+                Registration(
+                    email=Email(email), last_update=last_update, state=State.subscribed
+                )
+            )
+        tiny_db_storage.upsert_suppressions(
+            [
+                Suppression(
+                    email=Email(email),
+                    bounces=1,
+                    last_bounce=datetime(2019, 10, 25, 13, 37),
+                )
+                for email in ("bounced@test.org", "reconfirmed@test.org")
+            ]
+        )
+
+        assert [
+            subscriber.email
+            for subscriber in tiny_db_storage.get_all_active_subscribers()
+        ] == ["reconfirmed@test.org"]
+
+    def test_pending_delivery_roundtrip(self, tiny_db_storage):
+        feed_item = FeedItem(
+            title="title",
+            link="https://link.org/post/",
+            pub_date=datetime(2019, 10, 3, 20, 11, 47, tzinfo=timezone.utc),
+            description="description",
+            image=None,
+        )
+        due = PendingDelivery(
+            email=Email("mail1@test.org"),
+            feed_items=[feed_item],
+            attempts=1,
+            next_attempt=datetime(2019, 10, 25, 13, 37),
+            last_error="error",
+        )
+        not_due = PendingDelivery(
+            email=Email("mail2@test.org"),
+            feed_items=[feed_item],
+            attempts=1,
+            next_attempt=datetime(2019, 10, 25, 13, 39),
+            last_error="error",
+        )
+        tiny_db_storage.upsert_pending_delivery(due)
+        tiny_db_storage.upsert_pending_delivery(not_due)
+
+        now = datetime(2019, 10, 25, 13, 38)
+        assert list(tiny_db_storage.get_due_deliveries(now)) == [due]
+
+        due.attempts = 2
+        tiny_db_storage.upsert_pending_delivery(due)
+        assert list(tiny_db_storage.get_due_deliveries(now)) == [due]
+
+        tiny_db_storage.delete_pending_delivery(due.email, [feed_item])
+        assert list(tiny_db_storage.get_due_deliveries(now)) == []
+
+    def test_pending_deliveries_do_not_show_up_as_registrations(self, tiny_db_storage):
+        tiny_db_storage.upsert_pending_delivery(
+            PendingDelivery(
+                email=Email("mail1@test.org"),
+                feed_items=[
+                    FeedItem(
+                        title="title",
+                        link="link",
+                        pub_date=datetime(2019, 10, 3, tzinfo=timezone.utc),
+                        description="description",
+                        image=None,
+                    )
+                ],
+                attempts=1,
+                next_attempt=datetime(2019, 10, 25, 13, 37),
+                last_error="error",
+            )
+        )
+        assert list(tiny_db_storage.all()) == []
+
+    def test_failed_delivery_roundtrip(self, tiny_db_storage):
+        failure = FailedDelivery(
+            email=Email("mail1@test.org"),
+            feed_items=[
+                FeedItem(
+                    title="title",
+                    link="link",
+                    pub_date=datetime(2019, 10, 3, tzinfo=timezone.utc),
+                    description="description",
+                    image="image",
+                ),
+                FeedItem(
+                    title="title 2",
+                    link="link 2",
+                    pub_date=datetime(2019, 10, 4, tzinfo=timezone.utc),
+                    description="description 2",
+                    image=None,
+                ),
+            ],
+            attempts=1,
+            failed_at=datetime(2019, 10, 25, 13, 37),
+            error="550 no such user",
+        )
+        tiny_db_storage.add_failed_delivery(failure)
+        assert list(tiny_db_storage.get_failed_deliveries()) == [failure]
+
+    def test_get_unset_feed_validators(self, tiny_db_storage):
+        assert tiny_db_storage.get_feed_validators() is None
+
+    def test_feed_validators_storage(self, tiny_db_storage):
+        validators = CacheValidators(
+            etag='"v1"', last_modified="Thu, 03 Oct 2019 20:11:47 GMT"
+        )
+        tiny_db_storage.set_feed_validators(validators)
+        tiny_db_storage.set_feed_validators(
+            CacheValidators(etag='"v0"'), Shard(index=0, count=2)
+        )
+        assert tiny_db_storage.get_feed_validators() == validators
+        assert tiny_db_storage.get_feed_validators(
+            Shard(index=0, count=2)
+        ) == CacheValidators(etag='"v0"')
+        assert tiny_db_storage.get_feed_validators(Shard(index=1, count=2)) is None
+        assert tiny_db_storage.get_last_seen() is None
+
+    def test_get_unset_seen_items(self, tiny_db_storage):
+        assert tiny_db_storage.get_seen_items() is None
+
+    def test_seen_items_storage(self, tiny_db_storage):
+        seen_items = {"a1b2": datetime(2019, 10, 25, 13, 37, tzinfo=timezone.utc)}
+        tiny_db_storage.set_seen_items(seen_items)
+        tiny_db_storage.set_seen_items({}, Shard(index=0, count=2))
+        assert tiny_db_storage.get_seen_items() == seen_items
+        assert tiny_db_storage.get_seen_items(Shard(index=0, count=2)) == {}
+        assert tiny_db_storage.get_seen_items(Shard(index=1, count=2)) is None
+
+
+class TestTinyDbStorageOnSharedFile:
+    @pytest.fixture
+    def storages(self, tmp_path):
+        path = tmp_path / "db.json"
+        lock = FileLock(f"{path}.lock")
+        dbs = [TinyDB(path), TinyDB(path)]
+        yield [TinyDbStorage(db, lock=lock) for db in dbs]
+        for db in dbs:
+            db.close()
+
+    def test_inserts_of_other_storages_do_not_collide(self, storages):
+        failures = [
+            FailedDelivery(
+                email=Email(f"mail{i}@test.org"),
+                feed_items=[],
+                attempts=1,
+                failed_at=datetime(2019, 10, 25, 13, 37),
+                error="550 no such user",
+            )
+            for i in range(4)
+        ]
+        for i, failure in enumerate(failures):
+            storages[i % 2].add_failed_delivery(failure)
+        for i in range(4):
+            storages[i % 2].insert_multiple(
+                [
+                    Registration(
+                        email=Email(f"new{i}@test.org"),
+                        last_update=datetime(2019, 10, 25, 13, 37),
+                        state=State.subscribed,
+                    )
+                ]
+            )
+
+        assert list(storages[0].get_failed_deliveries()) == failures
+        assert sorted(storages[1].emails()) == [f"new{i}@test.org" for i in range(4)]
+
+
+class TestTinyDbStorageAcrossPolls:
+    def test_repeated_retries_on_the_same_storage(self, tiny_db_storage):
+        feed_item = FeedItem(
+            title="title",
+            link="https://link.org/post/",
+            pub_date=datetime(2019, 10, 3, 20, 11, 47, tzinfo=timezone.utc),
+            description="description",
+            image=None,
+        )
+        tiny_db_storage.upsert(
+            Registration(
+                email=Email("mail@test.org"),
+                last_update=datetime(2019, 10, 1),
+                state=State.subscribed,
+            )
+        )
+        tiny_db_storage.upsert_pending_delivery(
+            PendingDelivery(
+                email=Email("mail@test.org"),
+                feed_items=[feed_item],
+                attempts=1,
+                next_attempt=datetime(2019, 10, 25, 13, 37),
+                last_error="error",
+            )
+        )
+        connection = MagicMock()
+        connection.send_message.side_effect = SMTPResponseException(451, b"later")
+        connection_manager = MagicMock()
+        connection_manager.__enter__.return_value = connection
+        email_notifier = EmailNotifier(
+            tiny_db_storage,
+            lambda: connection_manager,
+            MagicMock(),
+            retry_policy=EmailNotifier.RetryPolicy(base_delay_minutes=0),
+            utcnow=lambda: datetime(2019, 10, 25, 13, 38),
+        )
+
+        for _ in range(2):
+            email_notifier.retry_pending()
+
+        assert connection.send_message.call_count == 2
+        assert [
+            delivery.attempts
+            for delivery in tiny_db_storage.get_due_deliveries(
+                datetime(2019, 10, 25, 13, 38)
+            )
+        ] == [3]
+
+    def test_repeated_reads_return_equal_results(self, tiny_db_storage):
+        registration = Registration(
+            email=Email("mail@test.org"),
+            last_update=datetime(2019, 10, 1),
+            state=State.subscribed,
+        )
+        tiny_db_storage.upsert(registration)
+
+        for _ in range(2):
+            assert list(tiny_db_storage.all()) == [registration]
+            assert tiny_db_storage.find(registration.email) == registration
+            assert list(tiny_db_storage.get_all_active_subscribers()) == [registration]
+
+    def test_clear_cache_picks_up_changes_of_other_processes(self, tmp_path):
+        path = tmp_path / "db.json"
+        with TinyDB(path) as db, TinyDB(path) as other_db:
+            storage = TinyDbStorage(db)
+            assert list(storage.emails()) == []
+            TinyDbStorage(other_db).upsert(
+                Registration(
+                    email=Email("mail@test.org"),
+                    last_update=datetime(2019, 10, 1),
+                    state=State.subscribed,
+                )
+            )
+
+            storage.clear_cache()
+            assert list(storage.emails()) == ["mail@test.org"]
@@ -0,0 +1,126 @@
+import pytest
+
+from doveseed.throttle import DomainScheduler, email_domain
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def create_scheduler(clock, **kwargs):
+    return DomainScheduler(
+        DomainScheduler.Policy(**kwargs), clock=clock, sleep=clock.sleep
+    )
+
+
+def test_email_domain():
+    assert email_domain("John.Doe@Example.ORG") == "example.org"
+
+
+def test_interleaves_domains(clock):
+    scheduler = create_scheduler(clock)
+    for item in ("a1", "a2", "a3"):
+        scheduler.add("a.org", item)
+    for item in ("b1", "b2"):
+        scheduler.add("b.org", item)
+    scheduler.add("c.org", "c1")
+
+    items = []
+    for _, item in scheduler:
+        items.append(item)
+        scheduler.succeed()
+
+    assert items == ["a1", "b1", "c1", "a2", "b2", "a3"]
+    assert clock.sleeps == []
+
+
+def test_limits_rate_per_domain_after_burst(clock):
+    scheduler = create_scheduler(
+        clock, initial_rate_per_second=2, burst=2, additive_increase=0
+    )
+    for i in range(4):
+        scheduler.add("a.org", f"a{i}")
+
+    sent_at = []
+    for _ in scheduler:
+        sent_at.append(clock.now)
+        scheduler.succeed()
+
+    assert sent_at == [1000.0, 1000.0, 1000.5, 1001.0]
+
+
+def test_decreases_rate_on_deferral_and_requeues(clock):
+    scheduler = create_scheduler(
+        clock,
+        initial_rate_per_second=2,
+        burst=1,
+        multiplicative_decrease=0.5,
+        additive_increase=0,
+    )
+    scheduler.add("a.org", "a1")
+    scheduler.add("a.org", "a2")
+    scheduler.add("b.org", "b1")
+
+    deliveries = []
+    deferred = False
+    for domain, item in scheduler:
+        deliveries.append((item, clock.now))
+        if item == "a1" and not deferred:
+            deferred = scheduler.defer(item)
+        else:
+            scheduler.succeed()
+
+    assert deferred
+    assert deliveries == [
+        ("a1", 1000.0),
+        ("b1", 1000.0),
+        ("a2", 1001.0),
+        ("a1", 1002.0),
+    ]
+
+
+def test_gives_up_after_max_deferrals(clock):
+    scheduler = create_scheduler(clock, max_deferrals=2)
+    scheduler.add("a.org", "a1")
+
+    results = []
+    for _ in scheduler:
+        results.append(scheduler.defer("a1"))
+
+    assert results == [True, True, False]
+
+
+def test_rate_stays_within_bounds(clock):
+    scheduler = create_scheduler(
+        clock,
+        initial_rate_per_second=1,
+        min_rate_per_second=0.5,
+        burst=1,
+        max_deferrals=5,
+    )
+    scheduler.add("a.org", "a1")
+
+    for _ in scheduler:
+        scheduler.defer("a1")
+
+    assert clock.sleeps == [2.0] * 5
+
+
+def test_requires_delivery_in_progress(clock):
+    scheduler = create_scheduler(clock)
+    with pytest.raises(RuntimeError):
+        scheduler.succeed()